@@ -1,14 +1,31 @@
+import os
 import sqlite3
+import sys
 
-conn = sqlite3.connect("database.db")
-c = conn.cursor()
+from migrations import migrate
+from passwords import ScryptHasher
 
-c.execute("""
-INSERT INTO users (name, email, password, role, status)
-VALUES ('Admin', 'admin@gmail.com', 'admin123', 'admin', 'approved')
-""")
+# Creates the admin account, or resets its password if it already exists.
+#   python add_admin.py [email] [password]
 
-conn.commit()
-conn.close()
+def add_admin(email='admin@event.com', password='admin123', db_path=None):
+    db_path = db_path or os.environ.get('DATABASE', 'database.db')
+    migrate(db_path)
 
-print("Admin created!")
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('''
+            INSERT INTO Admin (email, password) VALUES (?, ?)
+            ON CONFLICT (email) DO UPDATE SET password = excluded.password
+        ''', (email, ScryptHasher().hash(password)))
+        conn.commit()
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    email = sys.argv[1] if len(sys.argv) > 1 else 'admin@event.com'
+    password = sys.argv[2] if len(sys.argv) > 2 else 'admin123'
+    add_admin(email, password)
+    print("Admin added successfully!")
+    print("Email: %s" % email)
+    print("Password: %s" % password)
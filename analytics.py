@@ -0,0 +1,207 @@
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+from archive import OrderArchive
+from db import transaction
+from migrations import SALES_ROLLUPS
+
+# Sales analytics for the vendor and admin dashboards. The daily rollup
+# tables (see migrations.sales_rollups) are kept current by triggers on
+# Order_Items and Orders in the same transaction as checkout and status
+# updates, so these queries read at most one row per day, status and key in
+# the requested range and never scan the orders themselves. A status change
+# can leave all-zero rows behind under the old status; they are skipped.
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+TOP_LIMIT = 10
+
+VENDOR_DAILY_SQL = '''
+    SELECT day, SUM(quantity) as quantity, SUM(revenue) as revenue, SUM(order_count) as order_count
+    FROM Sales_Daily_Vendor
+    WHERE vendor_id = ? AND day BETWEEN ? AND ? AND %s
+    GROUP BY day
+'''
+
+VENDOR_STATUS_SQL = '''
+    SELECT status, SUM(quantity) as quantity, SUM(revenue) as revenue, SUM(order_count) as order_count
+    FROM Sales_Daily_Vendor
+    WHERE vendor_id = ? AND day BETWEEN ? AND ?
+    GROUP BY status
+    HAVING SUM(quantity) > 0
+'''
+
+VENDOR_TOP_SERVICES_SQL = '''
+    SELECT r.service_id, s.name, SUM(r.quantity) as quantity, SUM(r.revenue) as revenue,
+           SUM(r.order_count) as order_count
+    FROM Sales_Daily_Service r
+    LEFT JOIN Services s ON s.service_id = r.service_id
+    WHERE r.vendor_id = ? AND r.day BETWEEN ? AND ? AND %s
+    GROUP BY r.service_id
+    HAVING SUM(r.quantity) > 0
+    ORDER BY revenue DESC, r.service_id
+    LIMIT ?
+'''
+
+# Across vendors an order holding items of two vendors counts once for each,
+# the same way each vendor's dashboard counts it
+ADMIN_DAILY_SQL = '''
+    SELECT day, SUM(quantity) as quantity, SUM(revenue) as revenue, SUM(order_count) as order_count
+    FROM Sales_Daily_Vendor
+    WHERE day BETWEEN ? AND ? AND %s
+    GROUP BY day
+'''
+
+ADMIN_STATUS_SQL = '''
+    SELECT status, SUM(quantity) as quantity, SUM(revenue) as revenue, SUM(order_count) as order_count
+    FROM Sales_Daily_Vendor
+    WHERE day BETWEEN ? AND ?
+    GROUP BY status
+    HAVING SUM(quantity) > 0
+'''
+
+ADMIN_CATEGORIES_SQL = '''
+    SELECT category, SUM(quantity) as quantity, SUM(revenue) as revenue, SUM(order_count) as order_count
+    FROM Sales_Daily_Category
+    WHERE day BETWEEN ? AND ? AND %s
+    GROUP BY category
+    HAVING SUM(quantity) > 0
+    ORDER BY revenue DESC, category
+'''
+
+ADMIN_TOP_VENDORS_SQL = '''
+    SELECT r.vendor_id, v.name, SUM(r.quantity) as quantity, SUM(r.revenue) as revenue,
+           SUM(r.order_count) as order_count
+    FROM Sales_Daily_Vendor r
+    LEFT JOIN Vendors v ON v.vendor_id = r.vendor_id
+    WHERE r.day BETWEEN ? AND ? AND %s
+    GROUP BY r.vendor_id
+    HAVING SUM(r.quantity) > 0
+    ORDER BY revenue DESC, r.vendor_id
+    LIMIT ?
+'''
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def parse_range(args, today=None):
+    # from/to are inclusive calendar dates (YYYY-MM-DD); without them the
+    # last DEFAULT_DAYS days up to today
+    today = today or date.today()
+    try:
+        end = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else today
+        start = (datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from')
+                 else end - timedelta(days=DEFAULT_DAYS - 1))
+    except ValueError:
+        raise AnalyticsError('Dates must be given as YYYY-MM-DD')
+    if start > end:
+        raise AnalyticsError('from must not be after to')
+    if (end - start).days >= MAX_DAYS:
+        raise AnalyticsError('At most %d days can be requested at once' % MAX_DAYS)
+    return start, end
+
+def status_filter(args, column='status'):
+    if args.get('status'):
+        return '%s = ?' % column, [args['status']]
+    return '1', []
+
+def totals(row):
+    return {'quantity': row['quantity'] or 0, 'revenue': round(row['revenue'] or 0, 2),
+            'order_count': row['order_count'] or 0}
+
+def daily_series(rows, start, end):
+    # One entry per day of the range, zero-filled, oldest first
+    by_day = {row['day']: totals(row) for row in rows}
+    series = []
+    day = start
+    while day <= end:
+        key = day.isoformat()
+        series.append(dict({'day': key}, **by_day.get(key, {'quantity': 0, 'revenue': 0, 'order_count': 0})))
+        day += timedelta(days=1)
+    return series
+
+def summarize(daily):
+    return {'quantity': sum(d['quantity'] for d in daily),
+            'revenue': round(sum(d['revenue'] for d in daily), 2),
+            'order_count': sum(d['order_count'] for d in daily)}
+
+def vendor_summary(conn, vendor_id, args, limit=TOP_LIMIT):
+    start, end = parse_range(args)
+    bounds = (start.isoformat(), end.isoformat())
+    clause, params = status_filter(args)
+    daily = daily_series(conn.execute(VENDOR_DAILY_SQL % clause, (vendor_id,) + bounds + tuple(params)),
+                         start, end)
+    by_status = {row['status']: totals(row) for row in conn.execute(VENDOR_STATUS_SQL, (vendor_id,) + bounds)}
+    clause, params = status_filter(args, 'r.status')
+    top_services = [dict({'service_id': row['service_id'], 'name': row['name']}, **totals(row))
+                    for row in conn.execute(VENDOR_TOP_SERVICES_SQL % clause,
+                                            (vendor_id,) + bounds + tuple(params) + (limit,))]
+    return {'vendor_id': vendor_id, 'from': bounds[0], 'to': bounds[1], 'status': args.get('status'),
+            'totals': summarize(daily), 'by_status': by_status, 'daily': daily,
+            'top_services': top_services}
+
+def admin_summary(conn, args, limit=TOP_LIMIT):
+    start, end = parse_range(args)
+    bounds = (start.isoformat(), end.isoformat())
+    clause, params = status_filter(args)
+    daily = daily_series(conn.execute(ADMIN_DAILY_SQL % clause, bounds + tuple(params)), start, end)
+    by_status = {row['status']: totals(row) for row in conn.execute(ADMIN_STATUS_SQL, bounds)}
+    by_category = [dict({'category': row['category']}, **totals(row))
+                   for row in conn.execute(ADMIN_CATEGORIES_SQL % clause, bounds + tuple(params))]
+    clause, params = status_filter(args, 'r.status')
+    top_vendors = [dict({'vendor_id': row['vendor_id'], 'name': row['name']}, **totals(row))
+                   for row in conn.execute(ADMIN_TOP_VENDORS_SQL % clause, bounds + tuple(params) + (limit,))]
+    return {'from': bounds[0], 'to': bounds[1], 'status': args.get('status'),
+            'totals': summarize(daily), 'by_status': by_status, 'daily': daily,
+            'by_category': by_category, 'top_vendors': top_vendors}
+
+def rollup_rows(*sources):
+    # {(key..., day, status): (quantity, revenue, order_count)}, summed over
+    # the sources (hot and archived orders never overlap), revenue rounded
+    # so float summation order does not count as drift
+    rows = {}
+    for source in sources:
+        for row in source:
+            row = tuple(row)
+            quantity, revenue, order_count = rows.get(row[:-3], (0, 0, 0))
+            rows[row[:-3]] = (quantity + row[-3], revenue + row[-2], order_count + row[-1])
+    return {key: (quantity, round(revenue, 6), order_count)
+            for key, (quantity, revenue, order_count) in rows.items()}
+
+def rebuild_rollups(conn, archive=None):
+    # Backfill: recomputes every rollup from Order_Items and Orders (and the
+    # archived orders, given an archive.OrderArchive) under the write lock
+    # and returns how many rows of each table had drifted
+    drift = {}
+    with transaction(conn):
+        for table, (columns, expr, orders) in SALES_ROLLUPS.items():
+            stored = rollup_rows(conn.execute('SELECT %s, day, status, quantity, revenue, order_count FROM %s'
+                                              % (columns, table)))
+            sql = '''
+                SELECT %s, date(o.created_at), o.status, SUM(oi.quantity), SUM(oi.quantity * oi.price), %s
+                FROM Order_Items oi JOIN Orders o ON o.order_id = oi.order_id
+                GROUP BY %s, date(o.created_at), o.status
+            ''' % (expr, orders, expr)
+            actual = rollup_rows(conn.execute(sql), archive.scan(conn, sql) if archive is not None else [])
+            # Rows the triggers moved down to zero are not drift
+            stored = {key: value for key, value in stored.items() if value != (0, 0, 0)}
+            drift[table] = sum(1 for key in set(stored) | set(actual) if stored.get(key) != actual.get(key))
+
+            conn.execute('DELETE FROM %s' % table)
+            conn.executemany('INSERT INTO %s (%s, day, status, quantity, revenue, order_count) VALUES (%s)'
+                             % (table, columns, ', '.join('?' * (len(columns.split(',')) + 5))),
+                             [key + value for key, value in actual.items()])
+    return drift
+
+if __name__ == '__main__':
+    # python analytics.py [database.db]  -- backfill/reconcile the sales rollups
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    conn = sqlite3.connect(path, timeout=30)
+    drift = rebuild_rollups(conn, OrderArchive(path))
+    conn.close()
+    for table, rows in drift.items():
+        print('%s: %d rows drifted' % (table, rows))
+    print('Sales rollups rebuilt')
@@ -1,25 +1,286 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, Response, make_response
+from jinja2 import FileSystemBytecodeCache
 import sqlite3
-import hashlib
+import math
 from datetime import datetime
 import os
+import asyncio
+from functools import wraps
+
+from db import ConnectionPool
+from writer import WriteQueue, WriteQueueFull
+from sessions import SessionStore, ServerSessionInterface, LocalSharedStore
+from instrumentation import Instrumentation
+from async_db import AsyncReaderPool
+from migrations import migrate
+from archive import OrderArchive
+from orders import place_order, refresh_cart, set_order_status, load_vendor_orders, ORDER_STATUSES, OrderNotFound, StaleCartError
+from cache import CatalogCache, PageCache, catalog_version
+from stats import global_counts, vendor_counts
+from pagination import keyset_page, keyset_query, keyset_result
+import exports
+import search
+import catalog_snapshot
+import analytics
+import bookings
+from order_feed import OrderFeed, FeedError, parse_cursor, user_events, vendor_events
+from jobs import JobQueue
+import notifications
+from passwords import PasswordManager, PasswordHasherBusy, ScryptHasher, PBKDF2Hasher
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_change_in_production'
 
+app.config['DATABASE'] = os.environ.get('DATABASE', 'database.db')
+# Size the pool to the number of threads each gunicorn worker runs
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_BUSY_TIMEOUT_MS'] = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+app.config['DB_STATEMENT_CACHE_SIZE'] = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 256))
+# All writes go through one writer thread per process; jobs waiting behind a
+# commit are applied together, up to DB_WRITE_BATCH per transaction
+app.config['DB_WRITE_BATCH'] = int(os.environ.get('DB_WRITE_BATCH', 64))
+app.config['DB_WRITE_MAX_PENDING'] = int(os.environ.get('DB_WRITE_MAX_PENDING', 1024))
+# Seconds a request waits for its write to commit before answering 503
+app.config['DB_WRITE_TIMEOUT'] = float(os.environ.get('DB_WRITE_TIMEOUT', 30))
+app.config['CATALOG_CACHE_SIZE'] = int(os.environ.get('CATALOG_CACHE_SIZE', 1024))
+app.config['CATALOG_CACHE_TTL'] = float(os.environ.get('CATALOG_CACHE_TTL', 300))
+# Rendered catalog pages, revalidated against the catalog version
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 512))
+# Compile every template at startup; TEMPLATE_CACHE_DIR also keeps the
+# compiled bytecode on disk for the next worker start
+app.config['PRECOMPILE_TEMPLATES'] = os.environ.get('PRECOMPILE_TEMPLATES', '1') == '1'
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', '')
+# Password hashing: 'scrypt' or 'pbkdf2', plus its cost and how many hashes
+# may run (workers) or wait (max pending) at once per process
+app.config['PASSWORD_HASHER'] = os.environ.get('PASSWORD_HASHER', 'scrypt')
+app.config['SCRYPT_N'] = int(os.environ.get('SCRYPT_N', 2 ** 14))
+app.config['PBKDF2_ITERATIONS'] = int(os.environ.get('PBKDF2_ITERATIONS', 600000))
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', 4))
+app.config['PASSWORD_MAX_PENDING'] = int(os.environ.get('PASSWORD_MAX_PENDING', 64))
+# Server-side sessions: idle and absolute lifetime in seconds, the per-process
+# LRU tier, and an optional shared tier ('local' or a redis:// URL)
+app.config['SESSION_IDLE_TIMEOUT'] = int(os.environ.get('SESSION_IDLE_TIMEOUT', 2 * 3600))
+app.config['SESSION_MAX_AGE'] = int(os.environ.get('SESSION_MAX_AGE', 7 * 86400))
+app.config['SESSION_CACHE_SIZE'] = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+app.config['SESSION_CACHE_TTL'] = float(os.environ.get('SESSION_CACHE_TTL', 30))
+app.config['SESSION_SHARED_STORE'] = os.environ.get('SESSION_SHARED_STORE', '')
+# Per-route latency, SQL counts and /metrics; off unless INSTRUMENTATION=1
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '0') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+# 'sync' (plain WSGI) or 'async' (read-heavy routes as async views over an
+# aiosqlite reader pool, served through ASGI)
+app.config['SERVING_MODE'] = os.environ.get('SERVING_MODE', 'sync')
+app.config['ASYNC_READER_POOL_SIZE'] = int(os.environ.get('ASYNC_READER_POOL_SIZE', 8))
+# Order status change feed: longest a long poll waits, and how often waiting
+# requests look for events written by other worker processes
+app.config['ORDER_FEED_MAX_WAIT'] = float(os.environ.get('ORDER_FEED_MAX_WAIT', 25))
+app.config['ORDER_FEED_POLL_INTERVAL'] = float(os.environ.get('ORDER_FEED_POLL_INTERVAL', 1))
+# Background job worker threads per process (0 when `python jobs.py` runs
+# them instead) and the SMTP server for order emails; without one they are
+# only logged
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', '')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 25))
+app.config['MAIL_SENDER'] = os.environ.get('MAIL_SENDER', notifications.SENDER)
+# How long a date-booked service added to the cart stays held for the user
+app.config['BOOKING_HOLD_MINUTES'] = float(os.environ.get('BOOKING_HOLD_MINUTES', 30))
+# Read orders moved out by archive.py back in for the pages and exports
+# that reach them (0: the app only ever shows the hot orders)
+app.config['ORDER_ARCHIVE'] = os.environ.get('ORDER_ARCHIVE', '1') == '1'
+
+migrate(app.config['DATABASE'])
+
+pool = ConnectionPool(app.config['DATABASE'],
+                      size=app.config['DB_POOL_SIZE'],
+                      timeout=app.config['DB_POOL_TIMEOUT'],
+                      busy_timeout=app.config['DB_BUSY_TIMEOUT_MS'],
+                      statement_cache_size=app.config['DB_STATEMENT_CACHE_SIZE'],
+                      readonly=True)
+
+writer = WriteQueue(app.config['DATABASE'],
+                    max_batch=app.config['DB_WRITE_BATCH'],
+                    max_pending=app.config['DB_WRITE_MAX_PENDING'],
+                    timeout=app.config['DB_POOL_TIMEOUT'],
+                    busy_timeout=app.config['DB_BUSY_TIMEOUT_MS'],
+                    wait_timeout=app.config['DB_WRITE_TIMEOUT'])
+
+catalog = CatalogCache(maxsize=app.config['CATALOG_CACHE_SIZE'], ttl=app.config['CATALOG_CACHE_TTL'])
+pages = PageCache(maxsize=app.config['PAGE_CACHE_SIZE'])
+snapshot = catalog_snapshot.CatalogSnapshot()
+archive = OrderArchive(app.config['DATABASE']) if app.config['ORDER_ARCHIVE'] else None
+job_queue = JobQueue(pool, writer,
+                     workers=app.config['JOB_WORKERS'],
+                     poll_interval=app.config['JOB_POLL_INTERVAL'])
+notifications.register(job_queue, notifications.make_mailer(app.config['MAIL_SERVER'],
+                                                            app.config['MAIL_PORT'],
+                                                            app.config['MAIL_SENDER']))
+feed = OrderFeed(pool,
+                 poll_interval=app.config['ORDER_FEED_POLL_INTERVAL'],
+                 max_wait=app.config['ORDER_FEED_MAX_WAIT'])
+
+if app.config['TEMPLATE_CACHE_DIR']:
+    os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+    app.jinja_options = dict(app.jinja_options,
+                             bytecode_cache=FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR']))
+if app.config['PRECOMPILE_TEMPLATES']:
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+if app.config['PASSWORD_HASHER'] == 'pbkdf2':
+    hasher = PBKDF2Hasher(iterations=app.config['PBKDF2_ITERATIONS'])
+else:
+    hasher = ScryptHasher(n=app.config['SCRYPT_N'])
+passwords = PasswordManager(hasher,
+                            workers=app.config['PASSWORD_WORKERS'],
+                            max_pending=app.config['PASSWORD_MAX_PENDING'])
+
+if app.config['SESSION_SHARED_STORE'] == 'local':
+    shared_sessions = LocalSharedStore()
+elif app.config['SESSION_SHARED_STORE']:
+    import redis
+    shared_sessions = redis.Redis.from_url(app.config['SESSION_SHARED_STORE'])
+else:
+    shared_sessions = None
+session_store = SessionStore(writer,
+                             shared=shared_sessions,
+                             idle_timeout=app.config['SESSION_IDLE_TIMEOUT'],
+                             max_age=app.config['SESSION_MAX_AGE'],
+                             cache_size=app.config['SESSION_CACHE_SIZE'],
+                             cache_ttl=app.config['SESSION_CACHE_TTL'])
+
+if app.config['INSTRUMENTATION']:
+    instrumentation = Instrumentation(slow_query_seconds=app.config['SLOW_QUERY_MS'] / 1000.0,
+                                      slow_request_seconds=app.config['SLOW_REQUEST_MS'] / 1000.0)
+else:
+    instrumentation = None
+
+# One pooled read-only connection per app context, handed back on teardown
+# even when the route raised, so nothing leaks. Writes go through `writer`.
 def get_db_connection():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    if 'db' not in g:
+        g.db = pool.acquire()
+        g.db_conn = instrumentation.wrap(g.db) if instrumentation is not None else g.db
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    g.pop('db_conn', None)
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+# Job workers start with the first request of each worker process
+@app.before_request
+def start_job_workers():
+    job_queue.start()
+
+app.session_interface = ServerSessionInterface(session_store, get_db_connection)
+
+if instrumentation is not None:
+    instrumentation.init_app(app, collectors=[
+        ('db_pool', pool.stats),
+        ('db_writer', writer.stats),
+        ('catalog_cache', catalog.stats),
+        ('page_cache', pages.stats),
+        ('catalog_snapshot', snapshot.stats),
+        ('sessions', session_store.stats),
+        ('order_feed', feed.stats),
+        ('jobs', job_queue.stats),
+    ] + ([('order_archive', archive.stats)] if archive is not None else []))
+
+LOGIN_ENDPOINTS = {'user': 'user_login', 'vendor': 'vendor_login', 'admin': 'admin_login'}
+
+def role_required(role):
+    # Sends anyone not signed in with `role` to that role's login page
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                if session.get('role') != role:
+                    return redirect(url_for(LOGIN_ENDPOINTS[role]))
+                return await view(*args, **kwargs)
+            return async_wrapper
+        
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('role') != role:
+                return redirect(url_for(LOGIN_ENDPOINTS[role]))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def etag_response(entry):
+    body, etag = entry
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def cached_page(vary=None, catalog_data=True):
+    # Serves the rendered page from `pages` while the catalog is unchanged
+    # and answers If-None-Match with 304. vary() returns whatever else the
+    # page shows (e.g. the user's name); catalog_data=False for pages that
+    # show no catalog data at all. Redirects and errors are never cached.
+    def decorator(view):
+        def page_key():
+            version = None
+            if catalog_data:
+                version = catalog_version(get_db_connection())
+                catalog.sync_version(version)
+            return pages.key(request.endpoint, request.args, version, vary() if vary else None)
+        
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                key = page_key()
+                entry = pages.get(key)
+                if entry is None:
+                    body = await view(*args, **kwargs)
+                    if not isinstance(body, str):
+                        return body
+                    entry = pages.set(key, body)
+                return etag_response(entry)
+            return async_wrapper
+        
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = page_key()
+            entry = pages.get(key)
+            if entry is None:
+                body = view(*args, **kwargs)
+                if not isinstance(body, str):
+                    return body
+                entry = pages.set(key, body)
+            return etag_response(entry)
+        return wrapper
+    return decorator
+
+def current_user_name():
+    return session.get('user_name')
 
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return passwords.hash(password)
 
 def verify_password(stored_hash, password):
-    return stored_hash == hash_password(password)
+    return passwords.verify(stored_hash, password)
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    return 'Too many sign-ins in progress, please try again in a moment.', 503
+
+@app.errorhandler(WriteQueueFull)
+def write_queue_full(e):
+    return 'The server is busy, please try again in a moment.', 503
 
 # INDEX PAGE
 @app.route('/')
+@cached_page(catalog_data=False)
 def index():
     return render_template('index.html')
 
@@ -31,10 +292,12 @@ def user_login():
         password = request.form.get('password')
         
         conn = get_db_connection()
-        user = conn.execute('SELECT * FROM Users WHERE email = ?', (email,)).fetchone()
-        conn.close()
+        user = conn.execute('SELECT user_id, name, password FROM Users WHERE email = ?', (email,)).fetchone()
         
         if user and verify_password(user['password'], password):
+            if passwords.needs_rehash(user['password']):
+                writer.execute('UPDATE Users SET password = ? WHERE user_id = ?',
+                               (hash_password(password), user['user_id']))
             session.clear()
             session['user_id'] = user['user_id']
             session['user_name'] = user['name']
@@ -60,11 +323,8 @@ def user_register():
         hashed_password = hash_password(password)
         
         try:
-            conn = get_db_connection()
-            conn.execute('INSERT INTO Users (name, email, password, phone) VALUES (?, ?, ?, ?)',
-                        (name, email, hashed_password, phone))
-            conn.commit()
-            conn.close()
+            writer.execute('INSERT INTO Users (name, email, password, phone) VALUES (?, ?, ?, ?)',
+                           (name, email, hashed_password, phone))
             return redirect(url_for('user_login'))
         except sqlite3.IntegrityError:
             return render_template('register.html', error='Email already exists', role='user')
@@ -79,10 +339,12 @@ def vendor_login():
         password = request.form.get('password')
         
         conn = get_db_connection()
-        vendor = conn.execute('SELECT * FROM Vendors WHERE email = ?', (email,)).fetchone()
-        conn.close()
+        vendor = conn.execute('SELECT vendor_id, name, password FROM Vendors WHERE email = ?', (email,)).fetchone()
         
         if vendor and verify_password(vendor['password'], password):
+            if passwords.needs_rehash(vendor['password']):
+                writer.execute('UPDATE Vendors SET password = ? WHERE vendor_id = ?',
+                               (hash_password(password), vendor['vendor_id']))
             session.clear()
             session['vendor_id'] = vendor['vendor_id']
             session['vendor_name'] = vendor['name']
@@ -110,11 +372,9 @@ def vendor_register():
         hashed_password = hash_password(password)
         
         try:
-            conn = get_db_connection()
-            conn.execute('INSERT INTO Vendors (name, email, password, phone, category, description) VALUES (?, ?, ?, ?, ?, ?)',
-                        (name, email, hashed_password, phone, category, description))
-            conn.commit()
-            conn.close()
+            writer.execute('INSERT INTO Vendors (name, email, password, phone, category, description) VALUES (?, ?, ?, ?, ?, ?)',
+                           (name, email, hashed_password, phone, category, description))
+            catalog.invalidate_vendors()
             return redirect(url_for('vendor_login'))
         except sqlite3.IntegrityError:
             return render_template('register.html', error='Email already exists', role='vendor')
@@ -129,10 +389,12 @@ def admin_login():
         password = request.form.get('password')
         
         conn = get_db_connection()
-        admin = conn.execute('SELECT * FROM Admin WHERE email = ?', (email,)).fetchone()
-        conn.close()
+        admin = conn.execute('SELECT admin_id, password FROM Admin WHERE email = ?', (email,)).fetchone()
         
         if admin and verify_password(admin['password'], password):
+            if passwords.needs_rehash(admin['password']):
+                writer.execute('UPDATE Admin SET password = ? WHERE admin_id = ?',
+                               (hash_password(password), admin['admin_id']))
             session.clear()
             session['admin_email'] = email
             session['role'] = 'admin'
@@ -144,42 +406,30 @@ def admin_login():
 
 # USER DASHBOARD
 @app.route('/user_dashboard')
+@role_required('user')
+@cached_page(vary=current_user_name)
 def user_dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
     conn = get_db_connection()
-    categories = conn.execute('SELECT DISTINCT category FROM Vendors ORDER BY category').fetchall()
-    conn.close()
+    categories = catalog.categories(conn)
     
     return render_template('user_dashboard.html', 
                          user_name=session.get('user_name'),
-                         categories=[cat['category'] for cat in categories])
+                         categories=categories)
 
 # VIEW VENDORS BY CATEGORY
 @app.route('/vendor_services')
+@role_required('user')
+@cached_page()
 def vendor_services():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
     category = request.args.get('category')
     
     conn = get_db_connection()
-    vendors = conn.execute('''
-        SELECT DISTINCT v.vendor_id, v.name, v.category 
-        FROM Vendors v 
-        WHERE v.category = ?
-    ''', (category,)).fetchall()
+    vendors = catalog.vendors(conn, category)
     
     vendor_id = request.args.get('vendor_id')
     services = []
     if vendor_id:
-        services = conn.execute('''
-            SELECT * FROM Services 
-            WHERE vendor_id = ?
-        ''', (vendor_id,)).fetchall()
-    
-    conn.close()
+        services = catalog.services(conn, vendor_id)
     
     return render_template('vendor_services.html',
                          vendors=vendors,
@@ -188,100 +438,164 @@ def vendor_services():
                          selected_vendor=vendor_id,
                          user_name=session.get('user_name'))
 
-# ADD TO CART
-@app.route('/add_to_cart', methods=['POST'])
-def add_to_cart():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
-    data = request.get_json()
-    user_id = session['user_id']
-    service_id = data.get('service_id')
-    vendor_id = data.get('vendor_id')
-    quantity = data.get('quantity', 1)
+# SERVICE AVAILABILITY CALENDAR (JSON, ?from=&to=, default the next 30 days)
+@app.route('/service_availability/<int:service_id>')
+@role_required('user')
+def service_availability(service_id):
+    try:
+        start, end = bookings.parse_calendar_range(request.args)
+    except bookings.BookingError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    calendar = bookings.availability(get_db_connection(), service_id, start, end)
+    if calendar is None:
+        return jsonify({'success': False, 'message': 'Service not found'}), 404
+    return jsonify(calendar)
+
+# SEARCH VENDORS AND SERVICES
+@app.route('/search')
+@role_required('user')
+def search_catalog():
+    query = request.args.get('q', '')
+    min_price = request.args.get('min_price', type=float)
+    max_price = request.args.get('max_price', type=float)
+    limit = max(1, min(request.args.get('limit', search.DEFAULT_LIMIT, type=int), search.MAX_LIMIT))
     
     conn = get_db_connection()
+    return jsonify({
+        'success': True,
+        'query': query,
+        'services': search.search_services(conn, query, min_price, max_price, limit),
+        'vendors': search.search_vendors(conn, query, limit),
+    })
+
+# BROWSE SERVICES (JSON, ?category=&vendor_id=&min_price=&max_price=&sort=price|-price&limit=),
+# filtered and sorted on the in-memory catalog snapshot
+@app.route('/browse')
+@role_required('user')
+def browse():
+    try:
+        filters = catalog_snapshot.parse_browse(request.args)
+    except catalog_snapshot.BrowseError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    # Check if item already in cart
-    existing = conn.execute('''
-        SELECT * FROM Cart 
-        WHERE user_id = ? AND service_id = ? AND vendor_id = ?
-    ''', (user_id, service_id, vendor_id)).fetchone()
-    
-    if existing:
-        conn.execute('''
-            UPDATE Cart 
-            SET quantity = quantity + ?
-            WHERE user_id = ? AND service_id = ? AND vendor_id = ?
-        ''', (quantity, user_id, service_id, vendor_id))
-    else:
-        conn.execute('''
-            INSERT INTO Cart (user_id, service_id, vendor_id, quantity)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, service_id, vendor_id, quantity))
+    conn = get_db_connection()
+    snapshot.refresh(conn)
+    return jsonify(dict({'success': True}, **snapshot.browse(conn, **filters)))
+
+# ADD TO CART (services booked by date also take an event_date, and are held
+# on that date while in the cart)
+def add_cart_items(user_id, items):
+    try:
+        writer.run(bookings.add_to_cart, user_id, items, app.config['BOOKING_HOLD_MINUTES'] * 60)
+    except bookings.SlotUnavailable as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except bookings.BookingError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return None
+
+def cart_item(item):
+    # (service_id, vendor_id, quantity, event_date) of one posted item, or
+    # the 400 response to send back
+    try:
+        row = (int(item['service_id']), int(item['vendor_id']), int(item.get('quantity', 1)),
+               bookings.parse_day(item['event_date']) if item.get('event_date') else None)
+    except bookings.BookingError as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 400)
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return None, (jsonify({'success': False, 'message': 'Each item needs service_id, vendor_id and quantity'}), 400)
+    if row[2] < 1:
+        return None, (jsonify({'success': False, 'message': 'Quantity must be at least 1'}), 400)
+    return row, None
+
+@app.route('/add_to_cart', methods=['POST'])
+@role_required('user')
+def add_to_cart():
+    row, error = cart_item(request.get_json(silent=True))
+    if error is not None:
+        return error
     
-    conn.commit()
-    conn.close()
+    error = add_cart_items(session['user_id'], [row])
+    if error is not None:
+        return error
     
     return jsonify({'success': True, 'message': 'Added to cart'})
 
+# ADD MANY TO CART (e.g. a whole event package) IN ONE TRANSACTION
+@app.route('/add_to_cart_batch', methods=['POST'])
+@role_required('user')
+def add_to_cart_batch():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': 'Expected a list of items'}), 400
+    
+    user_id = session['user_id']
+    rows = []
+    for item in items:
+        row, error = cart_item(item)
+        if error is not None:
+            return error
+        rows.append(row)
+    
+    error = add_cart_items(user_id, rows)
+    if error is not None:
+        return error
+    
+    return jsonify({'success': True, 'message': 'Added %d items to cart' % len(rows)})
+
 # VIEW CART
+CART_ITEMS_SQL = '''
+    SELECT c.cart_id, c.quantity, c.event_date, s.service_id, s.name, s.price, v.name as vendor_name, v.vendor_id
+    FROM Cart c
+    JOIN Services s ON c.service_id = s.service_id
+    JOIN Vendors v ON c.vendor_id = v.vendor_id
+    WHERE c.user_id = ?
+'''
+
 @app.route('/cart')
+@role_required('user')
 def cart():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
     user_id = session['user_id']
     
     conn = get_db_connection()
-    cart_items = conn.execute('''
-        SELECT c.cart_id, c.quantity, s.service_id, s.name, s.price, v.name as vendor_name, v.vendor_id
-        FROM Cart c
-        JOIN Services s ON c.service_id = s.service_id
-        JOIN Vendors v ON c.vendor_id = v.vendor_id
-        WHERE c.user_id = ?
-    ''', (user_id,)).fetchall()
-    conn.close()
+    cart_items = conn.execute(CART_ITEMS_SQL, (user_id,)).fetchall()
     
     total = sum(item['price'] * item['quantity'] for item in cart_items)
     
     return render_template('cart.html',
                          cart_items=cart_items,
                          total=total,
+                         error=request.args.get('error'),
                          user_name=session.get('user_name'))
 
 # REMOVE FROM CART
 @app.route('/remove_from_cart/<int:cart_id>', methods=['POST'])
+@role_required('user')
 def remove_from_cart(cart_id):
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
-    conn = get_db_connection()
-    conn.execute('DELETE FROM Cart WHERE cart_id = ? AND user_id = ?', (cart_id, session['user_id']))
-    conn.commit()
-    conn.close()
+    writer.execute('DELETE FROM Cart WHERE cart_id = ? AND user_id = ?', (cart_id, session['user_id']))
     
     return redirect(url_for('cart'))
 
 # CLEAR CART
 @app.route('/clear_cart', methods=['POST'])
+@role_required('user')
 def clear_cart():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
-    conn = get_db_connection()
-    conn.execute('DELETE FROM Cart WHERE user_id = ?', (session['user_id'],))
-    conn.commit()
-    conn.close()
+    writer.execute('DELETE FROM Cart WHERE user_id = ?', (session['user_id'],))
     
     return redirect(url_for('cart'))
 
 # CHECKOUT
+def checkout_order(conn, user_id, details):
+    # Writer job: the order and the jobs sending its emails commit together
+    order_id = place_order(conn, user_id, details)
+    if order_id is not None:
+        notifications.order_placed(conn, order_id)
+    return order_id
+
 @app.route('/checkout', methods=['POST'])
+@role_required('user')
 def checkout():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
     user_id = session['user_id']
     
     name = request.form.get('name')
@@ -296,268 +610,383 @@ def checkout():
     if not all([name, email, address, city, state, pin, phone, payment_method]):
         return redirect(url_for('cart'))
     
-    conn = get_db_connection()
-    
-    # Get cart items
-    cart_items = conn.execute('''
-        SELECT c.quantity, s.service_id, s.price, c.vendor_id
-        FROM Cart c
-        JOIN Services s ON c.service_id = s.service_id
-        WHERE c.user_id = ?
-    ''', (user_id,)).fetchall()
-    
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
-    
-    # Create order
-    cursor = conn.execute('''
-        INSERT INTO Orders (user_id, total, status, payment_method, customer_name, customer_email, 
-                           customer_address, customer_city, customer_state, customer_pin, customer_phone)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, total, 'Received', payment_method, name, email, address, city, state, pin, phone))
-    
-    order_id = cursor.lastrowid
-    
-    # Add order items
-    for item in cart_items:
-        conn.execute('''
-            INSERT INTO Order_Items (order_id, service_id, vendor_id, quantity, price)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (order_id, item['service_id'], item['vendor_id'], item['quantity'], item['price']))
-    
-    # Clear cart
-    conn.execute('DELETE FROM Cart WHERE user_id = ?', (user_id,))
-    
-    conn.commit()
-    conn.close()
+    details = {'name': name, 'email': email, 'address': address, 'city': city, 'state': state,
+               'pin': pin, 'phone': phone, 'payment_method': payment_method}
+    
+    try:
+        order_id = writer.run(checkout_order, user_id, details)
+    except StaleCartError as e:
+        # Nothing was ordered; bring the cart up to date for the user to review
+        writer.run(refresh_cart, user_id)
+        return redirect(url_for('cart', error=str(e)))
+    except bookings.BookingError as e:
+        return redirect(url_for('cart', error=str(e)))
+    if order_id is None:
+        return redirect(url_for('cart'))
+    feed.notify()
+    job_queue.notify()
     
     return redirect(url_for('success'))
 
 # SUCCESS PAGE
 @app.route('/success')
+@role_required('user')
 def success():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
     return render_template('success.html', user_name=session.get('user_name'))
 
 # MY ORDERS
+def orders_page(conn, sql, params, args):
+    # Order listings go on into the archived orders once paged past the hot ones
+    load_page = archive.keyset_page if archive is not None else keyset_page
+    return load_page(conn, sql, params, ('o.created_at', 'o.order_id'), ('created_at', 'order_id'), args)
+
+MY_ORDERS_SQL = '''
+    SELECT o.order_id, o.total, o.status, o.created_at, o.payment_method,
+           (SELECT COUNT(*) FROM Order_Items oi WHERE oi.order_id = o.order_id) as item_count
+    FROM Orders o
+    WHERE o.user_id = ? AND {keyset}
+    ORDER BY {order}
+    LIMIT ?
+'''
+
 @app.route('/my_orders')
+@role_required('user')
 def my_orders():
-    if 'user_id' not in session:
-        return redirect(url_for('user_login'))
-    
     user_id = session['user_id']
     
     conn = get_db_connection()
-    orders = conn.execute('''
-        SELECT o.order_id, o.total, o.status, o.created_at, o.payment_method,
-               COUNT(oi.item_id) as item_count
-        FROM Orders o
-        LEFT JOIN Order_Items oi ON o.order_id = oi.order_id
-        WHERE o.user_id = ?
-        GROUP BY o.order_id
-        ORDER BY o.created_at DESC
-    ''', (user_id,)).fetchall()
-    
-    conn.close()
+    page = orders_page(conn, MY_ORDERS_SQL, (user_id,), request.args)
     
     return render_template('my_orders.html',
-                         orders=orders,
+                         orders=page.rows,
+                         page=page,
                          user_name=session.get('user_name'))
 
 # VENDOR DASHBOARD
 @app.route('/vendor_dashboard')
+@role_required('vendor')
 def vendor_dashboard():
-    if 'vendor_id' not in session:
-        return redirect(url_for('vendor_login'))
-    
     vendor_id = session['vendor_id']
     
     conn = get_db_connection()
-    service_count = conn.execute('SELECT COUNT(*) as count FROM Services WHERE vendor_id = ?', 
-                                 (vendor_id,)).fetchone()['count']
-    order_count = conn.execute('''
-        SELECT COUNT(DISTINCT o.order_id) as count
-        FROM Orders o
-        JOIN Order_Items oi ON o.order_id = oi.order_id
-        WHERE oi.vendor_id = ?
-    ''', (vendor_id,)).fetchone()['count']
-    conn.close()
+    counts = vendor_counts(conn, vendor_id)
     
     return render_template('vendor_dashboard.html',
                          vendor_name=session.get('vendor_name'),
-                         service_count=service_count,
-                         order_count=order_count)
+                         service_count=counts['service_count'],
+                         order_count=counts['order_count'])
+
+# VENDOR - SALES ANALYTICS (JSON, ?from=&to=&status=, from the daily rollups)
+@app.route('/vendor_analytics')
+@role_required('vendor')
+def vendor_analytics():
+    try:
+        summary = analytics.vendor_summary(get_db_connection(), session['vendor_id'], request.args)
+    except analytics.AnalyticsError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(summary)
 
 # MANAGE SERVICES
+def service_fields(form):
+    # (name, description, price, category, daily_capacity) from the add and
+    # update forms, or an error message for the page
+    name = (form.get('name') or '').strip()
+    category = (form.get('category') or '').strip()
+    if not name or not category or not form.get('price'):
+        return None, 'Name, price and category are required'
+    try:
+        price = float(form['price'])
+    except ValueError:
+        price = -1
+    if not math.isfinite(price) or price < 0:
+        return None, 'Price must be a number of 0 or more'
+    daily_capacity = form.get('daily_capacity', type=int)
+    if form.get('daily_capacity') and (daily_capacity is None or daily_capacity < 0):
+        return None, 'Daily capacity must be a whole number of 0 or more'
+    return (name, form.get('description', ''), price, category, daily_capacity), None
+
 @app.route('/manage_services', methods=['GET', 'POST'])
+@role_required('vendor')
 def manage_services():
-    if 'vendor_id' not in session:
-        return redirect(url_for('vendor_login'))
-    
     vendor_id = session['vendor_id']
+    error = None
+    status = 200
     
     if request.method == 'POST':
         action = request.form.get('action')
         
         if action == 'add':
-            name = request.form.get('name')
-            description = request.form.get('description')
-            price = request.form.get('price')
-            category = request.form.get('category')
-            
-            if not all([name, price, category]):
-                pass
-            
-            try:
-                conn = get_db_connection()
-                conn.execute('''
-                    INSERT INTO Services (vendor_id, name, description, price, category)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (vendor_id, name, description, float(price), category))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                pass
+            fields, error = service_fields(request.form)
+            if fields is not None:
+                writer.execute('''
+                    INSERT INTO Services (vendor_id, name, description, price, category, daily_capacity)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (vendor_id,) + fields)
+                catalog.invalidate_services(vendor_id)
         
         elif action == 'update':
             service_id = request.form.get('service_id')
-            name = request.form.get('name')
-            description = request.form.get('description')
-            price = request.form.get('price')
-            category = request.form.get('category')
+            # The version the form was opened at: the update only applies if
+            # nobody changed the service since (the trigger bumps version)
+            version = request.form.get('version', type=int)
             
-            conn = get_db_connection()
-            conn.execute('''
-                UPDATE Services 
-                SET name = ?, description = ?, price = ?, category = ?
-                WHERE service_id = ? AND vendor_id = ?
-            ''', (name, description, float(price), category, service_id, vendor_id))
-            conn.commit()
-            conn.close()
+            fields, error = service_fields(request.form)
+            if version is None:
+                fields, error = None, 'This form is missing the service version. Please reload the page and try again.'
+                status = 400
+            if fields is not None:
+                result = writer.execute('''
+                    UPDATE Services 
+                    SET name = ?, description = ?, price = ?, category = ?, daily_capacity = ?
+                    WHERE service_id = ? AND vendor_id = ? AND archived_at IS NULL AND version = ?
+                ''', fields + (service_id, vendor_id, version))
+                if result.rowcount == 0:
+                    error = 'This service was changed or removed since you opened it. Please try again.'
+                catalog.invalidate_services(vendor_id)
         
         elif action == 'delete':
+            # Archived, not deleted: past orders and carts still refer to it
             service_id = request.form.get('service_id')
-            conn = get_db_connection()
-            conn.execute('DELETE FROM Services WHERE service_id = ? AND vendor_id = ?', 
-                        (service_id, vendor_id))
-            conn.commit()
-            conn.close()
+            writer.execute('''
+                UPDATE Services SET archived_at = CURRENT_TIMESTAMP
+                WHERE service_id = ? AND vendor_id = ? AND archived_at IS NULL
+            ''', (service_id, vendor_id))
+            catalog.invalidate_services(vendor_id)
     
     conn = get_db_connection()
-    services = conn.execute('SELECT * FROM Services WHERE vendor_id = ?', (vendor_id,)).fetchall()
-    conn.close()
+    services = conn.execute('SELECT * FROM Services WHERE vendor_id = ? AND archived_at IS NULL',
+                            (vendor_id,)).fetchall()
     
     return render_template('manage_services.html',
                          services=services,
-                         vendor_name=session.get('vendor_name'))
+                         error=error,
+                         vendor_name=session.get('vendor_name')), status
+
+# SERVICE CAPACITY FOR ONE DATE (capacity empty to go back to the daily default)
+@app.route('/service_capacity', methods=['POST'])
+@role_required('vendor')
+def service_capacity():
+    try:
+        day = bookings.parse_day(request.form.get('date'))
+    except bookings.BookingError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    service_id = request.form.get('service_id', type=int)
+    capacity = request.form.get('capacity', type=int)
+    if capacity is not None and capacity < 0:
+        return jsonify({'success': False, 'message': 'Capacity cannot be negative'}), 400
+    
+    try:
+        found = writer.run(bookings.set_capacity, session['vendor_id'], service_id, day, capacity)
+    except bookings.BookingError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if not found:
+        return jsonify({'success': False, 'message': 'Service not found'}), 404
+    return jsonify({'success': True})
 
 # REQUEST ITEMS (Vendor Orders)
 @app.route('/request_item')
+@role_required('vendor')
 def request_item():
-    if 'vendor_id' not in session:
-        return redirect(url_for('vendor_login'))
-    
     vendor_id = session['vendor_id']
     
+    status = request.args.get('status')
+    if status not in ORDER_STATUSES:
+        status = None
+    
     conn = get_db_connection()
-    orders = conn.execute('''
-        SELECT o.order_id, o.customer_name, o.customer_email, o.customer_address,
-               o.customer_city, o.customer_state, o.customer_pin, o.customer_phone,
-               o.status, o.created_at, o.total,
-               GROUP_CONCAT(s.name) as services,
-               GROUP_CONCAT(oi.quantity) as quantities
-        FROM Orders o
-        JOIN Order_Items oi ON o.order_id = oi.order_id
-        JOIN Services s ON oi.service_id = s.service_id
-        WHERE oi.vendor_id = ?
-        GROUP BY o.order_id
-        ORDER BY o.created_at DESC
-    ''', (vendor_id,)).fetchall()
-    
-    conn.close()
+    page = load_vendor_orders(conn, vendor_id, request.args, status, archive)
     
     return render_template('request_item.html',
-                         orders=orders,
+                         orders=page.rows,
+                         page=page,
+                         status=status,
+                         statuses=ORDER_STATUSES,
                          vendor_name=session.get('vendor_name'))
 
 # UPDATE ORDER STATUS
+def change_order_status(conn, order_id, vendor_id, status):
+    # Writer job: the status change, its event and the customer email job
+    # commit together
+    event_id = set_order_status(conn, order_id, vendor_id, status)
+    if event_id is not None:
+        notifications.order_status_changed(conn, order_id, event_id)
+    return event_id
+
 @app.route('/update_order_status', methods=['POST'])
+@role_required('vendor')
 def update_order_status():
-    if 'vendor_id' not in session:
-        return redirect(url_for('vendor_login'))
-    
-    order_id = request.form.get('order_id')
+    order_id = request.form.get('order_id', type=int)
     status = request.form.get('status')
+    if status not in ORDER_STATUSES:
+        return jsonify({'success': False, 'message': 'Status must be one of: %s' % ', '.join(ORDER_STATUSES)}), 400
     
-    conn = get_db_connection()
-    conn.execute('UPDATE Orders SET status = ? WHERE order_id = ?', (status, order_id))
-    conn.commit()
-    conn.close()
+    try:
+        event_id = writer.run(change_order_status, order_id, session['vendor_id'], status)
+    except OrderNotFound as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    if event_id is not None:
+        feed.notify()
+        job_queue.notify()
     
     return redirect(url_for('request_item'))
 
+# ORDER STATUS CHANGE FEEDS (JSON long poll: ?after=<cursor>&timeout=<seconds>)
+def order_feed_response(fetch, principal):
+    try:
+        after, timeout = parse_cursor(request.args, feed.max_wait)
+    except FeedError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    # The session is loaded by now; give the pooled connection back rather
+    # than holding it for the whole wait
+    release_db_connection(None)
+    events, cursor, more = feed.wait(fetch, principal, after, timeout)
+    return jsonify({'events': events, 'cursor': cursor, 'more': more})
+
+@app.route('/my_orders/events')
+@role_required('user')
+def my_order_events():
+    return order_feed_response(user_events, session['user_id'])
+
+@app.route('/request_item/events')
+@role_required('vendor')
+def vendor_order_events():
+    return order_feed_response(vendor_events, session['vendor_id'])
+
 # ADMIN DASHBOARD
 @app.route('/admin_dashboard')
+@role_required('admin')
 def admin_dashboard():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('admin_login'))
-    
     conn = get_db_connection()
-    user_count = conn.execute('SELECT COUNT(*) as count FROM Users').fetchone()['count']
-    vendor_count = conn.execute('SELECT COUNT(*) as count FROM Vendors').fetchone()['count']
-    order_count = conn.execute('SELECT COUNT(*) as count FROM Orders').fetchone()['count']
-    conn.close()
+    counts = global_counts(conn)
     
     return render_template('admin_dashboard.html',
-                         user_count=user_count,
-                         vendor_count=vendor_count,
-                         order_count=order_count)
+                         user_count=counts['users'],
+                         vendor_count=counts['vendors'],
+                         order_count=counts['orders'])
+
+# ADMIN - SALES ANALYTICS (JSON, ?from=&to=&status=, from the daily rollups)
+@app.route('/admin_analytics')
+@role_required('admin')
+def admin_analytics():
+    try:
+        summary = analytics.admin_summary(get_db_connection(), request.args)
+    except analytics.AnalyticsError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(summary)
 
 # ADMIN - MANAGE USERS
+ADMIN_USERS_SQL = '''
+    SELECT user_id, name, email, phone, created_at
+    FROM Users
+    WHERE {keyset}
+    ORDER BY {order}
+    LIMIT ?
+'''
+
 @app.route('/admin_users')
+@role_required('admin')
 def admin_users():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('admin_login'))
-    
     conn = get_db_connection()
-    users = conn.execute('SELECT * FROM Users ORDER BY created_at DESC').fetchall()
-    conn.close()
+    page = keyset_page(conn, ADMIN_USERS_SQL, (),
+                       ('created_at', 'user_id'), ('created_at', 'user_id'), request.args)
     
-    return render_template('admin_dashboard.html', section='users', users=users)
+    return render_template('admin_dashboard.html', section='users', users=page.rows, page=page)
 
 # ADMIN - MANAGE VENDORS
+ADMIN_VENDORS_SQL = '''
+    SELECT vendor_id, name, email, phone, category, created_at
+    FROM Vendors
+    WHERE {keyset}
+    ORDER BY {order}
+    LIMIT ?
+'''
+
 @app.route('/admin_vendors')
+@role_required('admin')
 def admin_vendors():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('admin_login'))
-    
     conn = get_db_connection()
-    vendors = conn.execute('SELECT * FROM Vendors ORDER BY created_at DESC').fetchall()
-    conn.close()
+    page = keyset_page(conn, ADMIN_VENDORS_SQL, (),
+                       ('created_at', 'vendor_id'), ('created_at', 'vendor_id'), request.args)
     
-    return render_template('admin_dashboard.html', section='vendors', vendors=vendors)
+    return render_template('admin_dashboard.html', section='vendors', vendors=page.rows, page=page)
 
 # ADMIN - VIEW ORDERS
+ADMIN_ORDERS_SQL = '''
+    SELECT o.order_id, o.total, o.status, o.payment_method, o.created_at,
+           u.name as customer_name, u.email as customer_email,
+           (SELECT COUNT(*) FROM Order_Items oi WHERE oi.order_id = o.order_id) as item_count
+    FROM Orders o
+    JOIN Users u ON o.user_id = u.user_id
+    WHERE {keyset}
+    ORDER BY {order}
+    LIMIT ?
+'''
+
 @app.route('/admin_orders')
+@role_required('admin')
 def admin_orders():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('admin_login'))
-    
     conn = get_db_connection()
-    orders = conn.execute('''
-        SELECT o.order_id, o.total, o.status, o.payment_method, o.created_at,
-               u.name as customer_name, u.email as customer_email,
-               COUNT(oi.item_id) as item_count
-        FROM Orders o
-        JOIN Users u ON o.user_id = u.user_id
-        LEFT JOIN Order_Items oi ON o.order_id = oi.order_id
-        GROUP BY o.order_id
-        ORDER BY o.created_at DESC
-    ''').fetchall()
-    conn.close()
-    
-    return render_template('admin_orders.html', orders=orders)
+    page = orders_page(conn, ADMIN_ORDERS_SQL, (), request.args)
+    
+    return render_template('admin_orders.html', orders=page.rows, page=page)
+
+# EXPORTS (streamed as CSV or NDJSON, filtered by ?from=&to=&status=)
+def export_response(filename, columns, query):
+    try:
+        fmt = exports.export_format(request.args)
+        sql, params = query()
+        span = exports.date_range(request.args)
+    except exports.ExportError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return Response(exports.export_stream(pool, fmt, columns, sql, params, archive=archive, span=span),
+                    mimetype=exports.FORMATS[fmt],
+                    headers={'Content-Disposition': 'attachment; filename=%s.%s' % (filename, fmt)})
+
+@app.route('/admin_export/orders')
+@role_required('admin')
+def admin_export_orders():
+    return export_response('orders', exports.ORDER_COLUMNS,
+                           lambda: exports.orders_query(request.args))
+
+@app.route('/admin_export/order_items')
+@role_required('admin')
+def admin_export_order_items():
+    return export_response('order_items', exports.ORDER_ITEM_COLUMNS,
+                           lambda: exports.order_items_query(request.args))
+
+@app.route('/vendor_export/requests')
+@role_required('vendor')
+def vendor_export_requests():
+    vendor_id = session['vendor_id']
+    return export_response('requests', exports.VENDOR_REQUEST_COLUMNS,
+                           lambda: exports.vendor_requests_query(vendor_id, request.args))
+
+# ADMIN - RUNTIME STATS
+@app.route('/admin_stats')
+@role_required('admin')
+def admin_stats():
+    stats = {'db_pool': pool.stats(), 'db_writer': writer.stats(), 'catalog_cache': catalog.stats(),
+             'page_cache': pages.stats(), 'catalog_snapshot': snapshot.stats(), 'sessions': session_store.stats(),
+             'order_feed': feed.stats(), 'jobs': job_queue.stats()}
+    if archive is not None:
+        stats['order_archive'] = archive.stats()
+    if readers is not None:
+        stats['async_reader_pool'] = readers.stats()
+    return jsonify(stats)
+
+# ADMIN - REVOKE ALL SESSIONS OF AN ACCOUNT
+@app.route('/admin_revoke_sessions', methods=['POST'])
+@role_required('admin')
+def admin_revoke_sessions():
+    role = request.form.get('role')
+    principal = request.form.get('id')
+    if role not in LOGIN_ENDPOINTS or not principal:
+        return jsonify({'success': False, 'message': 'Expected role (user, vendor or admin) and id'}), 400
+    
+    revoked = session_store.revoke(role, principal)
+    return jsonify({'success': True, 'revoked': revoked})
 
 # LOGOUT
 @app.route('/logout')
@@ -565,10 +994,116 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
-if __name__ == '__main__':
-    # Check if database exists, if not create it
-    if not os.path.exists('database.db'):
-        from create_db import create_database
-        create_database()
+# ASYNC SERVING MODE
+# Async versions of the read-heavy routes. They replace the sync views when
+# SERVING_MODE=async and read through a bounded aiosqlite reader pool, so
+# independent queries of one request (e.g. vendors and services) overlap.
+readers = None
+
+@role_required('user')
+@cached_page(vary=current_user_name)
+async def user_dashboard_async():
+    categories = await catalog.categories_async(readers)
+    
+    return render_template('user_dashboard.html', 
+                         user_name=session.get('user_name'),
+                         categories=categories)
+
+@role_required('user')
+@cached_page()
+async def vendor_services_async():
+    category = request.args.get('category')
+    vendor_id = request.args.get('vendor_id')
+    
+    if vendor_id:
+        vendors, services = await asyncio.gather(catalog.vendors_async(readers, category),
+                                                 catalog.services_async(readers, vendor_id))
+    else:
+        vendors, services = await catalog.vendors_async(readers, category), []
+    
+    return render_template('vendor_services.html',
+                         vendors=vendors,
+                         services=services,
+                         category=category,
+                         selected_vendor=vendor_id,
+                         user_name=session.get('user_name'))
+
+@role_required('user')
+async def cart_async():
+    cart_items = await readers.fetchall(CART_ITEMS_SQL, (session['user_id'],))
+    total = sum(item['price'] * item['quantity'] for item in cart_items)
+    
+    return render_template('cart.html',
+                         cart_items=cart_items,
+                         total=total,
+                         error=request.args.get('error'),
+                         user_name=session.get('user_name'))
+
+async def keyset_page_async(sql, params, sort_columns, key_fields):
+    query = keyset_query(sql, params, sort_columns, request.args)
+    return keyset_result(query, await readers.fetchall(query.sql, query.params), key_fields)
+
+async def orders_page_async(sql, params):
+    if archive is None:
+        return await keyset_page_async(sql, params, ('o.created_at', 'o.order_id'), ('created_at', 'order_id'))
+    # Merging in archived partitions attaches them to one connection, so the
+    # sync orders_page runs on a pooled connection in a worker thread
+    args = request.args
+    
+    def load():
+        with pool.connection() as conn:
+            return orders_page(conn, sql, params, args)
+    return await asyncio.to_thread(load)
+
+@role_required('user')
+async def my_orders_async():
+    page = await orders_page_async(MY_ORDERS_SQL, (session['user_id'],))
     
-    app.run(debug=True)
+    return render_template('my_orders.html',
+                         orders=page.rows,
+                         page=page,
+                         user_name=session.get('user_name'))
+
+@role_required('admin')
+async def admin_users_async():
+    page = await keyset_page_async(ADMIN_USERS_SQL, (), ('created_at', 'user_id'), ('created_at', 'user_id'))
+    return render_template('admin_dashboard.html', section='users', users=page.rows, page=page)
+
+@role_required('admin')
+async def admin_vendors_async():
+    page = await keyset_page_async(ADMIN_VENDORS_SQL, (), ('created_at', 'vendor_id'), ('created_at', 'vendor_id'))
+    return render_template('admin_dashboard.html', section='vendors', vendors=page.rows, page=page)
+
+@role_required('admin')
+async def admin_orders_async():
+    page = await orders_page_async(ADMIN_ORDERS_SQL, ())
+    return render_template('admin_orders.html', orders=page.rows, page=page)
+
+ASYNC_VIEWS = {
+    'user_dashboard': user_dashboard_async,
+    'vendor_services': vendor_services_async,
+    'cart': cart_async,
+    'my_orders': my_orders_async,
+    'admin_users': admin_users_async,
+    'admin_vendors': admin_vendors_async,
+    'admin_orders': admin_orders_async,
+}
+
+def enable_async_mode():
+    global readers
+    readers = AsyncReaderPool(app.config['DATABASE'],
+                              size=app.config['ASYNC_READER_POOL_SIZE'],
+                              timeout=app.config['DB_POOL_TIMEOUT'],
+                              busy_timeout=app.config['DB_BUSY_TIMEOUT_MS'],
+                              statement_cache_size=app.config['DB_STATEMENT_CACHE_SIZE'])
+    app.view_functions.update(ASYNC_VIEWS)
+
+if app.config['SERVING_MODE'] == 'async':
+    enable_async_mode()
+
+if __name__ == '__main__':
+    if app.config['SERVING_MODE'] == 'async':
+        import uvicorn
+        uvicorn.run('asgi:application', port=int(os.environ.get('PORT', 5000)))
+    else:
+        app.run(debug=True)
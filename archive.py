@@ -0,0 +1,351 @@
+import argparse
+import os
+import re
+import sqlite3
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from orders import ORDER_STATUSES
+from pagination import keyset_query, keyset_result
+
+# Cold storage for old orders. archive_orders() moves orders that reached
+# their last status before a cutoff, with their items and status events,
+# into one SQLite file per month of created_at (archive/orders-YYYY-MM.db
+# next to the database) and records each file in Order_Archives (see
+# migrations.order_archives). Requests keep reading the hot tables only;
+# OrderArchive attaches a partition just for a query that reaches past the
+# newest archived data, one at a time (SQLite attaches at most 10).
+#
+# A batch is copied into its partition and committed before it is deleted
+# from database.db in a second, short transaction that only removes orders
+# the partition holds, so a crash in between leaves an order in both places
+# (queries skip the duplicate, and the next run finishes the move), never in
+# neither.
+
+ARCHIVE_STATUS = ORDER_STATUSES[-1]
+ARCHIVED_TABLES = ('Orders', 'Order_Items', 'Order_Status_Events')
+BATCH_SIZE = 500
+
+PARTITION_INDEXES = [
+    ('idx_orders_user_created', 'Orders', 'user_id, created_at'),
+    ('idx_orders_created', 'Orders', 'created_at'),
+    ('idx_order_items_order', 'Order_Items', 'order_id'),
+    ('idx_order_items_vendor_order', 'Order_Items', 'vendor_id, order_id'),
+    ('idx_order_status_events_order', 'Order_Status_Events', 'order_id'),
+]
+
+PARTITIONS_SQL = '''
+    SELECT month, path, orders, items, first_created_at, last_created_at, first_order_id, last_order_id
+    FROM Order_Archives
+    ORDER BY month
+'''
+
+ARCHIVE_MONTHS_SQL = '''
+    SELECT DISTINCT substr(created_at, 1, 7) FROM Orders
+    WHERE created_at < ? AND status = ?
+    ORDER BY 1
+'''
+
+BATCH_SQL = '''
+    SELECT order_id FROM Orders
+    WHERE created_at >= ? AND created_at < ? AND status = ?
+    LIMIT ?
+'''
+
+REGISTER_SQL = '''
+    INSERT INTO Order_Archives (month, path, orders, items, first_created_at, last_created_at,
+                                first_order_id, last_order_id, updated_at)
+    SELECT ?, ?, ?, ?, MIN(created_at), MAX(created_at), MIN(order_id), MAX(order_id), CURRENT_TIMESTAMP
+    FROM archive.Orders
+    WHERE 1
+    ON CONFLICT (month) DO UPDATE SET
+        orders = orders + excluded.orders, items = items + excluded.items,
+        first_created_at = excluded.first_created_at, last_created_at = excluded.last_created_at,
+        first_order_id = excluded.first_order_id, last_order_id = excluded.last_order_id,
+        updated_at = excluded.updated_at
+'''
+
+TABLE_NAMES = re.compile(r'\b(%s)\b' % '|'.join(ARCHIVED_TABLES))
+
+# What a partition holds that is no longer in database.db: without the
+# orders a batch copied but has not removed yet, for scan() to count
+# every order once
+SCAN_VIEWS = '''
+    CREATE TEMP VIEW Archived_Orders AS
+        SELECT * FROM main.Orders WHERE order_id NOT IN (SELECT order_id FROM hot.Orders);
+    CREATE TEMP VIEW Archived_Order_Items AS
+        SELECT * FROM main.Order_Items WHERE order_id NOT IN (SELECT order_id FROM hot.Orders);
+'''
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def qualify(sql, schema):
+    # Points the archived tables of a hot query at an attached partition;
+    # every other table (Users, Services, ...) still resolves to main
+    return TABLE_NAMES.sub(schema + r'.\1', sql)
+
+def columns(conn, schema, table):
+    return [(row[1], row[2]) for row in conn.execute('PRAGMA %s.table_info(%s)' % (schema, table))]
+
+def create_partition_schema(conn):
+    # Same tables as database.db, created from its own schema; columns added
+    # to the hot tables since the partition was created are added to it too
+    for table in ARCHIVED_TABLES:
+        sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                           (table,)).fetchone()[0]
+        conn.execute(re.sub(r'^CREATE TABLE\s+"?%s"?' % table, 'CREATE TABLE IF NOT EXISTS archive.%s' % table, sql))
+        have = {name for name, _ in columns(conn, 'archive', table)}
+        for name, decltype in columns(conn, 'main', table):
+            if name not in have:
+                conn.execute('ALTER TABLE archive.%s ADD COLUMN %s %s' % (table, name, decltype))
+    for name, table, indexed in PARTITION_INDEXES:
+        conn.execute('CREATE INDEX IF NOT EXISTS archive.%s ON %s(%s)' % (name, table, indexed))
+
+def next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return '%04d-%02d' % (year + number // 12, number % 12 + 1)
+
+def archive_batch(conn, month, relpath, ids):
+    # Phase 1: copy into the partition; only the partition is written
+    marks = ', '.join('?' * len(ids))
+    conn.execute('BEGIN')
+    try:
+        for table in ARCHIVED_TABLES:
+            names = ', '.join(name for name, _ in columns(conn, 'main', table))
+            conn.execute('INSERT OR IGNORE INTO archive.%s (%s) SELECT %s FROM main.%s WHERE order_id IN (%s)'
+                         % (table, names, names, table, marks), ids)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    # Phase 2: remove from database.db what the partition now holds
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        held = 'SELECT order_id FROM archive.Orders WHERE order_id IN (%s)' % marks
+        conn.execute("UPDATE Stats SET value = 1 WHERE name = 'archiving'")
+        conn.execute('DELETE FROM main.Order_Status_Events WHERE order_id IN (%s)' % held, ids)
+        items = conn.execute('DELETE FROM main.Order_Items WHERE order_id IN (%s)' % held, ids).rowcount
+        orders = conn.execute('DELETE FROM main.Orders WHERE order_id IN (%s)' % held, ids).rowcount
+        conn.execute("UPDATE Stats SET value = 0 WHERE name = 'archiving'")
+        conn.execute(REGISTER_SQL, (month, relpath, orders, items))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return orders, items
+
+def archive_orders(db_path, before, directory=None, batch_size=BATCH_SIZE, pause=0.05, verbose=False):
+    # Moves orders in ARCHIVE_STATUS created before `before` (YYYY-MM-DD)
+    # into their month's partition, batch_size orders per transaction with
+    # `pause` seconds between batches so checkout keeps getting the write
+    # lock. Returns {month: (orders, items)} moved.
+    base = os.path.dirname(os.path.abspath(db_path))
+    directory = directory or os.path.join(base, 'archive')
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    moved = {}
+    try:
+        for (month,) in conn.execute(ARCHIVE_MONTHS_SQL, (before, ARCHIVE_STATUS)).fetchall():
+            path = os.path.join(directory, 'orders-%s.db' % month)
+            relpath = os.path.relpath(path, base)
+            registered = conn.execute('SELECT 1 FROM Order_Archives WHERE month = ?', (month,)).fetchone()
+            if registered is None and os.path.exists(path):
+                raise ArchiveError('%s exists but is not listed in Order_Archives; move it away first' % path)
+            # Listed before anything is copied, so a run that stops half-way
+            # is picked up by the next one
+            conn.execute('INSERT OR IGNORE INTO Order_Archives (month, path) VALUES (?, ?)', (month, relpath))
+
+            conn.execute('ATTACH DATABASE ? AS archive', (path,))
+            try:
+                create_partition_schema(conn)
+                end = min(next_month(month) + '-01', before)
+                totals = [0, 0]
+                while True:
+                    ids = [row[0] for row in conn.execute(BATCH_SQL, (month + '-01', end, ARCHIVE_STATUS,
+                                                                      batch_size))]
+                    if not ids:
+                        break
+                    orders, items = archive_batch(conn, month, relpath, ids)
+                    totals[0] += orders
+                    totals[1] += items
+                    time.sleep(pause)
+            finally:
+                conn.execute('DETACH DATABASE archive')
+            moved[month] = tuple(totals)
+            if verbose:
+                print('%s: %d orders, %d items -> %s' % (month, totals[0], totals[1], relpath))
+    finally:
+        conn.close()
+    return moved
+
+def reclaim_space(db_path, pages=0, full=False):
+    # Gives the space freed by archiving back to the file system. The first
+    # run switches the database to incremental auto_vacuum, which takes one
+    # full VACUUM (a rewrite under the write lock); after that each run
+    # frees up to `pages` free pages (0: all) without rewriting anything
+    # else. Pages only partly emptied (archived orders sit between hot ones)
+    # are compacted by a full VACUUM only. Returns (pages, bytes) freed.
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        before = conn.execute('PRAGMA page_count').fetchone()[0]
+        if full or conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        else:
+            conn.execute('PRAGMA incremental_vacuum(%d)' % pages).fetchall()
+        freed = before - conn.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        conn.close()
+    return freed, freed * page_size
+
+
+def read_only_uri(path):
+    return 'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path))
+
+
+class OrderArchive:
+    # Read side: merges archived partitions into hot queries, for requests
+    # that reach them
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.base = os.path.dirname(os.path.abspath(db_path))
+        self.attaches = 0
+
+    def partitions(self, conn):
+        # As dicts, whatever the connection's row_factory
+        cursor = conn.execute(PARTITIONS_SQL)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    @contextmanager
+    def attached(self, conn, partition):
+        schema = 'archive_' + partition['month'].replace('-', '_')
+        conn.execute('ATTACH DATABASE ? AS %s' % schema, (os.path.join(self.base, partition['path']),))
+        self.attaches += 1
+        try:
+            yield schema
+        finally:
+            conn.execute('DETACH DATABASE %s' % schema)
+
+    def fetch(self, conn, partitions, sql, params):
+        rows = []
+        for partition in partitions:
+            with self.attached(conn, partition) as schema:
+                rows.extend(conn.execute(qualify(sql, schema), params).fetchall())
+        return rows
+
+    def keyset_page(self, conn, sql, params, sort_columns, key_fields, args):
+        # pagination.keyset_page over the hot tables plus any partition that
+        # can still hold rows for this page. The first key field must be
+        # created_at or order_id, which partitions record the range of. The
+        # returned page's `partitions` are those its rows came from.
+        query = keyset_query(sql, params, sort_columns, args)
+        rows = conn.execute(query.sql, query.params).fetchall()
+        field = key_fields[0]
+        descending = query.before is None
+        cursor = query.after if descending else query.before
+
+        def key(row):
+            return tuple(row[name] for name in key_fields)
+
+        used = []
+        partitions = [p for p in self.partitions(conn) if p['first_' + field] is not None]
+        for partition in sorted(partitions, key=lambda p: p['last_' + field], reverse=descending):
+            first, last = partition['first_' + field], partition['last_' + field]
+            if descending:
+                if cursor is not None and first > cursor[0]:
+                    continue
+                if len(rows) > query.limit and rows[query.limit][field] > last:
+                    break
+            else:
+                if last < cursor[0]:
+                    continue
+                if len(rows) > query.limit and rows[query.limit][field] < first:
+                    break
+            extra = self.fetch(conn, [partition], query.sql, query.params)
+            if not extra:
+                continue
+            used.append(partition)
+            merged, seen = [], set()
+            for row in sorted(rows + extra, key=key, reverse=descending):
+                if key(row) not in seen:
+                    seen.add(key(row))
+                    merged.append(row)
+            rows = merged[:query.limit + 1]
+
+        page = keyset_result(query, rows, key_fields)
+        page.partitions = used
+        return page
+
+    def stream(self, pool, sql, params, start=None, end=None, batch_size=1000):
+        # Batches of `sql` run against every partition overlapping
+        # [start, end) of created_at, oldest month first
+        with pool.connection() as conn:
+            for partition in self.partitions(conn):
+                if partition['first_created_at'] is None:
+                    continue
+                if (start and partition['last_created_at'] < start) or (end and partition['first_created_at'] >= end):
+                    continue
+                with self.attached(conn, partition) as schema:
+                    cursor = conn.execute(qualify(sql, schema), params)
+                    try:
+                        while True:
+                            batch = cursor.fetchmany(batch_size)
+                            if not batch:
+                                break
+                            yield batch
+                    finally:
+                        cursor.close()
+
+    def scan(self, conn, sql, params=()):
+        # Rows of `sql` over the orders and items of every partition, for the
+        # counter and rollup rebuilds. Each partition is read on a connection
+        # of its own with database.db attached as `hot` (other tables resolve
+        # there), so any number of partitions fit inside the caller's write
+        # transaction, which keeps the archive job from moving orders mid-scan.
+        rows = []
+        for partition in self.partitions(conn):
+            scan = sqlite3.connect(read_only_uri(os.path.join(self.base, partition['path'])), uri=True)
+            try:
+                scan.execute('ATTACH DATABASE ? AS hot', (read_only_uri(self.db_path),))
+                scan.executescript(SCAN_VIEWS)
+                rows.extend(scan.execute(TABLE_NAMES.sub(r'Archived_\1', sql), params).fetchall())
+            finally:
+                scan.close()
+        return rows
+
+    def stats(self):
+        return {'attaches': self.attaches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old delivered orders into monthly archive files')
+    parser.add_argument('db', nargs='?', default=os.environ.get('DATABASE', 'database.db'))
+    parser.add_argument('--older-than-days', type=int, default=180)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds between batches')
+    parser.add_argument('--vacuum', action='store_true', help='reclaim the freed space afterwards')
+    parser.add_argument('--vacuum-pages', type=int, default=0, help='pages per incremental vacuum (0: all)')
+    parser.add_argument('--vacuum-full', action='store_true', help='rewrite the whole file instead')
+    args = parser.parse_args()
+
+    from migrations import migrate
+    migrate(args.db)
+    before = (date.today() - timedelta(days=args.older_than_days)).isoformat()
+    started = time.perf_counter()
+    moved = archive_orders(args.db, before, batch_size=args.batch_size, pause=args.pause, verbose=True)
+    print('Archived %d orders created before %s in %.1fs'
+          % (sum(orders for orders, _ in moved.values()), before, time.perf_counter() - started))
+    if args.vacuum or args.vacuum_full:
+        pages, size = reclaim_space(args.db, args.vacuum_pages, args.vacuum_full)
+        print('Reclaimed %d pages (%.1f MB)' % (pages, size / 2 ** 20))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+# ASGI entry point: SERVING_MODE=async uvicorn asgi:application
+application = WsgiToAsgi(app)
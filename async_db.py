@@ -0,0 +1,119 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from db import PoolTimeout
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+# Read-only aiosqlite connections for the async serving mode. Flask runs each
+# async view on its own event loop, so the pool is bounded with thread-safe
+# primitives rather than asyncio ones and connections are handed between
+# loops; aiosqlite resolves each call on the loop that awaited it.
+
+
+class AsyncReaderPool:
+    def __init__(self, path, size=8, timeout=10.0, busy_timeout=5000, statement_cache_size=256):
+        if aiosqlite is None:
+            raise RuntimeError('The async serving mode needs aiosqlite: pip install aiosqlite')
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.statement_cache_size = statement_cache_size
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._created = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    async def _connect(self):
+        pending = aiosqlite.connect(self.path,
+                                    timeout=self.busy_timeout / 1000.0,
+                                    cached_statements=self.statement_cache_size)
+        # Each aiosqlite connection runs on its own thread; pooled readers
+        # live as long as the process and must not hold up its exit
+        getattr(pending, '_thread', pending).daemon = True
+        conn = await pending
+        conn.row_factory = sqlite3.Row
+        await conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    async def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            started = time.perf_counter()
+            acquired = await asyncio.to_thread(self._slots.acquire, True, self.timeout)
+            with self._lock:
+                self.wait_time += time.perf_counter() - started
+                if not acquired:
+                    self.timeouts += 1
+            if not acquired:
+                raise PoolTimeout('No reader connection available after %.1fs' % self.timeout)
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._created += 1
+        if conn is None:
+            try:
+                conn = await self._connect()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                self._slots.release()
+                raise
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+        self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    async def fetchall(self, sql, params=()):
+        async with self.connection() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def fetchone(self, sql, params=()):
+        async with self.connection() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                'size': self.size,
+                'open': self._created,
+                'idle': idle,
+                'in_use': self._created - idle,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time_seconds': round(self.wait_time, 6),
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,258 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from archive import read_only_uri
+
+# Online backups of database.db while the app keeps serving. backup() copies
+# it with SQLite's backup API `pages` pages per step and sleeps `pause`
+# seconds between steps, inside one read transaction on the source: the
+# copy is a consistent snapshot of the moment it started and is never
+# restarted by the writes made meanwhile, and in WAL mode checkout keeps
+# committing throughout (the WAL just cannot be checkpointed past the
+# snapshot until the copy is done). The copy is checked with PRAGMA
+# integrity_check before it replaces the destination.
+#
+# snapshot() stores backups incrementally: each copy (database.db and the
+# order archive partitions it lists, see archive.py) is cut into CHUNK_SIZE
+# chunks named by their SHA-256 under <directory>/chunks, and a manifest
+# under <directory>/snapshots lists the chunks of each file, so a snapshot
+# only writes the chunks that changed since any earlier one. restore()
+# puts a snapshot back together and checks it again.
+
+PAGES_PER_STEP = 1024
+PAUSE = 0.005
+CHUNK_SIZE = 4 * 2 ** 20
+
+
+class BackupError(ValueError):
+    pass
+
+
+def verify(path, quick=False):
+    # integrity_check reads every page and index; quick_check skips
+    # matching indexes to their tables and is much faster on big files
+    conn = sqlite3.connect(read_only_uri(path), uri=True)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA %s' % ('quick_check' if quick else 'integrity_check'))]
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
+    finally:
+        conn.close()
+    if problems != ['ok']:
+        raise BackupError('%s failed its integrity check: %s' % (path, '; '.join(problems[:5])))
+
+def remove_partial(partial):
+    for leftover in (partial, partial + '-journal', partial + '-wal', partial + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+def backup(db_path, dest, pages=PAGES_PER_STEP, pause=PAUSE, check=True, quick=False):
+    # Copies db_path to dest (replaced only once the copy is complete and
+    # checked). Returns a report of its size, steps and timings.
+    partial = dest + '.partial'
+    remove_partial(partial)
+    source = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    target = sqlite3.connect(partial)
+    steps, longest, last = [0], [0.0], [time.perf_counter()]
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        steps[0] += 1
+        longest[0] = max(longest[0], now - last[0])
+        if remaining:
+            time.sleep(pause)
+        last[0] = time.perf_counter()
+
+    started = time.perf_counter()
+    try:
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=pages, progress=progress)
+            source.execute('COMMIT')
+            # A copy of a WAL database is a WAL database; make it one plain file
+            target.execute('PRAGMA journal_mode = DELETE')
+            page_size = target.execute('PRAGMA page_size').fetchone()[0]
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        copied = time.perf_counter() - started
+        if check:
+            verify(partial, quick)
+    except BaseException:
+        remove_partial(partial)
+        raise
+    os.replace(partial, dest)
+    seconds = time.perf_counter() - started
+    size = page_size * page_count
+    return {'path': dest, 'pages': page_count, 'bytes': size, 'steps': steps[0],
+            'longest_step_ms': round(longest[0] * 1000, 3), 'copy_seconds': round(copied, 3),
+            'verify_seconds': round(seconds - copied, 3) if check else None, 'seconds': round(seconds, 3),
+            'mb_per_second': round(size / 2 ** 20 / copied, 1) if copied else None}
+
+def archive_paths(path):
+    # Partition files listed in a (backed up) database, relative to it
+    conn = sqlite3.connect(read_only_uri(path), uri=True)
+    try:
+        return [row[0] for row in conn.execute('SELECT path FROM Order_Archives ORDER BY month')]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+def store_chunks(path, chunks_dir):
+    # Returns (chunk names, bytes newly written)
+    names, written = [], 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            name = hashlib.sha256(chunk).hexdigest()
+            names.append(name)
+            chunk_path = os.path.join(chunks_dir, name[:2], name)
+            if not os.path.exists(chunk_path):
+                os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                with open(chunk_path + '.partial', 'wb') as out:
+                    out.write(chunk)
+                os.replace(chunk_path + '.partial', chunk_path)
+                written += len(chunk)
+    return names, written
+
+def snapshot(db_path, directory, pages=PAGES_PER_STEP, pause=PAUSE, quick=False):
+    # database.db first, then the partitions its copy lists: an order moved
+    # in between is in both copies (the archive reads skip the duplicate),
+    # never in neither. Returns the manifest, with a report per file.
+    chunks_dir = os.path.join(directory, 'chunks')
+    snapshots_dir = os.path.join(directory, 'snapshots')
+    os.makedirs(chunks_dir, exist_ok=True)
+    os.makedirs(snapshots_dir, exist_ok=True)
+    staging = os.path.join(directory, 'staging.db')
+
+    started = time.perf_counter()
+    name = datetime.now().strftime('%Y%m%d-%H%M%S')
+    manifest_path = os.path.join(snapshots_dir, name + '.json')
+    if os.path.exists(manifest_path):
+        raise BackupError('Snapshot %s already exists' % name)
+    main = os.path.basename(db_path)
+    manifest = {'name': name, 'created_at': datetime.now().isoformat(timespec='seconds'), 'main': main,
+                'chunk_size': CHUNK_SIZE, 'files': {}}
+    base = os.path.dirname(os.path.abspath(db_path))
+    sources = [(main, db_path)]
+    try:
+        while sources:
+            relpath, source = sources.pop(0)
+            report = backup(source, staging, pages, pause, quick=quick)
+            if relpath == main:
+                sources = [(partition, os.path.join(base, partition)) for partition in archive_paths(staging)]
+            report['chunks'], report['new_bytes'] = store_chunks(staging, chunks_dir)
+            del report['path']
+            manifest['files'][relpath] = report
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    manifest['seconds'] = round(time.perf_counter() - started, 3)
+
+    with open(manifest_path + '.partial', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.partial', manifest_path)
+    return manifest
+
+def list_snapshots(directory):
+    snapshots_dir = os.path.join(directory, 'snapshots')
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(snapshots_dir) if name.endswith('.json'))
+
+def restore(directory, name, dest, quick=False):
+    # Writes snapshot `name` (None: the newest) to dest, and its archive
+    # partitions next to it; refuses to overwrite anything
+    names = list_snapshots(directory)
+    name = name or (names[-1] if names else None)
+    if name not in names:
+        raise BackupError('No snapshot %s in %s' % (name, directory))
+    with open(os.path.join(directory, 'snapshots', name + '.json')) as f:
+        manifest = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(dest))
+    targets = [(relpath, dest if relpath == manifest['main'] else os.path.join(base, relpath))
+               for relpath in manifest['files']]
+    for _, path in targets:
+        if os.path.exists(path):
+            raise BackupError('%s already exists; restore somewhere else or move it away first' % path)
+    for relpath, path in targets:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            with open(path + '.partial', 'wb') as out:
+                for chunk_name in manifest['files'][relpath]['chunks']:
+                    with open(os.path.join(directory, 'chunks', chunk_name[:2], chunk_name), 'rb') as f:
+                        chunk = f.read()
+                    if hashlib.sha256(chunk).hexdigest() != chunk_name:
+                        raise BackupError('Chunk %s of %s is damaged' % (chunk_name, relpath))
+                    out.write(chunk)
+            verify(path + '.partial', quick)
+        except BaseException:
+            os.remove(path + '.partial')
+            raise
+        os.replace(path + '.partial', path)
+    return manifest
+
+
+def print_report(label, report):
+    print('%s: %.1f MB, %d pages in %d steps, copied in %.2fs (%.1f MB/s, longest step %.1f ms)%s'
+          % (label, report['bytes'] / 2 ** 20, report['pages'], report['steps'], report['copy_seconds'],
+             report['mb_per_second'] or 0, report['longest_step_ms'],
+             ', verified in %.2fs' % report['verify_seconds'] if report['verify_seconds'] is not None else ''))
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up the database while the app is running')
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'database.db'))
+    parser.add_argument('--pages', type=int, default=PAGES_PER_STEP, help='pages copied per step')
+    parser.add_argument('--pause', type=float, default=PAUSE, help='seconds to sleep between steps')
+    parser.add_argument('--quick', action='store_true', help='quick_check instead of integrity_check')
+    commands = parser.add_subparsers(dest='command', required=True)
+    copy = commands.add_parser('copy', help='a plain copy of database.db')
+    copy.add_argument('dest', nargs='?')
+    copy.add_argument('--no-verify', action='store_true')
+    snap = commands.add_parser('snapshot', help='an incremental snapshot, archive partitions included')
+    snap.add_argument('directory', nargs='?', default='backups')
+    listing = commands.add_parser('list', help='the snapshots in a directory')
+    listing.add_argument('directory', nargs='?', default='backups')
+    back = commands.add_parser('restore', help='put a snapshot back together')
+    back.add_argument('dest')
+    back.add_argument('--from', dest='directory', default='backups')
+    back.add_argument('--name', help='snapshot to restore (default: the newest)')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'copy':
+            dest = args.dest or 'database-%s.db' % datetime.now().strftime('%Y%m%d-%H%M%S')
+            print_report(dest, backup(args.db, dest, args.pages, args.pause, not args.no_verify, args.quick))
+            if archive_paths(dest):
+                print('Note: archived orders are kept in separate files; use `snapshot` to back them up too')
+        elif args.command == 'snapshot':
+            manifest = snapshot(args.db, args.directory, args.pages, args.pause, args.quick)
+            for relpath, report in manifest['files'].items():
+                print_report(relpath, report)
+            total = sum(report['bytes'] for report in manifest['files'].values())
+            written = sum(report['new_bytes'] for report in manifest['files'].values())
+            print('Snapshot %s: %.1f MB in %d files, %.1f MB of it new, %.2fs'
+                  % (manifest['name'], total / 2 ** 20, len(manifest['files']), written / 2 ** 20,
+                     manifest['seconds']))
+        elif args.command == 'list':
+            for name in list_snapshots(args.directory):
+                print(name)
+        else:
+            manifest = restore(args.directory, args.name, args.dest, args.quick)
+            print('Restored snapshot %s to %s (%d files)' % (manifest['name'], args.dest, len(manifest['files'])))
+    except BackupError as e:
+        parser.exit(1, 'Backup failed: %s\n' % e)
+
+if __name__ == '__main__':
+    main()
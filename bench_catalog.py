@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import seed_data
+from catalog_snapshot import CatalogSnapshot, numpy
+
+# Browse queries (category, vendor and price filters, top-k by price) on the
+# in-memory catalog snapshot, with and without NumPy, against the same
+# queries in SQLite, on a throwaway database filled by seed_data.py. Reports
+# the snapshot's size and build/refresh times, and checks every engine
+# returns the same services.
+#   python bench_catalog.py --services 1000000 --queries 100
+
+PERCENTILES = (50, 95, 99)
+
+SQLITE_PAGE_SQL = '''
+    SELECT service_id FROM Services
+    WHERE archived_at IS NULL AND %s
+    ORDER BY price %s, service_id
+    LIMIT ?
+'''
+
+SQLITE_COUNT_SQL = 'SELECT COUNT(*) FROM Services WHERE archived_at IS NULL AND %s'
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100.0 * len(sorted_values) + 0.5 - 1e-9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def rss_mb():
+    # Resident set size of this process (Linux); None elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+def make_queries(rng, count, vendors):
+    queries = []
+    for _ in range(count):
+        low = rng.choice([None, rng.uniform(500, 25000)])
+        queries.append({
+            'category': rng.choice([None] + list(seed_data.CATEGORIES)),
+            'vendor_id': rng.choice([None, None, None, rng.randint(1, vendors)]),
+            'min_price': low,
+            'max_price': rng.choice([None, (low or 500) + rng.uniform(1000, 25000)]),
+            'descending': rng.random() < 0.5,
+            'limit': 20,
+        })
+    return queries
+
+def sqlite_query(conn, category=None, vendor_id=None, min_price=None, max_price=None, descending=False,
+                 limit=20):
+    clauses, params = ['1'], []
+    for clause, value in (('category = ?', category), ('vendor_id = ?', vendor_id),
+                          ('price >= ?', min_price), ('price <= ?', max_price)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    where = ' AND '.join(clauses)
+    total = conn.execute(SQLITE_COUNT_SQL % where, params).fetchone()[0]
+    ids = [row[0] for row in conn.execute(SQLITE_PAGE_SQL % (where, 'DESC' if descending else 'ASC'),
+                                          params + [limit])]
+    return total, ids
+
+def measure(run, queries):
+    timings, results = [], []
+    started = time.perf_counter()
+    for query in queries:
+        query_started = time.perf_counter()
+        results.append(run(**query))
+        timings.append(time.perf_counter() - query_started)
+    wall = time.perf_counter() - started
+    timings.sort()
+    return [percentile(timings, p) * 1000 for p in PERCENTILES] + [len(queries) / wall], results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the in-memory catalog snapshot')
+    parser.add_argument('--services', type=int, default=1000000)
+    parser.add_argument('--vendors', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--changes', type=int, default=1000, help='services changed before the refresh timing')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as work:
+        db_path = os.path.join(work, 'bench.db')
+        started = time.perf_counter()
+        seed_data.generate(db_path, users=1, vendors=args.vendors,
+                           services_per_vendor=max(1, args.services // args.vendors), carts=0, orders=0)
+        print('Seeded %d services in %.1fs' % (args.services, time.perf_counter() - started))
+
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        engines = [('arrays', CatalogSnapshot(use_numpy=False))]
+        if numpy is not None:
+            engines.insert(0, ('numpy', CatalogSnapshot()))
+
+        for name, snapshot in engines:
+            before = rss_mb()
+            started = time.perf_counter()
+            snapshot.refresh(conn)
+            build = time.perf_counter() - started
+            after = rss_mb()
+            print('%-7s snapshot: %d services, %.1f MB of columns, RSS +%s MB, built in %.2fs'
+                  % (name, snapshot.stats()['services'], snapshot.stats()['bytes'] / 2 ** 20,
+                     '%.1f' % (after - before) if before is not None else '?', build))
+
+        queries = make_queries(rng, args.queries, args.vendors)
+        print('\n%-8s %10s %10s %10s %10s' % ('engine', 'p50_ms', 'p95_ms', 'p99_ms', 'qps'))
+        reference = None
+        for name, run in [(name, snapshot.query) for name, snapshot in engines] + \
+                         [('sqlite', lambda **query: sqlite_query(conn, **query))]:
+            row, results = measure(run, queries)
+            print('%-8s %10.2f %10.2f %10.2f %10.1f' % tuple([name] + row))
+            if reference is None:
+                reference = results
+            elif results != reference:
+                mismatches = sum(1 for a, b in zip(results, reference) if a != b)
+                print('  %d of %d results differ from %s' % (mismatches, len(queries), engines[0][0]))
+
+        # Incremental refresh after vendor edits: only the changed rows are read back
+        writer = sqlite3.connect(db_path)
+        ids = rng.sample(range(1, args.services + 1), min(args.changes, args.services))
+        writer.executemany('UPDATE Services SET price = price + 1 WHERE service_id = ?', [(i,) for i in ids])
+        writer.commit()
+        writer.close()
+        for name, snapshot in engines:
+            started = time.perf_counter()
+            snapshot.refresh(conn)
+            print('%-7s refresh after %d changes: %.1f ms' % (name, len(ids), (time.perf_counter() - started) * 1000))
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from db import ConnectionPool
+from migrations import migrate
+from orders import place_order
+
+# Checkout latency vs cart size: the per-row loop checkout used before
+# against the single-transaction place_order(). Runs on a throwaway database.
+#   python bench_checkout.py [runs_per_size]
+
+CART_SIZES = [1, 10, 50, 100, 200]
+
+DETAILS = {'name': 'Bench', 'email': 'bench@example.com', 'address': '1 Street', 'city': 'City',
+           'state': 'State', 'pin': '000000', 'phone': '0000000000', 'payment_method': 'Cash'}
+
+def legacy_checkout(conn, user_id, details):
+    cart_items = conn.execute('''
+        SELECT c.quantity, s.service_id, s.price, c.vendor_id
+        FROM Cart c
+        JOIN Services s ON c.service_id = s.service_id
+        WHERE c.user_id = ?
+    ''', (user_id,)).fetchall()
+    total = sum(item['price'] * item['quantity'] for item in cart_items)
+    cursor = conn.execute('''
+        INSERT INTO Orders (user_id, total, status, payment_method, customer_name, customer_email,
+                           customer_address, customer_city, customer_state, customer_pin, customer_phone)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, total, 'Received', details['payment_method'], details['name'], details['email'],
+          details['address'], details['city'], details['state'], details['pin'], details['phone']))
+    order_id = cursor.lastrowid
+    for item in cart_items:
+        conn.execute('''
+            INSERT INTO Order_Items (order_id, service_id, vendor_id, quantity, price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (order_id, item['service_id'], item['vendor_id'], item['quantity'], item['price']))
+    conn.execute('DELETE FROM Cart WHERE user_id = ?', (user_id,))
+    conn.commit()
+    return order_id
+
+def seed(conn, max_items):
+    conn.execute("INSERT INTO Users (name, email, password, phone) VALUES ('Bench', 'bench@example.com', 'x', '0')")
+    conn.execute("INSERT INTO Vendors (name, email, password, phone, category) VALUES ('Bench', 'v@example.com', 'x', '0', 'Catering')")
+    conn.executemany('INSERT INTO Services (vendor_id, name, price, category) VALUES (1, ?, ?, ?)',
+                     [('Service %d' % i, 10.0 + i, 'Catering') for i in range(max_items)])
+    conn.commit()
+
+def fill_cart(conn, size):
+    conn.executemany('INSERT INTO Cart (user_id, service_id, vendor_id, quantity) VALUES (1, ?, 1, 2)',
+                     [(i + 1,) for i in range(size)])
+    conn.commit()
+
+def measure(conn, func, size, runs):
+    samples = []
+    for _ in range(runs):
+        fill_cart(conn, size)
+        started = time.perf_counter()
+        func(conn, 1, DETAILS)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'bench.db')
+    migrate(db_path)
+
+    pool = ConnectionPool(db_path, size=1)
+    with pool.connection() as conn:
+        seed(conn, max(CART_SIZES))
+        print('%-10s %14s %14s %14s %14s' % ('items', 'loop p50 ms', 'loop p95 ms', 'bulk p50 ms', 'bulk p95 ms'))
+        for size in CART_SIZES:
+            loop_p50, loop_p95 = measure(conn, legacy_checkout, size, runs)
+            bulk_p50, bulk_p95 = measure(conn, place_order, size, runs)
+            print('%-10d %14.3f %14.3f %14.3f %14.3f' % (size, loop_p50, loop_p95, bulk_p50, bulk_p95))
+    pool.close_all()
+
+if __name__ == '__main__':
+    main()
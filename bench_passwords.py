@@ -0,0 +1,44 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passwords import PasswordManager, ScryptHasher, PBKDF2Hasher
+
+# Logins/sec per hashing cost: `clients` concurrent request threads verifying
+# passwords through a PasswordManager with `workers` hashing threads.
+#   python bench_passwords.py [logins] [clients] [workers]
+
+SETTINGS = [
+    ('scrypt n=2^13', ScryptHasher(n=2 ** 13)),
+    ('scrypt n=2^14', ScryptHasher(n=2 ** 14)),
+    ('scrypt n=2^15', ScryptHasher(n=2 ** 15)),
+    ('pbkdf2 300k', PBKDF2Hasher(iterations=300000)),
+    ('pbkdf2 600k', PBKDF2Hasher(iterations=600000)),
+]
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    print('%d logins, %d concurrent clients, %d hashing workers' % (logins, clients, workers))
+    print('%-16s %12s %14s' % ('setting', 'ms/verify', 'logins/sec'))
+    for name, hasher in SETTINGS:
+        manager = PasswordManager(hasher, workers=workers, max_pending=clients)
+        encoded = hasher.hash('correct horse battery staple')
+
+        started = time.perf_counter()
+        assert hasher.verify(encoded, 'correct horse battery staple')
+        single_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as requests:
+            results = list(requests.map(lambda _: manager.verify(encoded, 'correct horse battery staple'),
+                                        range(logins)))
+        elapsed = time.perf_counter() - started
+        manager.shutdown()
+        assert all(results)
+        print('%-16s %12.1f %14.1f' % (name, single_ms, logins / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import seed_data
+
+# End-to-end route benchmark through Flask's test client on a throwaway
+# database filled by seed_data.py. Each iteration is one customer journey:
+# login, browse, add to cart, checkout, my orders; then the vendor of one of
+# the ordered services opens request_item and moves the order on.
+#   python bench_routes.py --iterations 100 --save-baseline baseline.json
+#   python bench_routes.py --iterations 100 --baseline baseline.json
+# With --baseline it exits 1 when a route's percentile got slower by more
+# than --max-regression (a fraction) and --min-delta-ms.
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100.0 * len(sorted_values) + 0.5 - 1e-9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def call(self, route, func, *args, expect=(200, 302), **kwargs):
+        started = time.perf_counter()
+        response = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.timings.setdefault(route, []).append(elapsed)
+            if response.status_code not in expect:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def summary(self, wall_time):
+        summary = {}
+        for route, values in self.timings.items():
+            values = sorted(values)
+            summary[route] = {'count': len(values), 'errors': self.errors.get(route, 0),
+                              'req_per_sec': len(values) / wall_time}
+            for p in PERCENTILES:
+                summary[route]['p%d_ms' % p] = percentile(values, p) * 1000
+        return summary
+
+
+def journey(app, db, rng, data, recorder):
+    details = {'name': 'Bench', 'email': 'bench@seed.example', 'address': '1 Main Road', 'city': 'Pune',
+               'state': 'MH', 'pin': '411001', 'phone': '9000000000', 'payment_method': 'UPI'}
+    user_id = rng.choice(data['users'])
+    user = app.test_client()
+    recorder.call('user_login', user.post, '/user_login',
+                  data={'email': 'user%d@seed.example' % user_id, 'password': seed_data.PASSWORD})
+    recorder.call('user_dashboard', user.get, '/user_dashboard')
+
+    service_id = rng.choice(data['services'])
+    vendor_id, category = db.execute('SELECT vendor_id, category FROM Services WHERE service_id = ?',
+                                     (service_id,)).fetchone()
+    recorder.call('vendor_services', user.get, '/vendor_services', query_string={'category': category})
+    recorder.call('vendor_services?vendor_id', user.get, '/vendor_services',
+                  query_string={'category': category, 'vendor_id': vendor_id})
+    recorder.call('add_to_cart', user.post, '/add_to_cart',
+                  json={'service_id': service_id, 'vendor_id': vendor_id, 'quantity': rng.randint(1, 3)})
+    recorder.call('cart', user.get, '/cart')
+    recorder.call('checkout', user.post, '/checkout', data=details)
+    recorder.call('my_orders', user.get, '/my_orders')
+
+    order_id = db.execute('SELECT MAX(order_id) FROM Orders WHERE user_id = ?', (user_id,)).fetchone()[0]
+    vendor = app.test_client()
+    recorder.call('vendor_login', vendor.post, '/vendor_login',
+                  data={'email': 'vendor%d@seed.example' % vendor_id, 'password': seed_data.PASSWORD})
+    recorder.call('request_item', vendor.get, '/request_item')
+    recorder.call('update_order_status', vendor.post, '/update_order_status',
+                  data={'order_id': order_id, 'status': rng.choice(['Ready for Shipping', 'Out for Delivery'])})
+
+def compare(summary, baseline, key, max_regression, min_delta_ms):
+    regressions = []
+    for route, stats in sorted(summary.items()):
+        if route not in baseline:
+            continue
+        before, after = baseline[route][key], stats[key]
+        if after > before * (1 + max_regression) and after - before > min_delta_ms:
+            regressions.append('%s %s: %.2f ms -> %.2f ms (+%.0f%%)'
+                               % (route, key, before, after, (after / before - 1) * 100 if before else 100))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the main routes end to end')
+    parser.add_argument('--iterations', type=int, default=50, help='customer journeys to time')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed journeys first')
+    parser.add_argument('--clients', type=int, default=1, help='journeys run concurrently')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--vendors', type=int, default=200)
+    parser.add_argument('--services-per-vendor', type=int, default=10)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help='fail on regressions against this JSON summary')
+    parser.add_argument('--save-baseline', help='write the JSON summary here')
+    parser.add_argument('--percentile', choices=['p%d_ms' % p for p in PERCENTILES], default='p95_ms')
+    parser.add_argument('--max-regression', type=float, default=0.25)
+    parser.add_argument('--min-delta-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    data = seed_data.generate(path, users=args.users, vendors=args.vendors,
+                              services_per_vendor=args.services_per_vendor, carts=0,
+                              orders=args.orders, seed=args.seed)
+    # The app reads its configuration when it is imported
+    os.environ['DATABASE'] = path
+    from app import app
+
+    db = sqlite3.connect(path, check_same_thread=False)
+    rng = random.Random(args.seed)
+
+    for _ in range(args.warmup):
+        journey(app, db, rng, data, Recorder())
+
+    recorder = Recorder()
+    per_client = [args.iterations // args.clients + (i < args.iterations % args.clients)
+                  for i in range(args.clients)]
+
+    def client(index, iterations):
+        client_rng = random.Random(args.seed * 1000 + index)
+        for _ in range(iterations):
+            journey(app, db, client_rng, data, recorder)
+
+    threads = [threading.Thread(target=client, args=(i, n)) for i, n in enumerate(per_client)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+    summary = recorder.summary(wall_time)
+
+    total = sum(stats['count'] for stats in summary.values())
+    print('%d journeys, %d clients, %d requests in %.2fs (%.1f req/s)'
+          % (args.iterations, args.clients, total, wall_time, total / wall_time))
+    print('%-26s %6s %9s %9s %9s %9s %7s' % ('route', 'n', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for route, stats in summary.items():
+        print('%-26s %6d %9.1f %9.2f %9.2f %9.2f %7d' % (route, stats['count'], stats['req_per_sec'],
+                                                         stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                                                         stats['errors']))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    failed = any(stats['errors'] for stats in summary.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.percentile, args.max_regression, args.min_delta_ms)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
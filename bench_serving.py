@@ -0,0 +1,128 @@
+import http.cookiejar
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from db import ConnectionPool
+from migrations import migrate
+from passwords import ScryptHasher
+
+# Requests/sec on the read-heavy routes, sync (threaded WSGI dev server) vs
+# async (uvicorn + aiosqlite reader pool). Seeds a throwaway database, starts
+# the app once per mode and drives it with `clients` concurrent sessions.
+#   python bench_serving.py [seconds] [clients]
+# The async mode needs: pip install 'flask[async]' aiosqlite uvicorn
+
+VENDORS = 200
+SERVICES_PER_VENDOR = 20
+ORDERS = 2000
+
+ROUTES = ['/user_dashboard', '/vendor_services?category=Catering',
+          '/vendor_services?category=Catering&vendor_id=1', '/cart', '/my_orders']
+
+COMMANDS = {
+    'sync': [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', '{port}'],
+    'async': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', '{port}', '--log-level', 'warning'],
+}
+
+def seed(path):
+    migrate(path)
+    pool = ConnectionPool(path, size=1)
+    with pool.connection() as conn:
+        password = ScryptHasher().hash('bench')
+        conn.execute("INSERT INTO Users (name, email, password, phone) VALUES ('Bench', 'bench@example.com', ?, '0')",
+                     (password,))
+        categories = ['Catering', 'Florist', 'Decoration', 'Lighting']
+        conn.executemany('INSERT INTO Vendors (name, email, password, phone, category) VALUES (?, ?, ?, ?, ?)',
+                         [('Vendor %d' % i, 'v%d@example.com' % i, password, '0', categories[i % 4])
+                          for i in range(VENDORS)])
+        conn.executemany('INSERT INTO Services (vendor_id, name, description, price, category) VALUES (?, ?, ?, ?, ?)',
+                         [(v + 1, 'Service %d' % s, 'Bench service', 10.0 + s, categories[v % 4])
+                          for v in range(VENDORS) for s in range(SERVICES_PER_VENDOR)])
+        conn.executemany('INSERT INTO Cart (user_id, service_id, vendor_id, quantity) VALUES (1, ?, 1, 1)',
+                         [(s + 1,) for s in range(5)])
+        conn.executemany('''
+            INSERT INTO Orders (user_id, total, status, payment_method, customer_name, customer_email,
+                                customer_address, customer_city, customer_state, customer_pin, customer_phone)
+            VALUES (1, 10, 'Received', 'Cash', 'Bench', 'bench@example.com', 'a', 'b', 'c', 'd', 'e')
+        ''', [()] * ORDERS)
+        conn.commit()
+    pool.close_all()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Server at %s did not start' % base_url)
+
+def login(base_url):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    data = urllib.parse.urlencode({'email': 'bench@example.com', 'password': 'bench'}).encode()
+    opener.open(base_url + '/user_login', data).read()
+    return opener
+
+def drive(base_url, seconds, clients):
+    openers = [login(base_url) for _ in range(clients)]
+    counts = [0] * clients
+    errors = [0] * clients
+    deadline = time.monotonic() + seconds
+
+    def client(index):
+        opener = openers[index]
+        while time.monotonic() < deadline:
+            try:
+                opener.open(base_url + ROUTES[counts[index] % len(ROUTES)]).read()
+            except OSError:
+                errors[index] += 1
+            counts[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - started), sum(errors)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'bench.db')
+    seed(path)
+
+    print('%d concurrent clients, %.0fs per mode, routes: %s' % (clients, seconds, ', '.join(ROUTES)))
+    print('%-8s %12s %8s' % ('mode', 'req/sec', 'errors'))
+    for mode, command in COMMANDS.items():
+        port = free_port()
+        env = dict(os.environ, DATABASE=path, SERVING_MODE=mode)
+        server = subprocess.Popen([arg.format(port=port) for arg in command], env=env,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base_url = 'http://127.0.0.1:%d' % port
+            wait_until_up(base_url)
+            rate, errors = drive(base_url, seconds, clients)
+            print('%-8s %12.1f %8d' % (mode, rate, errors))
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import ConnectionPool
+from migrations import migrate
+from writer import WriteQueue
+
+# Add-to-cart writes/sec with `clients` concurrent request threads: each
+# thread committing on its own pooled connection (how routes wrote before)
+# against the single writer queue with group commit. Runs on a throwaway
+# database.
+#   python bench_writes.py [writes] [clients]
+
+ADD_TO_CART_SQL = '''
+    INSERT INTO Cart (user_id, service_id, vendor_id, quantity)
+    VALUES (?, ?, 1, 1)
+    ON CONFLICT (user_id, service_id, vendor_id)
+    DO UPDATE SET quantity = quantity + excluded.quantity
+'''
+
+def fresh_database():
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    migrate(path)
+    return path
+
+def pooled_writes(path, writes, clients):
+    pool = ConnectionPool(path, size=clients, busy_timeout=1000)
+    errors = []
+
+    def write(i):
+        with pool.connection() as conn:
+            try:
+                conn.execute(ADD_TO_CART_SQL, (i % 500, i % 50))
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    with ThreadPoolExecutor(max_workers=clients) as requests:
+        list(requests.map(write, range(writes)))
+    pool.close_all()
+    return len(errors), ''
+
+def queued_writes(path, writes, clients):
+    writer = WriteQueue(path)
+
+    def write(i):
+        writer.execute(ADD_TO_CART_SQL, (i % 500, i % 50))
+
+    with ThreadPoolExecutor(max_workers=clients) as requests:
+        list(requests.map(write, range(writes)))
+    stats = writer.stats()
+    return stats['failed_jobs'], 'avg batch %.1f, max queue depth %d' % (stats['avg_batch_size'],
+                                                                       stats['max_queue_depth'])
+
+def main():
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    print('%d writes, %d concurrent clients' % (writes, clients))
+    print('%-14s %12s %8s' % ('mode', 'writes/sec', 'errors'))
+    for name, run in [('pooled', pooled_writes), ('write queue', queued_writes)]:
+        path = fresh_database()
+        started = time.perf_counter()
+        errors, note = run(path, writes, clients)
+        elapsed = time.perf_counter() - started
+        print('%-14s %12.1f %8d  %s' % (name, writes / elapsed, errors, note))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import time
+from datetime import date, datetime, timedelta
+
+# Booking slots for services sold per event date (Services.daily_capacity is
+# set; see migrations.booking_slots). Adding such a service to the cart holds
+# the units on that date for HOLD_SECONDS; checkout turns the hold into a
+# booking. Every check reads the Slot_Bookings counters by primary key, so
+# it costs the same however many orders exist. The functions taking a
+# connection and changing data are writer jobs.
+
+HOLD_SECONDS = 30 * 60
+CALENDAR_DAYS = 30
+MAX_CALENDAR_DAYS = 92
+SWEEP_LIMIT = 500
+
+# Cart lines record the service version and price they were added at, for
+# checkout to compare against (see orders.check_cart_versions); adding to a
+# line brings it up to the current version. The vendor is always the
+# service's own, whatever the client sent.
+ADD_TO_CART_SQL = '''
+    INSERT INTO Cart (user_id, service_id, vendor_id, quantity, event_date, service_version, price)
+    SELECT ?, s.service_id, s.vendor_id, ?, ?, s.version, s.price FROM Services s WHERE s.service_id = ?
+    ON CONFLICT (user_id, service_id, vendor_id)
+    DO UPDATE SET quantity = quantity + excluded.quantity, event_date = COALESCE(excluded.event_date, event_date),
+                  service_version = excluded.service_version, price = excluded.price
+'''
+
+# A service is in the cart for one date at a time: adding it for another
+# date moves the whole line there
+SET_CART_LINE_SQL = '''
+    INSERT INTO Cart (user_id, service_id, vendor_id, quantity, event_date, service_version, price)
+    SELECT ?, s.service_id, s.vendor_id, ?, ?, s.version, s.price FROM Services s WHERE s.service_id = ?
+    ON CONFLICT (user_id, service_id, vendor_id)
+    DO UPDATE SET quantity = excluded.quantity, event_date = excluded.event_date,
+                  service_version = excluded.service_version, price = excluded.price
+    RETURNING cart_id
+'''
+
+HOLD_SQL = '''
+    INSERT INTO Booking_Holds (cart_id, user_id, service_id, day, quantity, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (cart_id) DO UPDATE SET
+        service_id = excluded.service_id, day = excluded.day, quantity = excluded.quantity,
+        expires_at = excluded.expires_at
+'''
+
+SLOT_SQL = '''
+    SELECT s.daily_capacity, sc.capacity as override, b.booked, b.held
+    FROM Services s
+    LEFT JOIN Service_Capacity sc ON sc.service_id = s.service_id AND sc.day = ?
+    LEFT JOIN Slot_Bookings b ON b.service_id = s.service_id AND b.day = ?
+    WHERE s.service_id = ?
+'''
+
+CART_SLOTS_SQL = '''
+    SELECT c.cart_id, c.service_id, c.vendor_id, c.quantity, c.event_date, s.name,
+           h.day as held_day, h.quantity as held_quantity, h.expires_at
+    FROM Cart c
+    JOIN Services s ON s.service_id = c.service_id
+    LEFT JOIN Booking_Holds h ON h.cart_id = c.cart_id
+    WHERE c.user_id = ? AND s.daily_capacity IS NOT NULL
+'''
+
+RELEASE_DAY_HOLDS_SQL = 'DELETE FROM Booking_Holds WHERE service_id = ? AND day = ? AND expires_at <= ?'
+
+SWEEP_HOLDS_SQL = '''
+    DELETE FROM Booking_Holds
+    WHERE cart_id IN (SELECT cart_id FROM Booking_Holds WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)
+'''
+
+CAPACITY_OVERRIDES_SQL = 'SELECT day, capacity FROM Service_Capacity WHERE service_id = ? AND day BETWEEN ? AND ?'
+
+SLOT_COUNTS_SQL = 'SELECT day, booked, held FROM Slot_Bookings WHERE service_id = ? AND day BETWEEN ? AND ?'
+
+LAPSED_HOLDS_SQL = '''
+    SELECT day, SUM(quantity) FROM Booking_Holds
+    WHERE service_id = ? AND day BETWEEN ? AND ? AND expires_at <= ?
+    GROUP BY day
+'''
+
+
+class BookingError(ValueError):
+    pass
+
+
+class SlotUnavailable(BookingError):
+    pass
+
+
+def parse_day(value, today=None):
+    # Event dates are YYYY-MM-DD, today or later
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise BookingError('Event dates must be given as YYYY-MM-DD')
+    if day < (today or date.today()):
+        raise BookingError('Event dates cannot be in the past')
+    return day.isoformat()
+
+def parse_calendar_range(args, today=None):
+    today = today or date.today()
+    try:
+        start = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else today
+        end = (datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to')
+               else start + timedelta(days=CALENDAR_DAYS - 1))
+    except ValueError:
+        raise BookingError('Dates must be given as YYYY-MM-DD')
+    if start > end or (end - start).days >= MAX_CALENDAR_DAYS:
+        raise BookingError('from must not be after to, and at most %d days apart' % MAX_CALENDAR_DAYS)
+    return start, end
+
+def release_expired_holds(conn, now, service_id=None, day=None):
+    # Deleting a hold gives its units back (trg_slot_bookings_holds_delete);
+    # the cart line stays and is held again at checkout if still available
+    if service_id is not None:
+        return conn.execute(RELEASE_DAY_HOLDS_SQL, (service_id, day, now)).rowcount
+    return conn.execute(SWEEP_HOLDS_SQL, (now, SWEEP_LIMIT)).rowcount
+
+def slot_left(conn, service_id, day, own_quantity=0):
+    # Units still free on `day`, counting `own_quantity` already held by the
+    # line asking as free. None when the service is not booked by date.
+    row = conn.execute(SLOT_SQL, (day, day, service_id)).fetchone()
+    if row is None or row['daily_capacity'] is None:
+        return None
+    capacity = row['override'] if row['override'] is not None else row['daily_capacity']
+    return capacity - (row['booked'] or 0) - (row['held'] or 0) + own_quantity
+
+def hold_line(conn, user_id, service_id, quantity, day, own_quantity, expires_at):
+    left = slot_left(conn, service_id, day, own_quantity)
+    if quantity > left:
+        raise SlotUnavailable('Only %d left on %s' % (max(left, 0), day) if left > 0
+                              else 'Fully booked on %s' % day)
+    cart_id = conn.execute(SET_CART_LINE_SQL, (user_id, quantity, day, service_id)).fetchall()[0][0]
+    conn.execute(HOLD_SQL, (cart_id, user_id, service_id, day, quantity, expires_at))
+    return cart_id
+
+def add_to_cart(conn, user_id, items, hold_seconds=HOLD_SECONDS):
+    # items: (service_id, vendor_id, quantity, event_date or None). Lines
+    # of date-booked services need an event date and are held on it; all
+    # items are added or, if one is unavailable, none. A vendor_id other
+    # than the service's is refused: it ends up on the order items.
+    now = time.time()
+    release_expired_holds(conn, now)
+    for service_id, vendor_id, quantity, day in items:
+        row = conn.execute('SELECT vendor_id, daily_capacity, archived_at FROM Services WHERE service_id = ?',
+                           (service_id,)).fetchone()
+        if row is None or row['archived_at'] is not None:
+            raise BookingError('This service is no longer available')
+        if row['vendor_id'] != vendor_id:
+            raise BookingError('This service is not offered by that vendor')
+        if row['daily_capacity'] is None:
+            conn.execute(ADD_TO_CART_SQL, (user_id, quantity, day, service_id))
+            continue
+        if day is None:
+            raise BookingError('Choose an event date for this service')
+
+        release_expired_holds(conn, now, service_id, day)
+        line = conn.execute('''
+            SELECT c.quantity, c.event_date, h.quantity as held
+            FROM Cart c LEFT JOIN Booking_Holds h ON h.cart_id = c.cart_id
+            WHERE c.user_id = ? AND c.service_id = ? AND c.vendor_id = ?
+        ''', (user_id, service_id, vendor_id)).fetchone()
+        if line is not None:
+            quantity += line['quantity']
+        own = (line['held'] or 0) if line is not None and line['event_date'] == day else 0
+        hold_line(conn, user_id, service_id, quantity, day, own, now + hold_seconds)
+
+def confirm_cart_slots(conn, user_id, now=None):
+    # Run by checkout before the order is written: every date-booked line
+    # must still have a live hold for its full quantity, or be held again
+    # now. Raises BookingError/SlotUnavailable naming the first line that
+    # cannot be booked.
+    now = now or time.time()
+    for line in conn.execute(CART_SLOTS_SQL, (user_id,)).fetchall():
+        if line['event_date'] is None:
+            raise BookingError('Choose an event date for %s' % line['name'])
+        if (line['held_day'] == line['event_date'] and line['held_quantity'] == line['quantity']
+                and line['expires_at'] > now):
+            continue
+        release_expired_holds(conn, now, line['service_id'], line['event_date'])
+        own = line['held_quantity'] if line['held_day'] == line['event_date'] and line['expires_at'] > now else 0
+        try:
+            hold_line(conn, user_id, line['service_id'], line['quantity'], line['event_date'], own or 0,
+                      now + HOLD_SECONDS)
+        except SlotUnavailable as e:
+            raise SlotUnavailable('%s: %s' % (line['name'], e))
+
+def set_capacity(conn, vendor_id, service_id, day, capacity):
+    # Writer job: overrides one date's capacity (None removes the override).
+    # Returns False if the service is not this vendor's; raises BookingError
+    # if it is not booked by date, as nothing would read the override.
+    row = conn.execute('SELECT daily_capacity FROM Services WHERE service_id = ? AND vendor_id = ?',
+                       (service_id, vendor_id)).fetchone()
+    if row is None:
+        return False
+    if row['daily_capacity'] is None:
+        raise BookingError('This service is not booked by date')
+    if capacity is None:
+        conn.execute('DELETE FROM Service_Capacity WHERE service_id = ? AND day = ?', (service_id, day))
+    else:
+        conn.execute('''
+            INSERT INTO Service_Capacity (service_id, day, capacity) VALUES (?, ?, ?)
+            ON CONFLICT (service_id, day) DO UPDATE SET capacity = excluded.capacity
+        ''', (service_id, day, capacity))
+    return True
+
+def availability(conn, service_id, start, end, now=None):
+    # Calendar for one service: capacity, booked, held and available units
+    # per day from start to end inclusive; one range scan per table.
+    # Returns None for an unknown service.
+    now = now or time.time()
+    service = conn.execute('SELECT service_id, vendor_id, daily_capacity FROM Services WHERE service_id = ?',
+                           (service_id,)).fetchone()
+    if service is None:
+        return None
+    result = {'service_id': service_id, 'vendor_id': service['vendor_id'],
+              'bookable': service['daily_capacity'] is not None, 'days': []}
+    if not result['bookable']:
+        return result
+
+    bounds = (service_id, start.isoformat(), end.isoformat())
+    overrides = dict(conn.execute(CAPACITY_OVERRIDES_SQL, bounds).fetchall())
+    counts = {row['day']: (row['booked'], row['held']) for row in conn.execute(SLOT_COUNTS_SQL, bounds)}
+    # Lapsed holds not yet released count as free
+    lapsed = dict(conn.execute(LAPSED_HOLDS_SQL, bounds + (now,)).fetchall())
+
+    day = start
+    while day <= end:
+        key = day.isoformat()
+        capacity = overrides.get(key, service['daily_capacity'])
+        booked, held = counts.get(key, (0, 0))
+        held -= lapsed.get(key, 0)
+        result['days'].append({'date': key, 'capacity': capacity, 'booked': booked, 'held': held,
+                               'available': max(capacity - booked - held, 0)})
+        day += timedelta(days=1)
+    return result
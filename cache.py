@@ -0,0 +1,201 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Thread-safe LRU cache whose entries also expire `ttl` seconds after
+    # they were stored
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+CATEGORIES_SQL = 'SELECT DISTINCT category FROM Vendors ORDER BY category'
+
+VENDORS_SQL = '''
+    SELECT DISTINCT v.vendor_id, v.name, v.category
+    FROM Vendors v
+    WHERE v.category = ?
+'''
+
+SERVICES_SQL = '''
+    SELECT * FROM Services
+    WHERE vendor_id = ? AND archived_at IS NULL
+'''
+
+CATALOG_VERSION_SQL = "SELECT value FROM Stats WHERE name = 'catalog_version'"
+
+
+def catalog_version(conn):
+    # Bumped by triggers on every vendor/service change (see
+    # migrations.catalog_version)
+    row = conn.execute(CATALOG_VERSION_SQL).fetchone()
+    return row[0] if row else 0
+
+
+class CatalogCache:
+    # Read-through cache for the vendor/service catalog browsed by users.
+    # Writers call the invalidate_* hooks; the TTL bounds how long another
+    # worker process can serve a stale entry. The *_async variants load
+    # through an async_db.AsyncReaderPool instead of a connection.
+    def __init__(self, maxsize=1024, ttl=300):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.version = None
+        self._version_lock = threading.Lock()
+
+    def sync_version(self, version):
+        # Drops everything once another worker has changed the catalog, so
+        # callers that know the current catalog_version never read stale
+        # entries
+        with self._version_lock:
+            if version != self.version:
+                if self.version is not None:
+                    self.cache.clear()
+                self.version = version
+
+    def categories(self, conn):
+        return self.cache.get_or_load(('categories',), lambda: [
+            row['category'] for row in conn.execute(CATEGORIES_SQL)
+        ])
+
+    def vendors(self, conn, category):
+        return self.cache.get_or_load(('vendors', category), lambda: [
+            dict(row) for row in conn.execute(VENDORS_SQL, (category,))
+        ])
+
+    def services(self, conn, vendor_id):
+        return self.cache.get_or_load(('services', str(vendor_id)), lambda: [
+            dict(row) for row in conn.execute(SERVICES_SQL, (vendor_id,))
+        ])
+
+    async def _get_or_load_async(self, key, load):
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = await load()
+            self.cache.set(key, value)
+        return value
+
+    async def categories_async(self, readers):
+        async def load():
+            return [row['category'] for row in await readers.fetchall(CATEGORIES_SQL)]
+        return await self._get_or_load_async(('categories',), load)
+
+    async def vendors_async(self, readers, category):
+        async def load():
+            return [dict(row) for row in await readers.fetchall(VENDORS_SQL, (category,))]
+        return await self._get_or_load_async(('vendors', category), load)
+
+    async def services_async(self, readers, vendor_id):
+        async def load():
+            return [dict(row) for row in await readers.fetchall(SERVICES_SQL, (vendor_id,))]
+        return await self._get_or_load_async(('services', str(vendor_id)), load)
+
+    def invalidate_vendors(self):
+        self.cache.invalidate_where(lambda key: key[0] in ('categories', 'vendors'))
+
+    def invalidate_services(self, vendor_id):
+        self.cache.invalidate(('services', str(vendor_id)))
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class PageCache:
+    # Rendered pages keyed by (endpoint, query args, catalog version, vary),
+    # each stored with a strong ETag: the hash of the exact body, so equal
+    # ETags mean byte-identical responses. Entries for old catalog versions
+    # are never hit again and age out of the LRU.
+    def __init__(self, maxsize=512, ttl=3600):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def key(endpoint, args, version, vary=None):
+        return (endpoint, tuple(sorted(args.items(multi=True))), version, vary)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, body):
+        if isinstance(body, str):
+            body = body.encode()
+        entry = (body, hashlib.sha256(body).hexdigest()[:32])
+        self.cache.set(key, entry)
+        return entry
+
+    def stats(self):
+        return self.cache.stats()
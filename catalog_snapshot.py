@@ -0,0 +1,261 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from cache import catalog_version
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# In-memory columnar copy of the orderable catalog for the browse API. Each
+# service is one slot in parallel arrays (id, vendor, price, category code,
+# live flag), about 25 bytes a service, sorted by service_id. Filtering by
+# category, vendor and price range and picking the top-k by price run over
+# whole columns: vectorized with NumPy when it is installed, as plain loops
+# over the arrays otherwise. Only the page of results is read back from
+# SQLite for names and descriptions.
+#
+# The arrays are never changed once published. refresh() reads the services
+# changed since the catalog_version it was built at (Services.change_seq,
+# see migrations.service_change_seq), patches copies of the arrays and swaps
+# them in, so queries run without a lock. Archived services stay in place
+# as dead slots until they make up a quarter of the arrays, when the
+# snapshot is rebuilt from scratch.
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_DEAD_FRACTION = 0.25
+
+SERVICES_SQL = 'SELECT service_id, vendor_id, price, category, archived_at FROM Services ORDER BY service_id'
+
+CHANGED_SQL = 'SELECT service_id, vendor_id, price, category, archived_at FROM Services WHERE change_seq > ?'
+
+DETAILS_SQL = '''
+    SELECT s.service_id, s.vendor_id, s.name, s.description, s.price, s.category, s.daily_capacity,
+           v.name as vendor_name
+    FROM Services s
+    JOIN Vendors v ON v.vendor_id = s.vendor_id
+    WHERE s.service_id IN (%s) AND s.archived_at IS NULL
+'''
+
+
+class BrowseError(ValueError):
+    pass
+
+
+def parse_browse(args):
+    # category, vendor_id, min_price, max_price, sort (price or -price) and
+    # limit from the query string
+    try:
+        vendor_id = int(args['vendor_id']) if args.get('vendor_id') else None
+        min_price = float(args['min_price']) if args.get('min_price') else None
+        max_price = float(args['max_price']) if args.get('max_price') else None
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BrowseError('vendor_id and limit must be integers, min_price and max_price numbers')
+    if args.get('sort', 'price') not in ('price', '-price'):
+        raise BrowseError('sort must be price or -price')
+    return {'category': args.get('category') or None, 'vendor_id': vendor_id, 'min_price': min_price,
+            'max_price': max_price, 'descending': args.get('sort') == '-price',
+            'limit': max(1, min(limit, MAX_LIMIT))}
+
+
+class _Columns:
+    def __init__(self, ids=None, vendors=None, prices=None, categories=None, live=None, names=None, dead=0):
+        self.ids = ids if ids is not None else array('q')
+        self.vendors = vendors if vendors is not None else array('q')
+        self.prices = prices if prices is not None else array('d')
+        self.categories = categories if categories is not None else array('i')
+        self.live = live if live is not None else array('b')
+        # Category code -> name, and back
+        self.names = names if names is not None else []
+        self.codes = {name: code for code, name in enumerate(self.names)}
+        self.dead = dead
+
+    def copy(self):
+        return _Columns(self.ids[:], self.vendors[:], self.prices[:], self.categories[:], self.live[:],
+                        list(self.names), self.dead)
+
+    def code(self, category):
+        if category not in self.codes:
+            self.codes[category] = len(self.names)
+            self.names.append(category)
+        return self.codes[category]
+
+    def append(self, row):
+        # Live services only; archived ones are left out of a rebuild
+        self.ids.append(row['service_id'])
+        self.vendors.append(row['vendor_id'])
+        self.prices.append(row['price'])
+        self.categories.append(self.code(row['category']))
+        self.live.append(1)
+
+    def set(self, pos, row):
+        was_live = self.live[pos]
+        self.vendors[pos] = row['vendor_id']
+        self.prices[pos] = row['price']
+        self.categories[pos] = self.code(row['category'])
+        self.live[pos] = row['archived_at'] is None
+        self.dead += was_live - self.live[pos]
+
+    def nbytes(self):
+        return sum(len(column) * column.itemsize
+                   for column in (self.ids, self.vendors, self.prices, self.categories, self.live))
+
+
+class CatalogSnapshot:
+    def __init__(self, use_numpy=True):
+        self.numpy = numpy if use_numpy else None
+        self.version = None
+        self._columns = _Columns()
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.rows_applied = 0
+        self.build_time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+
+    def refresh(self, conn):
+        # Brings the snapshot up to the current catalog_version; one index
+        # lookup when nothing changed. The version is read before the rows,
+        # so a change committed in between is read again next time.
+        version = catalog_version(conn)
+        if version == self.version:
+            return
+        with self._refresh_lock:
+            if version == self.version:
+                return
+            started = time.perf_counter()
+            if self.version is None:
+                self._rebuild(conn)
+            else:
+                changed = sorted(conn.execute(CHANGED_SQL, (self.version,)).fetchall(), key=lambda row: row[0])
+                if not self._apply(changed):
+                    self._rebuild(conn)
+            self.version = version
+            with self._lock:
+                self.build_time += time.perf_counter() - started
+
+    def _rebuild(self, conn):
+        columns = _Columns()
+        for row in conn.execute(SERVICES_SQL):
+            if row['archived_at'] is None:
+                columns.append(row)
+        self._columns = columns
+        with self._lock:
+            self.rebuilds += 1
+
+    def _apply(self, rows):
+        # Returns False when the changes cannot be patched in: a new service
+        # id below the highest one held, or too many dead slots
+        columns = self._columns.copy()
+        for row in rows:
+            pos = bisect_left(columns.ids, row['service_id'])
+            if pos < len(columns.ids) and columns.ids[pos] == row['service_id']:
+                columns.set(pos, row)
+            elif row['archived_at'] is not None:
+                continue
+            elif pos == len(columns.ids):
+                columns.append(row)
+            else:
+                return False
+        if columns.dead > MAX_DEAD_FRACTION * len(columns.ids):
+            return False
+        self._columns = columns
+        with self._lock:
+            self.refreshes += 1
+            self.rows_applied += len(rows)
+        return True
+
+    def query(self, category=None, vendor_id=None, min_price=None, max_price=None, descending=False,
+              limit=DEFAULT_LIMIT):
+        # Returns (number of matching services, ids of the `limit` cheapest,
+        # or dearest with descending, ties in service_id order)
+        started = time.perf_counter()
+        columns = self._columns
+        code = columns.codes.get(category) if category is not None else None
+        if category is not None and code is None:
+            result = 0, []
+        elif self.numpy is not None:
+            result = self._query_numpy(columns, code, vendor_id, min_price, max_price, descending, limit)
+        else:
+            result = self._query_arrays(columns, code, vendor_id, min_price, max_price, descending, limit)
+        with self._lock:
+            self.queries += 1
+            self.query_time += time.perf_counter() - started
+        return result
+
+    def _query_numpy(self, columns, code, vendor_id, min_price, max_price, descending, limit):
+        np = self.numpy
+        prices = np.frombuffer(columns.prices, dtype=np.float64)
+        mask = np.frombuffer(columns.live, dtype=np.int8) != 0
+        if code is not None:
+            mask &= np.frombuffer(columns.categories, dtype=columns.categories.typecode) == code
+        if vendor_id is not None:
+            mask &= np.frombuffer(columns.vendors, dtype=np.int64) == vendor_id
+        if min_price is not None:
+            mask &= prices >= min_price
+        if max_price is not None:
+            mask &= prices <= max_price
+
+        positions = np.flatnonzero(mask)
+        total = len(positions)
+        keys = -prices[positions] if descending else prices[positions]
+        if total > limit:
+            # Keep the k best keys and every tie with the k-th, then sort
+            # just those; positions are in service_id order and the sort is
+            # stable, so ties stay in service_id order
+            kth = np.partition(keys, limit - 1)[limit - 1]
+            best = keys <= kth
+            positions, keys = positions[best], keys[best]
+        positions = positions[np.argsort(keys, kind='stable')[:limit]]
+        ids = np.frombuffer(columns.ids, dtype=np.int64)
+        return total, ids[positions].tolist()
+
+    def _query_arrays(self, columns, code, vendor_id, min_price, max_price, descending, limit):
+        prices, live, categories, vendors = columns.prices, columns.live, columns.categories, columns.vendors
+        low = float('-inf') if min_price is None else min_price
+        high = float('inf') if max_price is None else max_price
+        positions = [pos for pos in range(len(prices))
+                     if live[pos] and low <= prices[pos] <= high
+                     and (code is None or categories[pos] == code)
+                     and (vendor_id is None or vendors[pos] == vendor_id)]
+        sign = -1 if descending else 1
+        best = heapq.nsmallest(limit, positions, key=lambda pos: (sign * prices[pos], pos))
+        return len(positions), [columns.ids[pos] for pos in best]
+
+    def browse(self, conn, **filters):
+        # query() plus the details of the page of services it picked, in
+        # the snapshot's order
+        total, ids = self.query(**filters)
+        services = []
+        if ids:
+            rows = {row['service_id']: dict(row)
+                    for row in conn.execute(DETAILS_SQL % ', '.join('?' * len(ids)), ids)}
+            services = [rows[service_id] for service_id in ids if service_id in rows]
+        return {'total': total, 'services': services, 'catalog_version': self.version}
+
+    def stats(self):
+        columns = self._columns
+        with self._lock:
+            return {
+                'services': len(columns.ids) - columns.dead,
+                'dead_slots': columns.dead,
+                'categories': len(columns.names),
+                'bytes': columns.nbytes(),
+                'numpy': self.numpy is not None,
+                'catalog_version': self.version,
+                'rebuilds': self.rebuilds,
+                'refreshes': self.refreshes,
+                'rows_applied': self.rows_applied,
+                'build_time_seconds': round(self.build_time, 6),
+                'queries': self.queries,
+                'query_time_seconds': round(self.query_time, 6),
+            }
@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Fixed-size pool of SQLite connections shared by the request threads of
+    # one worker process. Connections are opened lazily up to `size`; once
+    # the pool is full, callers wait up to `timeout` seconds for a release.
+    # A `readonly` pool refuses writes (PRAGMA query_only) for apps that send
+    # all writes through a writer.WriteQueue.
+    def __init__(self, path, size=8, timeout=10.0, busy_timeout=5000, statement_cache_size=256,
+                 readonly=False):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.statement_cache_size = statement_cache_size
+        self.readonly = readonly
+
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                               timeout=self.busy_timeout / 1000.0,
+                               check_same_thread=False,
+                               cached_statements=self.statement_cache_size)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA busy_timeout = %d' % int(self.busy_timeout))
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except Empty:
+            with self._lock:
+                self.timeouts += 1
+                self.wait_time += time.perf_counter() - started
+            raise PoolTimeout('No database connection available after %.1fs' % self.timeout)
+        with self._lock:
+            self.wait_time += time.perf_counter() - started
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A connection that cannot roll back is not safe to hand out again
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                'size': self.size,
+                'open': self._created,
+                'idle': idle,
+                'in_use': self._created - idle,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time_seconds': round(self.wait_time, 6),
+                'timeouts': self.timeouts,
+            }
+
+@contextmanager
+def transaction(conn, mode='IMMEDIATE'):
+    # Explicit transaction; IMMEDIATE takes the write lock up front so the
+    # statements inside never fail half-way on a lock upgrade. Inside an
+    # already open transaction (a writer.WriteQueue batch) it nests as a
+    # savepoint instead.
+    if conn.in_transaction:
+        conn.execute('SAVEPOINT nested')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK TO nested')
+            conn.execute('RELEASE nested')
+            raise
+        else:
+            conn.execute('RELEASE nested')
+        return
+
+    conn.execute('BEGIN ' + mode)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
@@ -0,0 +1,142 @@
+import csv
+import io
+import itertools
+import json
+from datetime import datetime, timedelta
+
+# Streaming exports. Rows are pulled from a dedicated pooled connection in
+# fetchmany() batches and encoded batch by batch, so memory stays flat no
+# matter how many rows match.
+
+BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ORDER_COLUMNS = ['order_id', 'user_id', 'total', 'status', 'payment_method', 'customer_name',
+                 'customer_email', 'customer_address', 'customer_city', 'customer_state',
+                 'customer_pin', 'customer_phone', 'created_at']
+
+ORDER_ITEM_COLUMNS = ['item_id', 'order_id', 'service_id', 'service_name', 'vendor_id',
+                      'quantity', 'price', 'status', 'created_at']
+
+VENDOR_REQUEST_COLUMNS = ['order_id', 'item_id', 'service_id', 'service_name', 'quantity', 'price',
+                          'status', 'customer_name', 'customer_email', 'customer_phone',
+                          'customer_address', 'customer_city', 'customer_state', 'customer_pin',
+                          'created_at']
+
+
+class ExportError(ValueError):
+    pass
+
+
+def date_range(args):
+    # from/to are inclusive calendar dates (YYYY-MM-DD) on the order's
+    # created_at; returned as the [start, end) bounds, None where not given
+    try:
+        start = datetime.strptime(args['from'], '%Y-%m-%d') if args.get('from') else None
+        end = datetime.strptime(args['to'], '%Y-%m-%d') + timedelta(days=1) if args.get('to') else None
+    except ValueError:
+        raise ExportError('Dates must be given as YYYY-MM-DD')
+    return (start.strftime('%Y-%m-%d') if start else None, end.strftime('%Y-%m-%d') if end else None)
+
+def parse_filters(args):
+    # status matches Orders.status exactly
+    clauses = []
+    params = []
+    start, end = date_range(args)
+    if start:
+        clauses.append('o.created_at >= ?')
+        params.append(start)
+    if end:
+        clauses.append('o.created_at < ?')
+        params.append(end)
+    if args.get('status'):
+        clauses.append('o.status = ?')
+        params.append(args['status'])
+    return clauses, params
+
+def export_format(args):
+    fmt = args.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ExportError('format must be one of: %s' % ', '.join(sorted(FORMATS)))
+    return fmt
+
+def stream_rows(pool, sql, params, batch_size=BATCH_SIZE):
+    with pool.connection() as conn:
+        cursor = conn.execute(sql, params)
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            cursor.close()
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(tuple(row) for row in batch)
+        yield buffer.getvalue()
+
+def encode_ndjson(columns, batches):
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in batch)
+
+def export_stream(pool, fmt, columns, sql, params, batch_size=BATCH_SIZE, archive=None, span=(None, None)):
+    # With an archive.OrderArchive, the archived orders in the [start, end)
+    # span come first, oldest month first, then the hot ones
+    batches = stream_rows(pool, sql, params, batch_size)
+    if archive is not None:
+        batches = itertools.chain(archive.stream(pool, sql, params, span[0], span[1], batch_size), batches)
+    if fmt == 'csv':
+        return encode_csv(columns, batches)
+    return encode_ndjson(columns, batches)
+
+def orders_query(args):
+    clauses, params = parse_filters(args)
+    sql = '''
+        SELECT o.order_id, o.user_id, o.total, o.status, o.payment_method, o.customer_name,
+               o.customer_email, o.customer_address, o.customer_city, o.customer_state,
+               o.customer_pin, o.customer_phone, o.created_at
+        FROM Orders o
+        WHERE %s
+        ORDER BY o.created_at, o.order_id
+    ''' % (' AND '.join(clauses) or '1')
+    return sql, params
+
+def order_items_query(args):
+    clauses, params = parse_filters(args)
+    sql = '''
+        SELECT oi.item_id, oi.order_id, oi.service_id, s.name, oi.vendor_id,
+               oi.quantity, oi.price, o.status, o.created_at
+        FROM Orders o
+        JOIN Order_Items oi ON oi.order_id = o.order_id
+        LEFT JOIN Services s ON s.service_id = oi.service_id
+        WHERE %s
+        ORDER BY o.created_at, o.order_id, oi.item_id
+    ''' % (' AND '.join(clauses) or '1')
+    return sql, params
+
+def vendor_requests_query(vendor_id, args):
+    clauses, params = parse_filters(args)
+    sql = '''
+        SELECT o.order_id, oi.item_id, oi.service_id, s.name, oi.quantity, oi.price,
+               o.status, o.customer_name, o.customer_email, o.customer_phone,
+               o.customer_address, o.customer_city, o.customer_state, o.customer_pin,
+               o.created_at
+        FROM Order_Items oi
+        JOIN Orders o ON o.order_id = oi.order_id
+        LEFT JOIN Services s ON s.service_id = oi.service_id
+        WHERE oi.vendor_id = ? AND %s
+        ORDER BY oi.order_id, oi.item_id
+    ''' % (' AND '.join(clauses) or '1')
+    return sql, [vendor_id] + params
@@ -0,0 +1,243 @@
+import bisect
+import logging
+import re
+import threading
+import time
+
+from flask import g, request
+
+# Opt-in request and SQL instrumentation (INSTRUMENTATION=1). When it is off
+# nothing here is installed: no request hooks, no connection wrapper, no
+# /metrics route. When on, every request records its latency per endpoint
+# and the number and total time of the SQL statements it ran on its pooled
+# connection; statements slower than `slow_query_seconds` are logged with
+# their bound parameters. Metrics are per process.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+log = logging.getLogger('eventmanagement.instrumentation')
+
+
+class Histogram:
+    # Cumulative-bucket histogram per label set, rendered in Prometheus text
+    # format
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((labels, list(counts), total, count)
+                            for labels, (counts, total, count) in self._series.items())
+        for labels, counts, total, count in series:
+            base = format_labels(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(
+                    list(zip(self.label_names, labels)) + [('le', format_value(bound))]), cumulative))
+            lines.append('%s_bucket%s %d' % (self.name, format_labels(
+                list(zip(self.label_names, labels)) + [('le', '+Inf')]), count))
+            lines.append('%s_sum%s %s' % (self.name, base, format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, base, count))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append('%s%s %s' % (self.name, format_labels(zip(self.label_names, labels)),
+                                      format_value(value)))
+        return lines
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else '%d' % value
+    return str(value)
+
+def format_labels(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                          .replace('"', '\\"').replace('\n', '\\n'))
+                             for name, value in pairs)
+
+def render_stats(prefix, stats):
+    # Flattens a stats() dict (pool, writer, caches) into untyped samples;
+    # nested dicts and non-numeric values are skipped
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = '%s_%s' % (prefix, key)
+        lines.append('# TYPE %s untyped' % name)
+        lines.append('%s %s' % (name, format_value(value)))
+    return lines
+
+
+class TracedCursor:
+    # Rows are produced while iterating/fetching, so that time counts too
+    __slots__ = ('_cursor', '_tracer')
+
+    def __init__(self, cursor, tracer):
+        self._cursor = cursor
+        self._tracer = tracer
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._tracer.add_time(time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    # Wraps the request's pooled connection; everything but execute and
+    # executemany is passed through untouched
+    __slots__ = ('_conn', '_tracer')
+
+    def __init__(self, conn, tracer):
+        self._conn = conn
+        self._tracer = tracer
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = self._conn.execute(sql, params)
+        self._tracer.record(sql, params, time.perf_counter() - started)
+        return TracedCursor(cursor, self._tracer)
+
+    def executemany(self, sql, seq_of_params):
+        started = time.perf_counter()
+        cursor = self._conn.executemany(sql, seq_of_params)
+        self._tracer.record(sql, '<executemany>', time.perf_counter() - started)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class Instrumentation:
+    def __init__(self, slow_query_seconds=0.1, slow_request_seconds=1.0):
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_request_seconds = slow_request_seconds
+        self.request_latency = Histogram('http_request_duration_seconds',
+                                         'Request latency by endpoint', ('endpoint', 'method'),
+                                         LATENCY_BUCKETS)
+        self.requests = Counter('http_requests_total', 'Requests by endpoint and status',
+                                ('endpoint', 'method', 'status'))
+        self.queries_per_request = Histogram('db_queries_per_request',
+                                             'SQL statements run per request', ('endpoint',),
+                                             QUERY_COUNT_BUCKETS)
+        self.query_time_per_request = Histogram('db_query_seconds_per_request',
+                                                'Total SQL time per request', ('endpoint',),
+                                                LATENCY_BUCKETS)
+        self.slow_queries = Counter('db_slow_queries_total', 'Statements slower than the threshold',
+                                    ('endpoint',))
+
+    def init_app(self, app, collectors=()):
+        # collectors: (prefix, callable returning a stats dict) pairs whose
+        # numbers are exported alongside the request metrics
+        self.collectors = collectors
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def wrap(self, conn):
+        return TracedConnection(conn, self)
+
+    def record(self, sql, params, elapsed):
+        if 'sql_count' not in g:
+            # A connection used outside a request (e.g. a CLI in app context)
+            return
+        g.sql_count += 1
+        g.sql_time += elapsed
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc((request.endpoint or 'unmatched',))
+            log.warning('Slow query (%.1f ms) on %s: %s params=%r', elapsed * 1000, request.path,
+                        re.sub(r'\s+', ' ', sql).strip(), params)
+
+    def add_time(self, elapsed):
+        if 'sql_time' in g:
+            g.sql_time += elapsed
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+
+    def after_request(self, response):
+        if 'request_started' not in g:
+            # An earlier before_request hook answered the request
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        self.request_latency.observe((endpoint, request.method), elapsed)
+        self.requests.inc((endpoint, request.method, str(response.status_code)))
+        self.queries_per_request.observe((endpoint,), g.sql_count)
+        self.query_time_per_request.observe((endpoint,), g.sql_time)
+        response.headers['Server-Timing'] = 'app;dur=%.2f, db;dur=%.2f;desc="%d queries"' % (
+            elapsed * 1000, g.sql_time * 1000, g.sql_count)
+        if elapsed >= self.slow_request_seconds:
+            log.warning('Slow request (%.1f ms, %d queries, %.1f ms SQL): %s %s', elapsed * 1000,
+                        g.sql_count, g.sql_time * 1000, request.method, request.full_path)
+        return response
+
+    def render(self):
+        lines = []
+        for metric in (self.request_latency, self.requests, self.queries_per_request,
+                       self.query_time_per_request, self.slow_queries):
+            lines.extend(metric.render())
+        for prefix, collect in self.collectors:
+            lines.extend(render_stats(prefix, collect()))
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
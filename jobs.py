@@ -0,0 +1,250 @@
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+# Durable background jobs in the Jobs table (see migrations.background_jobs).
+# Work is enqueued with enqueue() inside the writer job that makes the change
+# it follows up on, so the job commits with that change or not at all, and an
+# idempotency key turns a repeated enqueue into a no-op. Worker threads claim
+# due jobs through the writer, run the handler registered for the job's kind
+# and retry failures with exponential backoff until max_attempts. A claim is
+# a lease: if a worker dies, the job becomes due again once the lease runs
+# out, so handlers must tolerate running more than once (at-least-once).
+
+log = logging.getLogger('eventmanagement.jobs')
+
+ENQUEUE_SQL = '''
+    INSERT INTO Jobs (kind, payload, idempotency_key, max_attempts, run_at, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (idempotency_key) DO NOTHING
+'''
+
+NEXT_DUE_SQL = "SELECT MIN(run_at) FROM Jobs WHERE status IN ('pending', 'running')"
+
+CLAIM_SQL = '''
+    UPDATE Jobs SET status = 'running', run_at = ?, attempts = attempts + 1, worker = ?
+    WHERE job_id = (SELECT job_id FROM Jobs
+                    WHERE status IN ('pending', 'running') AND run_at <= ?
+                    ORDER BY run_at
+                    LIMIT 1)
+    RETURNING job_id, kind, payload, attempts, max_attempts
+'''
+
+# The worker and attempt guard against finishing a job whose lease expired
+# and that another worker has claimed since
+FINISH_SQL = '''
+    UPDATE Jobs SET status = ?, run_at = ?, last_error = ?, finished_at = ?
+    WHERE job_id = ? AND worker = ? AND attempts = ?
+'''
+
+PURGE_SQL = "DELETE FROM Jobs WHERE status = 'done' AND finished_at < ?"
+
+
+def enqueue(conn, kind, payload, key=None, delay=0, max_attempts=5):
+    # Call from inside a writer job. Returns False when a job with this
+    # idempotency key already exists.
+    now = time.time()
+    cursor = conn.execute(ENQUEUE_SQL, (kind, json.dumps(payload), key, max_attempts, now + delay, now))
+    return cursor.rowcount == 1
+
+def _claim_job(conn, worker, now, lease):
+    rows = conn.execute(CLAIM_SQL, (now + lease, worker, now)).fetchall()
+    return rows[0] if rows else None
+
+def _purge_jobs(conn, before):
+    return conn.execute(PURGE_SQL, (before,)).rowcount
+
+
+class JobQueue:
+    def __init__(self, pool, writer, workers=2, poll_interval=1.0, lease=300, backoff_base=5.0,
+                 backoff_max=3600, retention=7 * 86400):
+        # pool: read connections for handlers and for finding the next due
+        # job; writer: a WriteQueue for every change to the Jobs table
+        self.pool = pool
+        self.writer = writer
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retention = retention
+        self.handlers = {}
+
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wake = threading.Condition()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        self.claimed = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.lost = 0
+        self.purged = 0
+        self.run_time = 0.0
+
+    def register(self, kind, handler):
+        # handler(conn, payload): conn is a read-only pooled connection;
+        # writes go through the writer. Raising schedules a retry.
+        self.handlers[kind] = handler
+
+    def start(self):
+        # Started lazily so a forking server (gunicorn --preload) gets its
+        # worker threads in each worker process, not in the master
+        if self._threads or self.workers <= 0:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name='job-worker-%d' % i, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        # Wakes idle workers after this process enqueued work
+        with self._wake:
+            self._generation += 1
+            self._wake.notify_all()
+
+    def _next_due(self):
+        with self.pool.connection() as conn:
+            return conn.execute(NEXT_DUE_SQL).fetchone()[0]
+
+    def _idle(self, generation, seconds):
+        with self._wake:
+            if self._generation == generation and not self._stopping.is_set():
+                self._wake.wait(seconds)
+
+    def _work(self):
+        worker = '%s:%d:%s' % (socket.gethostname(), os.getpid(), threading.current_thread().name)
+        while not self._stopping.is_set():
+            with self._wake:
+                generation = self._generation
+            try:
+                # Peek on a read connection first, so idle workers never
+                # take the write lock just to find nothing to do
+                next_due = self._next_due()
+                now = time.time()
+                if next_due is None or next_due > now:
+                    self._maybe_purge(now)
+                    wait = self.poll_interval if next_due is None else min(self.poll_interval, next_due - now)
+                    self._idle(generation, wait)
+                    continue
+                job = self.writer.run(_claim_job, worker, now, self.lease)
+            except Exception:
+                log.exception('Job worker could not reach the database')
+                self._idle(generation, self.poll_interval)
+                continue
+            if job is None:
+                continue
+            try:
+                self._execute(worker, job)
+            except Exception:
+                log.exception('Job %d could not be finished; it runs again when its lease expires', job['job_id'])
+
+    def _execute(self, worker, job):
+        with self._lock:
+            self.claimed += 1
+        handler = self.handlers.get(job['kind'])
+        started = time.perf_counter()
+        error = None
+        try:
+            if handler is None:
+                raise LookupError('No handler registered for %r' % job['kind'])
+            with self.pool.connection() as conn:
+                handler(conn, json.loads(job['payload']))
+        except Exception as e:
+            error = e
+            log.warning('Job %d (%s) attempt %d/%d failed: %r', job['job_id'], job['kind'],
+                        job['attempts'], job['max_attempts'], e)
+        elapsed = time.perf_counter() - started
+        now = time.time()
+
+        if error is None:
+            params = ('done', now, None, now)
+            outcome = 'succeeded'
+        elif job['attempts'] >= job['max_attempts'] or handler is None:
+            params = ('failed', now, repr(error), now)
+            outcome = 'failed'
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (job['attempts'] - 1))
+            # Jitter spreads out retries of jobs that failed together
+            params = ('pending', now + delay * random.uniform(0.5, 1.0), repr(error), None)
+            outcome = 'retried'
+        result = self.writer.execute(FINISH_SQL, params + (job['job_id'], worker, job['attempts']))
+        if result.rowcount == 0:
+            outcome = 'lost'
+            log.warning('Job %d (%s) lease expired before it finished', job['job_id'], job['kind'])
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.run_time += elapsed
+
+    def _maybe_purge(self, now):
+        # Finished jobs are kept for `retention` seconds, then deleted
+        with self._lock:
+            if now - self._last_purge < 3600:
+                return
+            self._last_purge = now
+        purged = self.writer.run(_purge_jobs, now - self.retention)
+        with self._lock:
+            self.purged += purged
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self._threads),
+                'claimed': self.claimed,
+                'succeeded': self.succeeded,
+                'retried': self.retried,
+                'failed': self.failed,
+                'lost': self.lost,
+                'purged': self.purged,
+                'run_time_seconds': round(self.run_time, 6),
+            }
+
+
+def main():
+    # A standalone worker process, for running jobs outside the web workers
+    # (start the app with JOB_WORKERS=0 then)
+    from db import ConnectionPool
+    from migrations import migrate
+    from writer import WriteQueue
+    import notifications
+
+    parser = argparse.ArgumentParser(description='Run background jobs')
+    parser.add_argument('db', nargs='?', default=os.environ.get('DATABASE', 'database.db'))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    migrate(args.db)
+    pool = ConnectionPool(args.db, size=args.workers + 1, readonly=True)
+    queue = JobQueue(pool, WriteQueue(args.db), workers=args.workers, poll_interval=args.poll_interval)
+    notifications.register(queue, notifications.make_mailer(os.environ.get('MAIL_SERVER', ''),
+                                                            int(os.environ.get('MAIL_PORT', 25)),
+                                                            os.environ.get('MAIL_SENDER', notifications.SENDER)))
+    queue.start()
+    log.info('Running %d job workers on %s', args.workers, args.db)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        queue.stop(timeout=30)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,718 @@
+import sqlite3
+import sys
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run, so migrate() is safe to call on every startup and on an existing
+# database.db; it never drops data.
+MIGRATIONS = []
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+@migration
+def initial_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            phone TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Vendors (
+            vendor_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            phone TEXT,
+            category TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Services (
+            service_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            category TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (vendor_id) REFERENCES Vendors(vendor_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Cart (
+            cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            vendor_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES Users(user_id),
+            FOREIGN KEY (service_id) REFERENCES Services(service_id),
+            FOREIGN KEY (vendor_id) REFERENCES Vendors(vendor_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total REAL NOT NULL,
+            status TEXT DEFAULT 'Received',
+            payment_method TEXT NOT NULL,
+            customer_name TEXT NOT NULL,
+            customer_email TEXT NOT NULL,
+            customer_address TEXT NOT NULL,
+            customer_city TEXT NOT NULL,
+            customer_state TEXT NOT NULL,
+            customer_pin TEXT NOT NULL,
+            customer_phone TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES Users(user_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Order_Items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            vendor_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES Orders(order_id),
+            FOREIGN KEY (service_id) REFERENCES Services(service_id),
+            FOREIGN KEY (vendor_id) REFERENCES Vendors(vendor_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Admin (
+            admin_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+@migration
+def hot_path_indexes(conn):
+    # add_to_cart lookup and the cart page
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cart_user_service_vendor ON Cart(user_id, service_id, vendor_id)')
+    # vendor_services, manage_services, vendor_dashboard
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_services_vendor ON Services(vendor_id)')
+    # user_dashboard categories and vendor_services vendor list (covering)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_vendors_category ON Vendors(category, name)')
+    # request_item and vendor_dashboard
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_items_vendor_order ON Order_Items(vendor_id, order_id)')
+    # item counts per order
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON Order_Items(order_id)')
+    # my_orders and admin listings, newest first
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON Orders(user_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON Orders(created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON Users(created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_vendors_created ON Vendors(created_at)')
+
+@migration
+def unique_cart_key(conn):
+    # Fold duplicate rows left by the old read-then-write add_to_cart into
+    # the oldest row for each key before enforcing uniqueness
+    conn.execute('''
+        UPDATE Cart
+        SET quantity = (SELECT SUM(c2.quantity) FROM Cart c2
+                        WHERE c2.user_id = Cart.user_id
+                          AND c2.service_id = Cart.service_id
+                          AND c2.vendor_id = Cart.vendor_id)
+        WHERE cart_id IN (SELECT MIN(cart_id) FROM Cart
+                          GROUP BY user_id, service_id, vendor_id
+                          HAVING COUNT(*) > 1)
+    ''')
+    conn.execute('''
+        DELETE FROM Cart
+        WHERE cart_id NOT IN (SELECT MIN(cart_id) FROM Cart
+                              GROUP BY user_id, service_id, vendor_id)
+    ''')
+    conn.execute('DROP INDEX IF EXISTS idx_cart_user_service_vendor')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_user_service_vendor ON Cart(user_id, service_id, vendor_id)')
+
+@migration
+def dashboard_counters(conn):
+    # Counts shown on the admin and vendor dashboards, kept current by
+    # triggers so the dashboards never scan Users/Vendors/Orders/Order_Items
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Vendor_Stats (
+            vendor_id INTEGER PRIMARY KEY,
+            service_count INTEGER NOT NULL DEFAULT 0,
+            order_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    for table, name in (('Users', 'users'), ('Vendors', 'vendors'), ('Orders', 'orders')):
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_%(name)s_insert AFTER INSERT ON %(table)s
+            BEGIN
+                UPDATE Stats SET value = value + 1 WHERE name = '%(name)s';
+            END
+        ''' % {'table': table, 'name': name})
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_%(name)s_delete AFTER DELETE ON %(table)s
+            BEGIN
+                UPDATE Stats SET value = value - 1 WHERE name = '%(name)s';
+            END
+        ''' % {'table': table, 'name': name})
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vendor_stats_services_insert AFTER INSERT ON Services
+        BEGIN
+            INSERT INTO Vendor_Stats (vendor_id, service_count) VALUES (NEW.vendor_id, 1)
+            ON CONFLICT (vendor_id) DO UPDATE SET service_count = service_count + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vendor_stats_services_delete AFTER DELETE ON Services
+        BEGIN
+            UPDATE Vendor_Stats SET service_count = service_count - 1 WHERE vendor_id = OLD.vendor_id;
+        END
+    ''')
+    # An order counts once per vendor, on its first item for that vendor
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vendor_stats_order_items_insert AFTER INSERT ON Order_Items
+        WHEN NOT EXISTS (SELECT 1 FROM Order_Items
+                         WHERE vendor_id = NEW.vendor_id AND order_id = NEW.order_id
+                           AND item_id <> NEW.item_id)
+        BEGIN
+            INSERT INTO Vendor_Stats (vendor_id, order_count) VALUES (NEW.vendor_id, 1)
+            ON CONFLICT (vendor_id) DO UPDATE SET order_count = order_count + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vendor_stats_order_items_delete AFTER DELETE ON Order_Items
+        WHEN NOT EXISTS (SELECT 1 FROM Order_Items
+                         WHERE vendor_id = OLD.vendor_id AND order_id = OLD.order_id)
+        BEGIN
+            UPDATE Vendor_Stats SET order_count = order_count - 1 WHERE vendor_id = OLD.vendor_id;
+        END
+    ''')
+
+    conn.execute('''
+        INSERT OR REPLACE INTO Stats (name, value)
+        VALUES ('users', (SELECT COUNT(*) FROM Users)),
+               ('vendors', (SELECT COUNT(*) FROM Vendors)),
+               ('orders', (SELECT COUNT(*) FROM Orders))
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO Vendor_Stats (vendor_id, service_count, order_count)
+        SELECT v.vendor_id,
+               (SELECT COUNT(*) FROM Services s WHERE s.vendor_id = v.vendor_id),
+               (SELECT COUNT(DISTINCT oi.order_id) FROM Order_Items oi WHERE oi.vendor_id = v.vendor_id)
+        FROM Vendors v
+    ''')
+
+@migration
+def catalog_search_index(conn):
+    # External-content FTS5 indexes over the catalog; triggers keep them in
+    # step with Services and Vendors. prefix='2 3' keeps short prefix
+    # queries ("cat*") on an index instead of a full term scan.
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS Services_FTS USING fts5(
+            name, description, category,
+            content='Services', content_rowid='service_id', prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS Vendors_FTS USING fts5(
+            name, description, category,
+            content='Vendors', content_rowid='vendor_id', prefix='2 3'
+        )
+    ''')
+
+    for table, key in (('Services', 'service_id'), ('Vendors', 'vendor_id')):
+        names = {'table': table, 'fts': table + '_FTS', 'key': key}
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_%(fts)s_insert AFTER INSERT ON %(table)s
+            BEGIN
+                INSERT INTO %(fts)s (rowid, name, description, category)
+                VALUES (NEW.%(key)s, NEW.name, NEW.description, NEW.category);
+            END
+        ''' % names)
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_%(fts)s_delete AFTER DELETE ON %(table)s
+            BEGIN
+                INSERT INTO %(fts)s (%(fts)s, rowid, name, description, category)
+                VALUES ('delete', OLD.%(key)s, OLD.name, OLD.description, OLD.category);
+            END
+        ''' % names)
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_%(fts)s_update AFTER UPDATE OF name, description, category ON %(table)s
+            BEGIN
+                INSERT INTO %(fts)s (%(fts)s, rowid, name, description, category)
+                VALUES ('delete', OLD.%(key)s, OLD.name, OLD.description, OLD.category);
+                INSERT INTO %(fts)s (rowid, name, description, category)
+                VALUES (NEW.%(key)s, NEW.name, NEW.description, NEW.category);
+            END
+        ''' % names)
+        conn.execute("INSERT INTO %(fts)s (%(fts)s) VALUES ('rebuild')" % names)
+
+@migration
+def server_sessions(conn):
+    # Server-side sessions (see sessions.py). session_key is a hash of the
+    # cookie token; role/principal let all sessions of an account be revoked
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Sessions (
+            session_key TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            role TEXT,
+            principal TEXT,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_principal ON Sessions(role, principal)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON Sessions(last_seen)')
+
+@migration
+def catalog_version(conn):
+    # A counter bumped by every change to the browsable catalog. Response
+    # caches key on it, so a write in any worker process invalidates the
+    # cached pages of all of them.
+    conn.execute("INSERT OR IGNORE INTO Stats (name, value) VALUES ('catalog_version', 0)")
+    watched = {'Vendors': 'name, category, description', 'Services': 'vendor_id, name, description, price, category'}
+    for table, columns in watched.items():
+        for event in ('INSERT', 'DELETE', 'UPDATE OF ' + columns):
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_catalog_version_%s_%s AFTER %s ON %s
+                BEGIN
+                    UPDATE Stats SET value = value + 1 WHERE name = 'catalog_version';
+                END
+            ''' % (table.lower(), event.split()[0].lower(), event, table))
+
+# Daily sales rollups, keyed by (key, day, status) where day is the date the
+# order was placed: table -> (key columns, key expression over Order_Items oi,
+# order_count expression). An order counts once per vendor and category; per
+# service every line counts, as a service appears once per order.
+SALES_ROLLUPS = {
+    'Sales_Daily_Vendor': ('vendor_id', 'oi.vendor_id', 'COUNT(DISTINCT oi.order_id)'),
+    'Sales_Daily_Service': ('service_id, vendor_id', 'oi.service_id, oi.vendor_id', 'COUNT(*)'),
+    'Sales_Daily_Category': ('category', "COALESCE(oi.category, 'Uncategorized')", 'COUNT(DISTINCT oi.order_id)'),
+}
+
+SALES_ROLLUP_UPSERT = '''
+    INSERT INTO %(table)s (%(columns)s, day, status, quantity, revenue, order_count)
+    %(select)s
+    ON CONFLICT (%(key)s, day, status) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        order_count = order_count + excluded.order_count;
+'''
+
+@migration
+def sales_rollups(conn):
+    # Order_Items keeps the category an item was sold under, like its price,
+    # so editing or deleting a service does not move past sales
+    conn.execute('ALTER TABLE Order_Items ADD COLUMN category TEXT')
+    conn.execute('''
+        UPDATE Order_Items
+        SET category = (SELECT s.category FROM Services s WHERE s.service_id = Order_Items.service_id)
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Sales_Daily_Vendor (
+            vendor_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (vendor_id, day, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Sales_Daily_Service (
+            service_id INTEGER NOT NULL,
+            vendor_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (service_id, day, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Sales_Daily_Category (
+            category TEXT NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, day, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_daily_service_vendor ON Sales_Daily_Service(vendor_id, day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_daily_vendor_day ON Sales_Daily_Vendor(day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_daily_category_day ON Sales_Daily_Category(day)')
+
+    # Each new item is added under its order's current status; it counts
+    # the order for its vendor/category only if it is the first item there.
+    # Rows are never subtracted when items are deleted: the rollups record
+    # what was sold, not what is still stored.
+    new_item = []
+    for table, (columns, expr, orders) in SALES_ROLLUPS.items():
+        expr = expr.replace('oi.', 'NEW.')
+        if orders.startswith('COUNT(DISTINCT'):
+            key = columns
+            orders = '''CASE WHEN EXISTS (SELECT 1 FROM Order_Items oi
+                                         WHERE oi.order_id = NEW.order_id AND oi.item_id <> NEW.item_id
+                                           AND %s = %s) THEN 0 ELSE 1 END''' % (SALES_ROLLUPS[table][1], expr)
+        else:
+            orders = '1'
+        new_item.append(SALES_ROLLUP_UPSERT % {
+            'table': table, 'columns': columns, 'key': columns.split(',')[0],
+            'select': '''SELECT %s, date(o.created_at), o.status, NEW.quantity, NEW.quantity * NEW.price, %s
+                         FROM Orders o WHERE o.order_id = NEW.order_id''' % (expr, orders)})
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_sales_order_items_insert AFTER INSERT ON Order_Items
+        BEGIN
+            %s
+        END
+    ''' % ''.join(new_item))
+
+    # A status change moves the whole order from the old status to the new
+    moves = []
+    for sign, status in (('-', 'OLD.status'), ('', 'NEW.status')):
+        for table, (columns, expr, orders) in SALES_ROLLUPS.items():
+            moves.append(SALES_ROLLUP_UPSERT % {
+                'table': table, 'columns': columns, 'key': columns.split(',')[0],
+                'select': '''SELECT %(expr)s, date(NEW.created_at), %(status)s, %(sign)sSUM(oi.quantity),
+                                  %(sign)sSUM(oi.quantity * oi.price), %(sign)s%(orders)s
+                           FROM Order_Items oi WHERE oi.order_id = NEW.order_id
+                           GROUP BY %(expr)s''' % {'expr': expr, 'status': status, 'sign': sign, 'orders': orders}})
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_sales_orders_status AFTER UPDATE OF status ON Orders
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            %s
+        END
+    ''' % ''.join(moves))
+
+    for table, (columns, expr, orders) in SALES_ROLLUPS.items():
+        conn.execute(SALES_ROLLUP_UPSERT.rstrip().rstrip(';') % {
+            'table': table, 'columns': columns, 'key': columns.split(',')[0],
+            'select': '''SELECT %(expr)s, date(o.created_at), o.status, SUM(oi.quantity),
+                              SUM(oi.quantity * oi.price), %(orders)s
+                       FROM Order_Items oi JOIN Orders o ON o.order_id = oi.order_id
+                       GROUP BY %(expr)s, date(o.created_at), o.status''' % {'expr': expr, 'orders': orders}})
+
+@migration
+def order_status_events(conn):
+    # Append-only log of order status changes, written by triggers in the
+    # same transaction as the order insert or status update. event_id is the
+    # change-feed cursor, so it must never be reused (AUTOINCREMENT).
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Order_Status_Events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            old_status TEXT,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_status_events_user ON Order_Status_Events(user_id, event_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_order_status_events_insert AFTER INSERT ON Orders
+        BEGIN
+            INSERT INTO Order_Status_Events (order_id, user_id, old_status, status)
+            VALUES (NEW.order_id, NEW.user_id, NULL, NEW.status);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_order_status_events_update AFTER UPDATE OF status ON Orders
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO Order_Status_Events (order_id, user_id, old_status, status)
+            VALUES (NEW.order_id, NEW.user_id, OLD.status, NEW.status);
+        END
+    ''')
+
+    # Existing orders start the log with their current status
+    conn.execute('''
+        INSERT INTO Order_Status_Events (order_id, user_id, old_status, status, created_at)
+        SELECT order_id, user_id, NULL, status, created_at FROM Orders ORDER BY order_id
+    ''')
+
+@migration
+def background_jobs(conn):
+    # Durable job queue (see jobs.py). A claimed job is 'running' with
+    # run_at pushed to the end of its lease, so due work, including jobs
+    # whose worker died, is one range scan of the partial index.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at REAL NOT NULL,
+            worker TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_due ON Jobs(run_at) WHERE status IN ('pending', 'running')
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_finished ON Jobs(finished_at) WHERE status = 'done'
+    ''')
+
+@migration
+def booking_slots(conn):
+    # Date-booked services. daily_capacity is how many units of a service can
+    # be booked for one event date (NULL: not booked by date) and
+    # Service_Capacity overrides it for single dates (0 blocks a date).
+    # Slot_Bookings keeps booked (ordered) and held (in carts) units per
+    # service and date, maintained by triggers, so checking a date is one
+    # primary-key lookup and a calendar is one range scan.
+    conn.execute('ALTER TABLE Services ADD COLUMN daily_capacity INTEGER')
+    conn.execute('ALTER TABLE Cart ADD COLUMN event_date TEXT')
+    conn.execute('ALTER TABLE Order_Items ADD COLUMN event_date TEXT')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Service_Capacity (
+            service_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            capacity INTEGER NOT NULL,
+            PRIMARY KEY (service_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Slot_Bookings (
+            service_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0,
+            held INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (service_id, day)
+        ) WITHOUT ROWID
+    ''')
+    # One hold per cart line; it lapses at expires_at unless checked out
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Booking_Holds (
+            cart_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_booking_holds_slot ON Booking_Holds(service_id, day, expires_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_booking_holds_expires ON Booking_Holds(expires_at)')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_bookings_holds_insert AFTER INSERT ON Booking_Holds
+        BEGIN
+            INSERT INTO Slot_Bookings (service_id, day, held) VALUES (NEW.service_id, NEW.day, NEW.quantity)
+            ON CONFLICT (service_id, day) DO UPDATE SET held = held + excluded.held;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_bookings_holds_delete AFTER DELETE ON Booking_Holds
+        BEGIN
+            UPDATE Slot_Bookings SET held = held - OLD.quantity WHERE service_id = OLD.service_id AND day = OLD.day;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_bookings_holds_update
+        AFTER UPDATE OF service_id, day, quantity ON Booking_Holds
+        BEGIN
+            UPDATE Slot_Bookings SET held = held - OLD.quantity WHERE service_id = OLD.service_id AND day = OLD.day;
+            INSERT INTO Slot_Bookings (service_id, day, held) VALUES (NEW.service_id, NEW.day, NEW.quantity)
+            ON CONFLICT (service_id, day) DO UPDATE SET held = held + excluded.held;
+        END
+    ''')
+    # Removing a cart line (or checking it out) releases its hold
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_booking_holds_cart_delete AFTER DELETE ON Cart
+        BEGIN
+            DELETE FROM Booking_Holds WHERE cart_id = OLD.cart_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_bookings_order_items_insert AFTER INSERT ON Order_Items
+        WHEN NEW.event_date IS NOT NULL
+        BEGIN
+            INSERT INTO Slot_Bookings (service_id, day, booked) VALUES (NEW.service_id, NEW.event_date, NEW.quantity)
+            ON CONFLICT (service_id, day) DO UPDATE SET booked = booked + excluded.booked;
+        END
+    ''')
+
+    # Capacity shows on the catalog pages, so it is part of the catalog version
+    conn.execute('DROP TRIGGER IF EXISTS trg_catalog_version_services_update')
+    conn.execute('''
+        CREATE TRIGGER trg_catalog_version_services_update
+        AFTER UPDATE OF vendor_id, name, description, price, category, daily_capacity ON Services
+        BEGIN
+            UPDATE Stats SET value = value + 1 WHERE name = 'catalog_version';
+        END
+    ''')
+
+@migration
+def service_versions(conn):
+    # Optimistic concurrency between vendor edits and checkout. Every change
+    # to a service bumps Services.version, and a cart line records the
+    # version and price it was added at, so checkout finds the lines that
+    # changed underneath it in one query instead of locking the catalog.
+    # Services are archived (archived_at set) rather than deleted, so
+    # Order_Items and carts never point at a missing service; archived
+    # services leave the catalog, search and the vendor's service count.
+    conn.execute('ALTER TABLE Services ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    conn.execute('ALTER TABLE Services ADD COLUMN archived_at TIMESTAMP')
+    conn.execute('ALTER TABLE Cart ADD COLUMN service_version INTEGER')
+    conn.execute('ALTER TABLE Cart ADD COLUMN price REAL')
+    conn.execute('''
+        UPDATE Cart SET service_version = s.version, price = s.price
+        FROM Services s
+        WHERE s.service_id = Cart.service_id
+    ''')
+
+    # Writers that set version themselves are left alone
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_services_version
+        AFTER UPDATE OF vendor_id, name, description, price, category, daily_capacity, archived_at ON Services
+        WHEN NEW.version = OLD.version
+        BEGIN
+            UPDATE Services SET version = OLD.version + 1 WHERE service_id = NEW.service_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vendor_stats_services_archive AFTER UPDATE OF archived_at ON Services
+        WHEN (OLD.archived_at IS NULL) <> (NEW.archived_at IS NULL)
+        BEGIN
+            UPDATE Vendor_Stats SET service_count = service_count + (CASE WHEN NEW.archived_at IS NULL THEN 1 ELSE -1 END)
+            WHERE vendor_id = NEW.vendor_id;
+        END
+    ''')
+
+    conn.execute('DROP TRIGGER IF EXISTS trg_catalog_version_services_update')
+    conn.execute('''
+        CREATE TRIGGER trg_catalog_version_services_update
+        AFTER UPDATE OF vendor_id, name, description, price, category, daily_capacity, archived_at ON Services
+        BEGIN
+            UPDATE Stats SET value = value + 1 WHERE name = 'catalog_version';
+        END
+    ''')
+
+@migration
+def service_change_seq(conn):
+    # Services.change_seq is the catalog_version a service last changed at,
+    # so a process holding a copy of the catalog (catalog_snapshot.py) reads
+    # back only the services changed since its version, off an index.
+    # Updating change_seq itself fires none of the Services triggers.
+    conn.execute('ALTER TABLE Services ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_services_change_seq ON Services(change_seq)')
+    watched = 'vendor_id, name, description, price, category, daily_capacity, archived_at'
+    for event in ('INSERT', 'UPDATE OF ' + watched):
+        name = 'trg_catalog_version_services_' + event.split()[0].lower()
+        conn.execute('DROP TRIGGER IF EXISTS ' + name)
+        conn.execute('''
+            CREATE TRIGGER %s AFTER %s ON Services
+            BEGIN
+                UPDATE Stats SET value = value + 1 WHERE name = 'catalog_version';
+                UPDATE Services SET change_seq = (SELECT value FROM Stats WHERE name = 'catalog_version')
+                WHERE service_id = NEW.service_id;
+            END
+        ''' % (name, event))
+
+@migration
+def order_archives(conn):
+    # Old delivered orders are moved into per-month partition files (see
+    # archive.py); Order_Archives lists them with the created_at and
+    # order_id range each holds, so queries attach only the partitions a
+    # request can reach. Moving an order out is not deleting it: while the
+    # 'archiving' flag is set (only ever inside the archive job's own
+    # transaction) the dashboard counters keep counting it. The sales
+    # rollups and slot bookings have no delete triggers to begin with.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Order_Archives (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            items INTEGER NOT NULL DEFAULT 0,
+            first_created_at TEXT,
+            last_created_at TEXT,
+            first_order_id INTEGER,
+            last_order_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO Stats (name, value) VALUES ('archiving', 0)")
+
+    conn.execute('DROP TRIGGER IF EXISTS trg_stats_orders_delete')
+    conn.execute('''
+        CREATE TRIGGER trg_stats_orders_delete AFTER DELETE ON Orders
+        WHEN (SELECT value FROM Stats WHERE name = 'archiving') = 0
+        BEGIN
+            UPDATE Stats SET value = value - 1 WHERE name = 'orders';
+        END
+    ''')
+    conn.execute('DROP TRIGGER IF EXISTS trg_vendor_stats_order_items_delete')
+    conn.execute('''
+        CREATE TRIGGER trg_vendor_stats_order_items_delete AFTER DELETE ON Order_Items
+        WHEN (SELECT value FROM Stats WHERE name = 'archiving') = 0
+             AND NOT EXISTS (SELECT 1 FROM Order_Items
+                             WHERE vendor_id = OLD.vendor_id AND order_id = OLD.order_id)
+        BEGIN
+            UPDATE Vendor_Stats SET order_count = order_count - 1 WHERE vendor_id = OLD.vendor_id;
+        END
+    ''')
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        applied = []
+        for version, func in enumerate(MIGRATIONS, start=1):
+            # Take the write lock before re-checking the version so several
+            # workers starting at once apply each migration exactly once
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if schema_version(conn) >= version:
+                    conn.execute('ROLLBACK')
+                    continue
+                func(conn)
+                conn.execute('PRAGMA user_version = %d' % version)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            applied.append(func.__name__)
+        return applied
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    applied = migrate(db_path)
+    print('Applied %d migration(s), schema version %d' % (len(applied), len(MIGRATIONS)))
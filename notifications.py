@@ -0,0 +1,108 @@
+import logging
+import smtplib
+from email.message import EmailMessage
+
+from jobs import enqueue
+
+# Order emails. Checkout and status updates only enqueue jobs in their own
+# transaction; the emails are sent later by the job workers, so requests
+# never wait on a mail server and a failed send is retried. Without a mail
+# server configured the messages are logged instead.
+
+SENDER = 'no-reply@eventmanagement.local'
+
+ORDER_SQL = '''
+    SELECT order_id, total, status, payment_method, customer_name, customer_email, created_at
+    FROM Orders
+    WHERE order_id = ?
+'''
+
+ORDER_LINES_SQL = '''
+    SELECT oi.vendor_id, COALESCE(s.name, 'Service #' || oi.service_id) as name, oi.quantity, oi.price
+    FROM Order_Items oi
+    LEFT JOIN Services s ON s.service_id = oi.service_id
+    WHERE oi.order_id = ?
+    ORDER BY oi.item_id
+'''
+
+log = logging.getLogger('eventmanagement.notifications')
+
+
+class LogMailer:
+    def send(self, to, subject, body):
+        log.info('Mail to %s: %s\n%s', to, subject, body)
+
+
+class SMTPMailer:
+    def __init__(self, host, port=25, sender=SENDER, timeout=30):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.timeout = timeout
+
+    def send(self, to, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to
+        message['Subject'] = subject
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+
+def make_mailer(server='', port=25, sender=SENDER):
+    return SMTPMailer(server, port, sender) if server else LogMailer()
+
+def format_lines(lines):
+    return '\n'.join('  %s x %d @ Rs. %.2f' % (line['name'], line['quantity'], line['price']) for line in lines)
+
+# Enqueued from writer jobs, in the transaction that placed or updated the
+# order. The keys make each email a single job however often this runs.
+
+def order_placed(conn, order_id):
+    enqueue(conn, 'order_confirmation', {'order_id': order_id}, key='order_confirmation:%d' % order_id)
+    for row in conn.execute('SELECT DISTINCT vendor_id FROM Order_Items WHERE order_id = ?', (order_id,)).fetchall():
+        enqueue(conn, 'vendor_new_order', {'order_id': order_id, 'vendor_id': row[0]},
+                key='vendor_new_order:%d:%d' % (order_id, row[0]))
+
+def order_status_changed(conn, order_id, event_id):
+    enqueue(conn, 'order_status', {'order_id': order_id, 'event_id': event_id},
+            key='order_status:%d:%d' % (order_id, event_id))
+
+# Job handlers. An order that no longer exists has nothing left to send.
+
+def send_order_confirmation(conn, mailer, payload):
+    order = conn.execute(ORDER_SQL, (payload['order_id'],)).fetchone()
+    if order is None:
+        return
+    lines = conn.execute(ORDER_LINES_SQL, (order['order_id'],)).fetchall()
+    mailer.send(order['customer_email'], 'Order #%d received' % order['order_id'],
+                'Hi %s,\n\nThank you for your order placed on %s.\n\n%s\n\nTotal: Rs. %.2f (%s)\n'
+                % (order['customer_name'], order['created_at'], format_lines(lines), order['total'],
+                   order['payment_method']))
+
+def send_vendor_new_order(conn, mailer, payload):
+    order = conn.execute(ORDER_SQL, (payload['order_id'],)).fetchone()
+    vendor = conn.execute('SELECT name, email FROM Vendors WHERE vendor_id = ?', (payload['vendor_id'],)).fetchone()
+    if order is None or vendor is None:
+        return
+    lines = [line for line in conn.execute(ORDER_LINES_SQL, (order['order_id'],))
+             if line['vendor_id'] == payload['vendor_id']]
+    mailer.send(vendor['email'], 'New order #%d' % order['order_id'],
+                'Hi %s,\n\n%s ordered:\n\n%s\n\nSee Requested Items to process it.\n'
+                % (vendor['name'], order['customer_name'], format_lines(lines)))
+
+def send_status_update(conn, mailer, payload):
+    event = conn.execute('SELECT status FROM Order_Status_Events WHERE event_id = ?',
+                         (payload['event_id'],)).fetchone()
+    order = conn.execute(ORDER_SQL, (payload['order_id'],)).fetchone()
+    if order is None or event is None:
+        return
+    mailer.send(order['customer_email'], 'Order #%d: %s' % (order['order_id'], event['status']),
+                'Hi %s,\n\nYour order #%d is now: %s.\n' % (order['customer_name'], order['order_id'],
+                                                             event['status']))
+
+def register(queue, mailer):
+    queue.register('order_confirmation', lambda conn, payload: send_order_confirmation(conn, mailer, payload))
+    queue.register('vendor_new_order', lambda conn, payload: send_vendor_new_order(conn, mailer, payload))
+    queue.register('order_status', lambda conn, payload: send_status_update(conn, mailer, payload))
@@ -0,0 +1,134 @@
+import math
+import threading
+import time
+
+# Change feed over Order_Status_Events (see migrations.order_status_events).
+# Clients pass the last event_id they have seen as the cursor and get only
+# newer events for their own orders (users) or orders holding their items
+# (vendors). With no new events the request long-polls: it waits on a
+# condition that this process signals after its own writes, and re-checks
+# the newest event id at least every `poll_interval` seconds to notice
+# writes made by other worker processes. No pooled connection is held while
+# waiting.
+
+LATEST_EVENT_SQL = "SELECT seq FROM sqlite_sequence WHERE name = 'Order_Status_Events'"
+
+USER_EVENTS_SQL = '''
+    SELECT event_id, order_id, old_status, status, created_at
+    FROM Order_Status_Events
+    WHERE user_id = ? AND event_id > ?
+    ORDER BY event_id
+    LIMIT ?
+'''
+
+VENDOR_EVENTS_SQL = '''
+    SELECT e.event_id, e.order_id, e.old_status, e.status, e.created_at
+    FROM Order_Status_Events e
+    WHERE e.event_id > ?
+      AND EXISTS (SELECT 1 FROM Order_Items oi WHERE oi.vendor_id = ? AND oi.order_id = e.order_id)
+    ORDER BY e.event_id
+    LIMIT ?
+'''
+
+
+class FeedError(ValueError):
+    pass
+
+
+def parse_cursor(args, max_wait):
+    # after: last event_id seen (omitted: start from now); timeout: seconds
+    # to wait for new events, capped at max_wait
+    try:
+        after = int(args['after']) if args.get('after') else None
+        timeout = float(args.get('timeout', max_wait))
+    except ValueError:
+        after, timeout = -1, 0.0
+    if (after is not None and after < 0) or not math.isfinite(timeout):
+        raise FeedError('after must be an event id and timeout a number of seconds')
+    return after, min(max(timeout, 0.0), max_wait)
+
+def latest_event_id(conn):
+    row = conn.execute(LATEST_EVENT_SQL).fetchone()
+    return row[0] if row else 0
+
+def user_events(conn, user_id, after, limit):
+    return conn.execute(USER_EVENTS_SQL, (user_id, after, limit)).fetchall()
+
+def vendor_events(conn, vendor_id, after, limit):
+    return conn.execute(VENDOR_EVENTS_SQL, (after, vendor_id, limit)).fetchall()
+
+
+class OrderFeed:
+    def __init__(self, pool, poll_interval=1.0, max_wait=25.0, batch_size=100):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self._changed = threading.Condition()
+        self._generation = 0
+
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.requests = 0
+        self.timeouts = 0
+        self.polls = 0
+
+    def notify(self):
+        # Called after this process committed an order insert or status change
+        with self._changed:
+            self._generation += 1
+            self._changed.notify_all()
+
+    def _check(self, fetch, principal, after):
+        # Returns (rows, cursor). When newer events exist but none are for
+        # this principal, the cursor still moves up to the newest event.
+        with self.pool.connection() as conn:
+            latest = latest_event_id(conn)
+            if after is None or latest <= after:
+                return [], latest if after is None else after
+            rows = fetch(conn, principal, after, self.batch_size)
+        if rows:
+            return rows, rows[-1]['event_id']
+        return rows, latest
+
+    def wait(self, fetch, principal, after, timeout):
+        # fetch is user_events or vendor_events; returns (events, cursor,
+        # more) where more means another batch is ready right away
+        with self._lock:
+            self.requests += 1
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                with self._changed:
+                    generation = self._generation
+                rows, cursor = self._check(fetch, principal, after)
+                with self._lock:
+                    self.polls += 1
+                if rows or after is None:
+                    return [dict(row) for row in rows], cursor, len(rows) == self.batch_size
+                after = cursor
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.timeouts += 1
+                    return [], cursor, False
+                with self._changed:
+                    if self._generation == generation:
+                        self._changed.wait(min(self.poll_interval, remaining))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'requests': self.requests,
+                'timeouts': self.timeouts,
+                'polls': self.polls,
+            }
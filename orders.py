@@ -0,0 +1,197 @@
+from dataclasses import dataclass, field
+
+from bookings import confirm_cart_slots
+from db import transaction
+from pagination import keyset_page
+
+# Cart lines added at another version of their service, or whose service
+# has been archived (or, before archiving existed, deleted)
+STALE_CART_LINES_SQL = '''
+    SELECT c.cart_id, c.service_version, c.price as cart_price, s.name, s.version, s.price, s.archived_at
+    FROM Cart c
+    LEFT JOIN Services s ON s.service_id = c.service_id
+    WHERE c.user_id = ? AND (c.service_version IS NOT s.version OR s.archived_at IS NOT NULL OR s.service_id IS NULL)
+'''
+
+VENDOR_ORDERS_SQL = '''
+    SELECT o.order_id, o.customer_name, o.customer_email, o.customer_address,
+           o.customer_city, o.customer_state, o.customer_pin, o.customer_phone,
+           o.status, o.created_at, o.total
+    FROM Order_Items oi
+    JOIN Orders o ON o.order_id = oi.order_id
+    WHERE oi.vendor_id = ? AND %s AND {keyset}
+    GROUP BY oi.order_id
+    ORDER BY {order}
+    LIMIT ?
+'''
+
+VENDOR_ORDER_ITEMS_SQL = '''
+    SELECT oi.order_id, oi.item_id, oi.service_id, s.name, oi.quantity, oi.price
+    FROM Order_Items oi
+    LEFT JOIN Services s ON s.service_id = oi.service_id
+    WHERE oi.vendor_id = ? AND oi.order_id IN (%s)
+    ORDER BY oi.order_id, oi.item_id
+'''
+
+
+class StaleCartError(ValueError):
+    pass
+
+
+class OrderNotFound(ValueError):
+    pass
+
+
+def check_cart_versions(conn, user_id):
+    # Run by checkout inside its write transaction, so no vendor edit can
+    # land between this check and the order insert. Lines whose service
+    # changed without changing price are moved up to the current version and
+    # checkout goes on; lines whose price changed or whose service was
+    # archived raise StaleCartError (see refresh_cart).
+    stale = conn.execute(STALE_CART_LINES_SQL, (user_id,)).fetchall()
+    problems = []
+    for line in stale:
+        if line['version'] is None or line['archived_at'] is not None:
+            problems.append('%s is no longer available' % (line['name'] or 'A service'))
+        elif line['cart_price'] is not None and line['cart_price'] != line['price']:
+            problems.append('%s now costs Rs. %.2f (was Rs. %.2f)' % (line['name'], line['price'], line['cart_price']))
+    if problems:
+        raise StaleCartError('Your cart changed: %s. Please review it and check out again.' % '; '.join(problems))
+    conn.executemany('UPDATE Cart SET service_version = ?, price = ? WHERE cart_id = ?',
+                     [(line['version'], line['price'], line['cart_id']) for line in stale])
+
+def refresh_cart(conn, user_id):
+    # Writer job, run after StaleCartError: drops the lines of archived or
+    # deleted services and re-prices the rest at their current version, so
+    # the cart shows what checkout will charge. Returns the lines changed.
+    removed = conn.execute('''
+        DELETE FROM Cart
+        WHERE user_id = ? AND NOT EXISTS (SELECT 1 FROM Services s
+                                          WHERE s.service_id = Cart.service_id AND s.archived_at IS NULL)
+    ''', (user_id,)).rowcount
+    updated = conn.execute('''
+        UPDATE Cart SET service_version = s.version, price = s.price
+        FROM Services s
+        WHERE Cart.user_id = ? AND s.service_id = Cart.service_id AND Cart.service_version IS NOT s.version
+    ''', (user_id,)).rowcount
+    return removed + updated
+
+def place_order(conn, user_id, details):
+    # Moves the user's cart into a new order in one write transaction: the
+    # order total is computed in SQL, all items are copied with a single
+    # INSERT ... SELECT snapshotting the current service prices and
+    # categories, and the cart is emptied. Every line is first checked
+    # against its service's version (check_cart_versions raises
+    # StaleCartError) and date-booked lines are confirmed
+    # (bookings.confirm_cart_slots raises SlotUnavailable if one can no
+    # longer be booked). Returns the new order_id, or None if the cart was
+    # empty.
+    with transaction(conn):
+        check_cart_versions(conn, user_id)
+        confirm_cart_slots(conn, user_id)
+        
+        cursor = conn.execute('''
+            INSERT INTO Orders (user_id, total, status, payment_method, customer_name, customer_email,
+                               customer_address, customer_city, customer_state, customer_pin, customer_phone)
+            SELECT c.user_id, SUM(s.price * c.quantity), 'Received', ?, ?, ?, ?, ?, ?, ?, ?
+            FROM Cart c
+            JOIN Services s ON c.service_id = s.service_id
+            WHERE c.user_id = ?
+            GROUP BY c.user_id
+        ''', (details['payment_method'], details['name'], details['email'], details['address'],
+              details['city'], details['state'], details['pin'], details['phone'], user_id))
+        if cursor.rowcount == 0:
+            return None
+        
+        order_id = cursor.lastrowid
+        conn.execute('''
+            INSERT INTO Order_Items (order_id, service_id, vendor_id, quantity, price, category, event_date)
+            SELECT ?, c.service_id, c.vendor_id, c.quantity, s.price, s.category, c.event_date
+            FROM Cart c
+            JOIN Services s ON c.service_id = s.service_id
+            WHERE c.user_id = ?
+            ORDER BY c.cart_id
+        ''', (order_id, user_id))
+        
+        conn.execute('DELETE FROM Cart WHERE user_id = ?', (user_id,))
+    
+    return order_id
+
+
+ORDER_STATUSES = ['Received', 'Ready for Shipping', 'Out for Delivery']
+
+VENDOR_HAS_ORDER_SQL = 'SELECT EXISTS (SELECT 1 FROM Order_Items WHERE order_id = ? AND vendor_id = ?)'
+
+
+def set_order_status(conn, order_id, vendor_id, status):
+    # Writer job. Returns the id of the Order_Status_Events row the change
+    # logged, or None if the order already had that status. A vendor only
+    # moves orders holding their items: the change feeds the status events,
+    # the sales rollups and the customer emails.
+    if status not in ORDER_STATUSES:
+        raise ValueError('Unknown order status %r' % status)
+    if not conn.execute(VENDOR_HAS_ORDER_SQL, (order_id, vendor_id)).fetchone()[0]:
+        raise OrderNotFound('Order not found')
+    cursor = conn.execute('UPDATE Orders SET status = ? WHERE order_id = ? AND status IS NOT ?',
+                          (status, order_id, status))
+    if cursor.rowcount == 0:
+        return None
+    return conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Order_Status_Events'").fetchone()[0]
+
+
+@dataclass
+class VendorOrderItem:
+    item_id: int
+    service_id: int
+    name: str
+    quantity: int
+    price: float
+
+
+@dataclass
+class VendorOrder:
+    order_id: int
+    customer_name: str
+    customer_email: str
+    customer_address: str
+    customer_city: str
+    customer_state: str
+    customer_pin: str
+    customer_phone: str
+    status: str
+    created_at: str
+    total: float
+    items: list = field(default_factory=list)
+
+
+def load_vendor_orders(conn, vendor_id, args, status=None, archive=None):
+    # Phase 1: one page of order headers for orders holding this vendor's
+    # items, walked newest first off the (vendor_id, order_id) index; with an
+    # archive.OrderArchive, pages reaching past the hot orders continue into
+    # the archived ones
+    status_clause = 'o.status = ?' if status else '1'
+    params = (vendor_id, status) if status else (vendor_id,)
+    load_page = archive.keyset_page if archive is not None else keyset_page
+    page = load_page(conn, VENDOR_ORDERS_SQL % status_clause, params, ('oi.order_id',), ('order_id',), args)
+    
+    orders = [VendorOrder(**dict(row)) for row in page.rows]
+    if not orders:
+        page.rows = orders
+        return page
+    
+    # Phase 2: every item of this vendor on those orders in one query
+    by_id = {order.order_id: order for order in orders}
+    items_sql = VENDOR_ORDER_ITEMS_SQL % ', '.join('?' * len(by_id))
+    rows = conn.execute(items_sql, [vendor_id] + list(by_id)).fetchall()
+    if archive is not None and page.partitions:
+        rows += archive.fetch(conn, page.partitions, items_sql, [vendor_id] + list(by_id))
+    seen = set()
+    for row in rows:
+        if row['item_id'] in seen:
+            continue
+        seen.add(row['item_id'])
+        by_id[row['order_id']].items.append(
+            VendorOrderItem(row['item_id'], row['service_id'], row['name'], row['quantity'], row['price']))
+    
+    page.rows = orders
+    return page
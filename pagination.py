@@ -0,0 +1,99 @@
+import base64
+import json
+
+# Keyset (cursor) pagination, newest first, usually over (created_at, id). A
+# cursor is the sort key of the first/last row of a page, so every page is an
+# index range seek instead of an OFFSET scan over everything before it.
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class Page:
+    def __init__(self, rows, limit, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(value, length=2):
+    if not value:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(key, list) or len(key) != length:
+        return None
+    return tuple(key)
+
+def page_size(args, default=DEFAULT_PAGE_SIZE):
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+class KeysetQuery:
+    def __init__(self, sql, params, limit, after, before):
+        self.sql = sql
+        self.params = params
+        self.limit = limit
+        self.after = after
+        self.before = before
+
+
+def keyset_query(sql, params, sort_columns, args, default_size=DEFAULT_PAGE_SIZE):
+    # `sql` must contain {keyset} inside its WHERE clause and end with
+    # ORDER BY {order} LIMIT ?. sort_columns are the SQL expressions of the
+    # sort key.
+    limit = page_size(args, default_size)
+    after = decode_cursor(args.get('after'), len(sort_columns))
+    before = decode_cursor(args.get('before'), len(sort_columns)) if after is None else None
+
+    columns = '(%s)' % ', '.join(sort_columns)
+    placeholders = '(%s)' % ', '.join('?' * len(sort_columns))
+    if before is not None:
+        keyset = '%s > %s' % (columns, placeholders)
+        order = ', '.join('%s ASC' % col for col in sort_columns)
+        cursor_params = list(before)
+    elif after is not None:
+        keyset = '%s < %s' % (columns, placeholders)
+        order = ', '.join('%s DESC' % col for col in sort_columns)
+        cursor_params = list(after)
+    else:
+        keyset = '1'
+        order = ', '.join('%s DESC' % col for col in sort_columns)
+        cursor_params = []
+
+    return KeysetQuery(sql.format(keyset=keyset, order=order),
+                       list(params) + cursor_params + [limit + 1],
+                       limit, after, before)
+
+def keyset_result(query, rows, key_fields):
+    # Turns the rows fetched for a KeysetQuery into a Page; key_fields are
+    # the result columns matching the query's sort_columns
+    rows = list(rows)
+    has_more = len(rows) > query.limit
+    rows = rows[:query.limit]
+    if query.before is not None:
+        rows.reverse()
+
+    def key_of(row):
+        return [row[field] for field in key_fields]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if query.before is not None or has_more:
+            next_cursor = encode_cursor(key_of(rows[-1]))
+        if query.after is not None or (query.before is not None and has_more):
+            prev_cursor = encode_cursor(key_of(rows[0]))
+    return Page(rows, query.limit, next_cursor, prev_cursor)
+
+def keyset_page(conn, sql, params, sort_columns, key_fields, args, default_size=DEFAULT_PAGE_SIZE):
+    query = keyset_query(sql, params, sort_columns, args, default_size)
+    return keyset_result(query, conn.execute(query.sql, query.params).fetchall(), key_fields)
@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Salted, versioned password hashes. Encoded hashes carry their algorithm and
+# cost ("scrypt$16384$8$1$<salt>$<hash>"), so the cost can be raised later
+# and old hashes upgraded on the next successful login. Unprefixed 64-char
+# hex strings are the unsalted SHA-256 hashes the app used to store.
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class ScryptHasher:
+    algorithm = 'scrypt'
+
+    def __init__(self, n=2 ** 14, r=8, p=1):
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def _derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * n * r * p + 1024 * 1024, dklen=32)
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return '%s$%d$%d$%d$%s$%s' % (self.algorithm, self.n, self.r, self.p,
+                                      _b64encode(salt), _b64encode(digest))
+
+    def verify(self, encoded, password):
+        _, n, r, p, salt, digest = encoded.split('$')
+        actual = self._derive(password, _b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(actual, _b64decode(digest))
+
+    def needs_rehash(self, encoded):
+        return encoded.split('$')[1:4] != [str(self.n), str(self.r), str(self.p)]
+
+
+class PBKDF2Hasher:
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.iterations)
+        return '%s$%d$%s$%s' % (self.algorithm, self.iterations, _b64encode(salt), _b64encode(digest))
+
+    def verify(self, encoded, password):
+        _, iterations, salt, digest = encoded.split('$')
+        actual = hashlib.pbkdf2_hmac('sha256', password.encode(), _b64decode(salt), int(iterations))
+        return hmac.compare_digest(actual, _b64decode(digest))
+
+    def needs_rehash(self, encoded):
+        return encoded.split('$')[1] != str(self.iterations)
+
+
+class LegacySHA256Hasher:
+    algorithm = 'sha256'
+
+    @staticmethod
+    def matches(encoded):
+        return len(encoded) == 64 and '$' not in encoded
+
+    def verify(self, encoded, password):
+        return hmac.compare_digest(encoded, hashlib.sha256(password.encode()).hexdigest())
+
+    def needs_rehash(self, encoded):
+        return True
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordManager:
+    # Runs hashing and verification on a bounded thread pool. hashlib's
+    # scrypt and pbkdf2 release the GIL, so `workers` hashes really run in
+    # parallel; at most `max_pending` may be queued or running, beyond that
+    # callers get PasswordHasherBusy instead of piling up behind the pool.
+    def __init__(self, hasher, workers=4, max_pending=64, wait_timeout=5.0):
+        self.hasher = hasher
+        self.hashers = {h.algorithm: h for h in (ScryptHasher(), PBKDF2Hasher(), hasher)}
+        self.legacy = LegacySHA256Hasher()
+        self.wait_timeout = wait_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _hasher_for(self, encoded):
+        if self.legacy.matches(encoded):
+            return self.legacy
+        return self.hashers.get(encoded.split('$', 1)[0])
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise PasswordHasherBusy('Too many password checks in progress')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(self.hasher.hash, password)
+
+    def verify(self, encoded, password):
+        hasher = self._hasher_for(encoded or '')
+        if hasher is None or password is None:
+            return False
+        try:
+            return self._run(hasher.verify, encoded, password)
+        except ValueError:
+            # Malformed hash string
+            return False
+
+    def needs_rehash(self, encoded):
+        hasher = self._hasher_for(encoded)
+        if hasher is not self.hasher:
+            return True
+        return hasher.needs_rehash(encoded)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
@@ -0,0 +1,74 @@
+import re
+import sqlite3
+import sys
+
+from db import transaction
+
+# Ranked full-text search over the catalog, backed by the Services_FTS and
+# Vendors_FTS tables (see migrations.catalog_search_index).
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# bm25 column weights: name, description, category
+SERVICE_WEIGHTS = (10.0, 2.0, 5.0)
+VENDOR_WEIGHTS = (10.0, 2.0, 5.0)
+
+def match_expression(text):
+    # Each word becomes a quoted prefix term ("flor"* matches florist), all
+    # of which must match. Quoting keeps user input out of the FTS5 syntax.
+    terms = re.findall(r'\w+', text or '')
+    return ' '.join('"%s"*' % term for term in terms)
+
+def search_services(conn, text, min_price=None, max_price=None, limit=DEFAULT_LIMIT):
+    expression = match_expression(text)
+    if not expression:
+        return []
+    clauses = ['Services_FTS MATCH ?', 's.archived_at IS NULL']
+    params = [expression]
+    if min_price is not None:
+        clauses.append('s.price >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        clauses.append('s.price <= ?')
+        params.append(max_price)
+    rows = conn.execute('''
+        SELECT s.service_id, s.vendor_id, s.name, s.description, s.price, s.category,
+               v.name as vendor_name, bm25(Services_FTS, ?, ?, ?) as rank
+        FROM Services_FTS
+        JOIN Services s ON s.service_id = Services_FTS.rowid
+        JOIN Vendors v ON v.vendor_id = s.vendor_id
+        WHERE %s
+        ORDER BY rank
+        LIMIT ?
+    ''' % ' AND '.join(clauses), list(SERVICE_WEIGHTS) + params + [limit])
+    return [dict(row) for row in rows]
+
+def search_vendors(conn, text, limit=DEFAULT_LIMIT):
+    expression = match_expression(text)
+    if not expression:
+        return []
+    rows = conn.execute('''
+        SELECT v.vendor_id, v.name, v.description, v.category,
+               bm25(Vendors_FTS, ?, ?, ?) as rank
+        FROM Vendors_FTS
+        JOIN Vendors v ON v.vendor_id = Vendors_FTS.rowid
+        WHERE Vendors_FTS MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', list(VENDOR_WEIGHTS) + [expression, limit])
+    return [dict(row) for row in rows]
+
+def rebuild_index(conn):
+    with transaction(conn):
+        conn.execute("INSERT INTO Services_FTS (Services_FTS) VALUES ('rebuild')")
+        conn.execute("INSERT INTO Vendors_FTS (Vendors_FTS) VALUES ('rebuild')")
+        conn.execute("INSERT INTO Services_FTS (Services_FTS) VALUES ('optimize')")
+        conn.execute("INSERT INTO Vendors_FTS (Vendors_FTS) VALUES ('optimize')")
+
+if __name__ == '__main__':
+    # python search.py [database.db]  -- rebuild and optimize the search index
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else 'database.db', timeout=30)
+    rebuild_index(conn)
+    conn.close()
+    print('Search index rebuilt')
@@ -0,0 +1,185 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from migrations import migrate
+from orders import ORDER_STATUSES
+from passwords import ScryptHasher
+
+# Synthetic data for benchmarks and load tests. Bulk-loads users, vendors,
+# services, carts and orders with executemany in batches inside a single
+# transaction; the counter and search triggers still fire, so dashboards and
+# search stay consistent. Every generated account has the same password.
+#   python seed_data.py [db] --users 10000 --vendors 500 --orders 50000
+
+PASSWORD = 'password123'
+
+CATEGORIES = {
+    'Catering': ['Buffet', 'Plated Dinner', 'Cocktail Snacks', 'Wedding Cake', 'Dessert Bar', 'BBQ Grill'],
+    'Florist': ['Bridal Bouquet', 'Table Centerpiece', 'Flower Arch', 'Rose Garland', 'Petal Shower'],
+    'Decoration': ['Stage Backdrop', 'Balloon Wall', 'Table Linen', 'Theme Props', 'Entrance Gate'],
+    'Lighting': ['Fairy Lights', 'LED Uplighting', 'Chandelier Hire', 'Spotlights', 'Lantern Set'],
+}
+ADJECTIVES = ['Classic', 'Deluxe', 'Premium', 'Rustic', 'Modern', 'Royal', 'Garden', 'Vintage']
+CITIES = ['Mumbai', 'Delhi', 'Bengaluru', 'Pune', 'Jaipur', 'Kolkata', 'Chennai', 'Hyderabad']
+PAYMENT_METHODS = ['Cash', 'UPI', 'Card']
+STATUS_WEIGHTS = [5, 3, 2]
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def timestamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def next_id(conn, table, key):
+    return conn.execute('SELECT COALESCE(MAX(%s), 0) + 1 FROM %s' % (key, table)).fetchone()[0]
+
+def generate(db_path, users=1000, vendors=100, services_per_vendor=10, carts=200, orders=2000,
+             max_items=4, days=365, seed=1, batch_size=5000, verbose=False):
+    # Appends to whatever is already in the database; returns the id ranges
+    # it created so callers (bench_routes.py) can pick accounts to use
+    migrate(db_path)
+    rng = random.Random(seed)
+    password = ScryptHasher().hash(PASSWORD)
+    now = datetime.now().replace(microsecond=0)
+
+    def some_time():
+        return timestamp(now - timedelta(seconds=rng.randrange(days * 86400)))
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    started = time.perf_counter()
+    counts = {}
+
+    def load(table, sql, rows):
+        table_started = time.perf_counter()
+        total = 0
+        for batch in batched(rows, batch_size):
+            conn.executemany(sql, batch)
+            total += len(batch)
+        counts[table] = total
+        if verbose:
+            print('%-12s %9d rows %8.2fs' % (table, total, time.perf_counter() - table_started))
+
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        first_user = next_id(conn, 'Users', 'user_id')
+        first_vendor = next_id(conn, 'Vendors', 'vendor_id')
+        first_service = next_id(conn, 'Services', 'service_id')
+        first_order = next_id(conn, 'Orders', 'order_id')
+
+        load('Users', '''
+            INSERT INTO Users (user_id, name, email, password, phone, created_at) VALUES (?, ?, ?, ?, ?, ?)
+        ''', ((first_user + i, 'User %d' % (first_user + i), 'user%d@seed.example' % (first_user + i),
+               password, '9%09d' % (first_user + i), some_time()) for i in range(users)))
+
+        vendor_categories = [rng.choice(list(CATEGORIES)) for _ in range(vendors)]
+        load('Vendors', '''
+            INSERT INTO Vendors (vendor_id, name, email, password, phone, category, description, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((first_vendor + i, '%s %s %d' % (rng.choice(ADJECTIVES), category, first_vendor + i),
+               'vendor%d@seed.example' % (first_vendor + i), password, '8%09d' % (first_vendor + i),
+               category, '%s services in %s' % (category, rng.choice(CITIES)), some_time())
+              for i, category in enumerate(vendor_categories)))
+
+        # (vendor_id, category, name, price) per generated service, indexed from first_service
+        service_rows = []
+        for i, category in enumerate(vendor_categories):
+            for _ in range(services_per_vendor):
+                service_rows.append((first_vendor + i, category, rng.choice(CATEGORIES[category]),
+                                     round(rng.uniform(500, 50000), 2)))
+        load('Services', '''
+            INSERT INTO Services (service_id, vendor_id, name, description, price, category, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ((first_service + i, vendor_id, '%s %s' % (rng.choice(ADJECTIVES), name),
+               '%s for up to %d guests' % (name, rng.choice([50, 100, 200, 500])), price, category, some_time())
+              for i, (vendor_id, category, name, price) in enumerate(service_rows)))
+
+        def pick_services(count):
+            picked = rng.sample(range(len(service_rows)), min(count, len(service_rows)))
+            return [(first_service + i, service_rows[i][0], service_rows[i][3], service_rows[i][1]) for i in picked]
+
+        cart_users = rng.sample(range(first_user, first_user + users), min(carts, users)) if service_rows else []
+        load('Cart', '''
+            INSERT INTO Cart (user_id, service_id, vendor_id, quantity, added_at) VALUES (?, ?, ?, ?, ?)
+        ''', ((user_id, service_id, vendor_id, rng.randint(1, 3), some_time())
+              for user_id in cart_users
+              for service_id, vendor_id, _, _ in pick_services(rng.randint(1, max_items))))
+
+        order_items = []
+        order_rows = []
+        for i in range(orders if service_rows and users else 0):
+            order_id = first_order + i
+            items = [(service_id, vendor_id, rng.randint(1, 3), price, category)
+                     for service_id, vendor_id, price, category in pick_services(rng.randint(1, max_items))]
+            order_items.extend((order_id,) + item for item in items)
+            user_id = rng.randrange(first_user, first_user + users)
+            order_rows.append((order_id, user_id, round(sum(q * p for _, _, q, p, _ in items), 2),
+                               rng.choices(ORDER_STATUSES, STATUS_WEIGHTS)[0], rng.choice(PAYMENT_METHODS),
+                               'User %d' % user_id, 'user%d@seed.example' % user_id, '%d Main Road' % rng.randint(1, 999),
+                               rng.choice(CITIES), 'State', '%06d' % rng.randint(100000, 999999),
+                               '9%09d' % user_id, some_time()))
+        # Orders sorted by time so ids and created_at grow together, as they do live
+        order_rows.sort(key=lambda row: row[-1])
+        renumber = {row[0]: first_order + i for i, row in enumerate(order_rows)}
+        load('Orders', '''
+            INSERT INTO Orders (order_id, user_id, total, status, payment_method, customer_name, customer_email,
+                                customer_address, customer_city, customer_state, customer_pin, customer_phone,
+                                created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((renumber[row[0]],) + row[1:] for row in order_rows))
+        load('Order_Items', '''
+            INSERT INTO Order_Items (order_id, service_id, vendor_id, quantity, price, category)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', sorted((renumber[item[0]],) + item[1:] for item in order_items))
+
+        conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('PRAGMA optimize')
+        conn.close()
+
+    if verbose:
+        print('Loaded %d rows in %.2fs' % (sum(counts.values()), time.perf_counter() - started))
+    return {
+        'users': range(first_user, first_user + users),
+        'vendors': range(first_vendor, first_vendor + vendors),
+        'services': range(first_service, first_service + len(service_rows)),
+        'orders': range(first_order, first_order + len(order_rows)),
+        'counts': counts,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-load synthetic data (password: %s)' % PASSWORD)
+    parser.add_argument('db', nargs='?', default=os.environ.get('DATABASE', 'database.db'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--vendors', type=int, default=100)
+    parser.add_argument('--services-per-vendor', type=int, default=10)
+    parser.add_argument('--carts', type=int, default=200, help='users with items in their cart')
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--max-items', type=int, default=4, help='most items per cart or order')
+    parser.add_argument('--days', type=int, default=365, help='spread created_at over this many days')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    generate(args.db, users=args.users, vendors=args.vendors, services_per_vendor=args.services_per_vendor,
+             carts=args.carts, orders=args.orders, max_items=args.max_items, days=args.days,
+             seed=args.seed, batch_size=args.batch_size, verbose=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import secrets
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+
+from cache import TTLCache
+
+# Server-side sessions. The cookie only carries a random token; the session
+# data lives in the Sessions table under a hash of that token, so a session
+# can be revoked and a leaked table does not hand out live cookies. Lookups
+# go through a per-process LRU tier, then an optional shared tier (Redis or
+# LocalSharedStore), then SQLite. Expiry slides with use: last_seen moves
+# forward at most once per `touch_interval` and those updates are written
+# to SQLite in batches every `flush_interval` seconds.
+
+PRINCIPAL_KEYS = {'user': 'user_id', 'vendor': 'vendor_id', 'admin': 'admin_email'}
+
+SESSION_SQL = 'SELECT data, created_at, last_seen FROM Sessions WHERE session_key = ?'
+
+SAVE_SESSION_SQL = '''
+    INSERT INTO Sessions (session_key, data, role, principal, created_at, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (session_key) DO UPDATE SET
+        data = excluded.data, role = excluded.role, principal = excluded.principal,
+        last_seen = excluded.last_seen
+'''
+
+
+def session_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def principal_of(data):
+    role = data.get('role')
+    principal = data.get(PRINCIPAL_KEYS.get(role))
+    return role, None if principal is None else str(principal)
+
+
+class LocalSharedStore:
+    # Stand-in for a shared key/value store with the get/set(ex=)/delete
+    # calls of a Redis client, for single-host setups and development. It
+    # only lives in this process, so unlike Redis it is not shared between
+    # gunicorn workers.
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, None if ex is None else time.monotonic() + ex)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SessionStore:
+    def __init__(self, writer, shared=None, idle_timeout=7200, max_age=7 * 86400,
+                 cache_size=10000, cache_ttl=30, touch_interval=60, flush_interval=5):
+        # cache_ttl bounds how long another process may keep serving a
+        # revoked session from its LRU tier
+        self.writer = writer
+        self.shared = shared
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.touch_interval = touch_interval
+        self.flush_interval = flush_interval
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        self.shared_hits = 0
+        self.db_loads = 0
+        self.expired = 0
+        self.revoked = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def _expired(self, record, now):
+        return (now - record['last_seen'] > self.idle_timeout
+                or now - record['created_at'] > self.max_age)
+
+    def _remember(self, key, record):
+        self.cache.set(key, record)
+        if self.shared is not None:
+            self.shared.set(key, json.dumps(record), ex=self.idle_timeout)
+
+    def _forget(self, key):
+        self.cache.invalidate(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def load(self, token, conn):
+        key = session_key(token)
+        record = self.cache.get(key)
+        if record is None and self.shared is not None:
+            raw = self.shared.get(key)
+            if raw is not None:
+                record = json.loads(raw)
+                self.cache.set(key, record)
+                with self._lock:
+                    self.shared_hits += 1
+        if record is None:
+            row = conn.execute(SESSION_SQL, (key,)).fetchone()
+            with self._lock:
+                self.db_loads += 1
+            if row is None:
+                return None
+            record = {'data': json.loads(row['data']), 'created_at': row['created_at'],
+                      'last_seen': row['last_seen']}
+            self._remember(key, record)
+
+        if self._expired(record, time.time()):
+            with self._lock:
+                self.expired += 1
+            self.delete(token)
+            return None
+        return record
+
+    def save(self, token, data, created_at=None):
+        key = session_key(token)
+        now = time.time()
+        record = {'data': data, 'created_at': created_at or now, 'last_seen': now}
+        role, principal = principal_of(data)
+        self.writer.execute(SAVE_SESSION_SQL, (key, json.dumps(data), role, principal,
+                                               record['created_at'], now))
+        with self._lock:
+            self._seen.pop(key, None)
+        self._remember(key, record)
+        return record
+
+    def touch(self, token, record):
+        # Sliding expiry without a write per request
+        now = time.time()
+        if now - record['last_seen'] < self.touch_interval:
+            return
+        key = session_key(token)
+        self._remember(key, dict(record, last_seen=now))
+        with self._lock:
+            self._seen[key] = now
+
+    def delete(self, token):
+        key = session_key(token)
+        self.writer.execute('DELETE FROM Sessions WHERE session_key = ?', (key,))
+        self._forget(key)
+
+    def revoke(self, role, principal):
+        # Ends every session of one account, e.g. after a password change
+        keys = self.writer.run(_delete_principal_sessions, role, str(principal))
+        for key in keys:
+            self._forget(key)
+        with self._lock:
+            self.revoked += len(keys)
+        return len(keys)
+
+    def maybe_flush(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_flush < self.flush_interval:
+                return None
+            self._last_flush = now
+        return self.flush()
+
+    def flush(self):
+        # Writes the batched last_seen updates and purges expired sessions
+        # in one queued job; callers do not wait for it
+        with self._lock:
+            seen, self._seen = self._seen, {}
+            self.flushes += 1
+            self.flushed_rows += len(seen)
+        now = time.time()
+        return self.writer.submit(_flush_sessions, [(ts, key) for key, ts in seen.items()],
+                                  now - self.idle_timeout, now - self.max_age)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'pending_touches': len(self._seen),
+                'shared_hits': self.shared_hits,
+                'db_loads': self.db_loads,
+                'expired': self.expired,
+                'revoked': self.revoked,
+                'flushes': self.flushes,
+                'flushed_rows': self.flushed_rows,
+            }
+        stats['cache'] = self.cache.stats()
+        return stats
+
+
+def _delete_principal_sessions(conn, role, principal):
+    keys = [row['session_key'] for row in conn.execute(
+        'SELECT session_key FROM Sessions WHERE role = ? AND principal = ?', (role, principal))]
+    conn.execute('DELETE FROM Sessions WHERE role = ? AND principal = ?', (role, principal))
+    return keys
+
+def _flush_sessions(conn, touches, idle_before, created_before):
+    conn.executemany('UPDATE Sessions SET last_seen = MAX(last_seen, ?) WHERE session_key = ?', touches)
+    conn.execute('DELETE FROM Sessions WHERE last_seen < ? OR created_at < ?', (idle_before, created_before))
+
+
+class ServerSession(SessionMixin):
+    # Loaded from the store on first access, so requests that never look at
+    # the session (static pages, the index) never look it up. clear() also
+    # rotates the token, so logging in always issues a fresh session id.
+    def __init__(self, token, loader):
+        self.token = token
+        self._loader = loader
+        self._data = None
+        self.record = None
+        self.new = False
+        self.modified = False
+        self.accessed = False
+        self.rotated = False
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _load(self):
+        if self._data is None:
+            self.accessed = True
+            self.record = self._loader(self.token) if self.token else None
+            self._data = dict(self.record['data']) if self.record else {}
+            self.new = self.record is None
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def clear(self):
+        self._data = {}
+        self.accessed = True
+        self.modified = True
+        self.rotated = True
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store, get_connection):
+        self.store = store
+        self.get_connection = get_connection
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        return ServerSession(token, lambda token: self.store.load(token, self.get_connection()))
+
+    def save_session(self, app, session, response):
+        self.store.maybe_flush()
+        if not session.loaded:
+            return
+        response.vary.add('Cookie')
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.token and (session.rotated or (not session and session.record)):
+            self.store.delete(session.token)
+        if not session:
+            if session.token:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.rotated or session.record is None:
+            token = secrets.token_urlsafe(32)
+            self.store.save(token, dict(session))
+            response.set_cookie(name, token,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain,
+                                path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+        elif session.modified:
+            self.store.save(session.token, dict(session), session.record['created_at'])
+        else:
+            self.store.touch(session.token, session.record)
@@ -0,0 +1,81 @@
+import sqlite3
+import sys
+
+from archive import OrderArchive
+from db import transaction
+
+# Dashboard counters. The Stats and Vendor_Stats tables are maintained by
+# triggers (see migrations.dashboard_counters); the dashboards only read them.
+
+GLOBAL_COUNTERS = {
+    'users': 'SELECT COUNT(*) FROM Users',
+    'vendors': 'SELECT COUNT(*) FROM Vendors',
+    'orders': 'SELECT COUNT(*) FROM Orders',
+}
+
+VENDOR_COUNTS_SQL = '''
+    SELECT v.vendor_id,
+           (SELECT COUNT(*) FROM Services s WHERE s.vendor_id = v.vendor_id AND s.archived_at IS NULL) as service_count,
+           (SELECT COUNT(DISTINCT oi.order_id) FROM Order_Items oi WHERE oi.vendor_id = v.vendor_id) as order_count
+    FROM Vendors v
+'''
+
+STATS_SQL = 'SELECT name, value FROM Stats WHERE name IN (?, ?, ?)'
+
+VENDOR_STATS_SQL = 'SELECT service_count, order_count FROM Vendor_Stats WHERE vendor_id = ?'
+
+# Archived orders still count (see migrations.order_archives)
+ARCHIVED_VENDOR_ORDERS_SQL = 'SELECT vendor_id, COUNT(DISTINCT order_id) FROM Order_Items GROUP BY vendor_id'
+
+def global_counts(conn):
+    counts = dict.fromkeys(GLOBAL_COUNTERS, 0)
+    for row in conn.execute(STATS_SQL, tuple(GLOBAL_COUNTERS)):
+        counts[row[0]] = row[1]
+    return counts
+
+def vendor_counts(conn, vendor_id):
+    row = conn.execute(VENDOR_STATS_SQL, (vendor_id,)).fetchone()
+    if row is None:
+        return {'service_count': 0, 'order_count': 0}
+    return {'service_count': row[0], 'order_count': row[1]}
+
+def rebuild_stats(conn, archive=None):
+    # Recomputes every counter from the base tables (and the archived
+    # orders, given an archive.OrderArchive) under the write lock and
+    # returns the counters that had drifted as {name: (stored, actual)}
+    drift = {}
+    with transaction(conn):
+        stored = global_counts(conn)
+        for name, sql in GLOBAL_COUNTERS.items():
+            actual = conn.execute(sql).fetchone()[0]
+            if archive is not None and name == 'orders':
+                actual += sum(row[0] for row in archive.scan(conn, sql))
+            if stored.get(name) != actual:
+                drift[name] = (stored.get(name), actual)
+            conn.execute('INSERT OR REPLACE INTO Stats (name, value) VALUES (?, ?)', (name, actual))
+
+        stored_vendors = {row[0]: (row[1], row[2]) for row in
+                          conn.execute('SELECT vendor_id, service_count, order_count FROM Vendor_Stats')}
+        actual_vendors = {row[0]: (row[1], row[2]) for row in conn.execute(VENDOR_COUNTS_SQL)}
+        if archive is not None:
+            for vendor_id, orders in archive.scan(conn, ARCHIVED_VENDOR_ORDERS_SQL):
+                if vendor_id in actual_vendors:
+                    services, hot_orders = actual_vendors[vendor_id]
+                    actual_vendors[vendor_id] = (services, hot_orders + orders)
+        for vendor_id in set(stored_vendors) | set(actual_vendors):
+            if stored_vendors.get(vendor_id) != actual_vendors.get(vendor_id):
+                drift['vendor %d' % vendor_id] = (stored_vendors.get(vendor_id), actual_vendors.get(vendor_id))
+        conn.execute('DELETE FROM Vendor_Stats')
+        conn.executemany('INSERT INTO Vendor_Stats (vendor_id, service_count, order_count) VALUES (?, ?, ?)',
+                         [(vendor_id,) + counts for vendor_id, counts in actual_vendors.items()])
+    return drift
+
+if __name__ == '__main__':
+    # python stats.py [database.db]  -- reconcile the dashboard counters
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    conn = sqlite3.connect(path, timeout=30)
+    drift = rebuild_stats(conn, OrderArchive(path))
+    conn.close()
+    for name, (stored, actual) in sorted(drift.items()):
+        print('%s: %s -> %s' % (name, stored, actual))
+    print('Counters rebuilt, %d had drifted' % len(drift))
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+
+
+def add_orders(db_path, count, status='Out for Delivery', created_at='2025-01-15 10:00:00'):
+    # A vendor, a service and a user on first use, then `count` one-item orders
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO Users (user_id, name, email, password, phone) VALUES (1, 'U', 'u@x', 'p', '1')")
+    conn.execute("INSERT OR IGNORE INTO Vendors (vendor_id, name, email, password, phone, category) "
+                 "VALUES (1, 'V', 'v@x', 'p', '1', 'Catering')")
+    conn.execute("INSERT OR IGNORE INTO Services (service_id, vendor_id, name, price, category) "
+                 "VALUES (1, 1, 'Buffet', 100, 'Catering')")
+    for _ in range(count):
+        order_id = conn.execute('''
+            INSERT INTO Orders (user_id, total, status, payment_method, customer_name, customer_email,
+                                customer_address, customer_city, customer_state, customer_pin, customer_phone,
+                                created_at)
+            VALUES (1, 100, ?, 'Cash', 'U', 'u@x', 'a', 'c', 's', '1', '1', ?)
+        ''', (status, created_at)).lastrowid
+        conn.execute('INSERT INTO Order_Items (order_id, service_id, vendor_id, quantity, price) VALUES (?, 1, 1, 1, 100)',
+                     (order_id,))
+    conn.commit()
+    conn.close()
+
+def signed_in_client(appmod, role, **values):
+    # A test client with `role` signed in, e.g. vendor_id=1
+    client = appmod.app.test_client()
+    with client.session_transaction() as sess:
+        sess['role'] = role
+        sess.update(values)
+    return client
+
+def vendor_client(appmod, vendor_id):
+    return signed_in_client(appmod, 'vendor', vendor_id=vendor_id)
+
+def user_client(appmod, user_id):
+    return signed_in_client(appmod, 'user', user_id=user_id)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'database.db')
+    migrate(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def appmod(tmp_path_factory):
+    # The app reads its configuration at import, so it is imported once, on
+    # a database of its own
+    os.environ['DATABASE'] = str(tmp_path_factory.mktemp('app') / 'database.db')
+    os.environ['JOB_WORKERS'] = '0'
+    import app
+    return app
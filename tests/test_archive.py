@@ -0,0 +1,18 @@
+import asyncio
+
+import archive
+from conftest import add_orders
+
+
+def test_async_order_listings_include_archived_orders(appmod):
+    db_path = appmod.app.config['DATABASE']
+    add_orders(db_path, 3, created_at='2025-01-15 10:00:00')
+    add_orders(db_path, 5, status='Received', created_at='2025-03-01 10:00:00')
+    moved = archive.archive_orders(db_path, '2025-02-01', pause=0)
+    assert moved == {'2025-01': (3, 3)}
+
+    with appmod.app.test_request_context('/my_orders?limit=50'):
+        page = asyncio.run(appmod.orders_page_async(appmod.MY_ORDERS_SQL, (1,)))
+        assert len(page.rows) == 8
+        admin = asyncio.run(appmod.orders_page_async(appmod.ADMIN_ORDERS_SQL, ()))
+        assert [row['order_id'] for row in admin.rows] == [row['order_id'] for row in page.rows]
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import sqlite3
+
+import pytest
+
+import archive
+import backup
+from conftest import add_orders
+
+
+def digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def dump(path):
+    conn = sqlite3.connect(path)
+    try:
+        return list(conn.iterdump())
+    finally:
+        conn.close()
+
+def sources(db_path):
+    base = os.path.dirname(db_path)
+    paths = [db_path] + [os.path.join(base, relpath) for relpath in backup.archive_paths(db_path)]
+    return {path: digest(path) for path in paths}
+
+
+@pytest.mark.parametrize('archived', [False, True])
+def test_snapshot_list_restore_round_trip(tmp_path, db_path, archived):
+    add_orders(db_path, 5)
+    add_orders(db_path, 3, status='Received', created_at='2025-03-01 10:00:00')
+    if archived:
+        archive.archive_orders(db_path, '2025-02-01', pause=0)
+    before = sources(db_path)
+    assert len(before) == (2 if archived else 1)
+
+    directory = str(tmp_path / 'backups')
+    manifest = backup.snapshot(db_path, directory, pages=2, pause=0)
+    assert sources(db_path) == before
+    assert backup.list_snapshots(directory) == [manifest['name']]
+    assert sorted(os.listdir(directory)) == ['chunks', 'snapshots']
+
+    dest = str(tmp_path / 'restored' / 'database.db')
+    backup.restore(directory, None, dest)
+    assert dump(dest) == dump(db_path)
+    for relpath in backup.archive_paths(db_path):
+        assert dump(os.path.join(tmp_path, 'restored', relpath)) == dump(os.path.join(tmp_path, relpath))
+
+    with pytest.raises(backup.BackupError):
+        backup.restore(directory, None, dest)
+
+def test_second_snapshot_only_writes_changed_chunks(tmp_path, db_path):
+    add_orders(db_path, 5)
+    directory = str(tmp_path / 'backups')
+    first = backup.snapshot(db_path, directory, pause=0)
+    os.rename(os.path.join(directory, 'snapshots', first['name'] + '.json'),
+              os.path.join(directory, 'snapshots', '00000000-000000.json'))
+    second = backup.snapshot(db_path, directory, pause=0)
+    assert second['files']['database.db']['new_bytes'] == 0
+    assert len(backup.list_snapshots(directory)) == 2
+
+def test_failed_copy_leaves_no_partial_file(tmp_path, db_path, monkeypatch):
+    def fail(path, quick=False):
+        raise backup.BackupError('%s failed its integrity check' % path)
+    monkeypatch.setattr(backup, 'verify', fail)
+    with pytest.raises(backup.BackupError):
+        backup.snapshot(db_path, str(tmp_path / 'backups'), pause=0)
+    assert os.listdir(tmp_path / 'backups' / 'snapshots') == []
+    assert sorted(os.listdir(tmp_path / 'backups')) == ['chunks', 'snapshots']
+
+def test_damaged_chunk_is_refused(tmp_path, db_path):
+    add_orders(db_path, 2)
+    directory = str(tmp_path / 'backups')
+    manifest = backup.snapshot(db_path, directory, pause=0)
+    chunk = manifest['files']['database.db']['chunks'][0]
+    with open(os.path.join(directory, 'chunks', chunk[:2], chunk), 'r+b') as f:
+        f.seek(100)
+        f.write(b'x')
+    dest = str(tmp_path / 'restored.db')
+    with pytest.raises(backup.BackupError):
+        backup.restore(directory, None, dest)
+    assert not os.path.exists(dest) and not os.path.exists(dest + '.partial')
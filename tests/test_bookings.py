@@ -0,0 +1,65 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import bookings
+from conftest import add_orders
+from db import transaction
+from orders import place_order
+
+DAY = date.today() + timedelta(days=30)
+
+
+@pytest.fixture
+def conn(db_path):
+    # Vendor 1 with service 1 (not booked by date) and service 2 (2 a day)
+    add_orders(db_path, 0)
+    # Autocommit, as on the writer thread
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("INSERT INTO Services (service_id, vendor_id, name, price, category, daily_capacity) "
+                 "VALUES (2, 1, 'Hall', 500, 'Venues', 2)")
+    for user_id in (2, 3):
+        conn.execute("INSERT INTO Users (user_id, name, email, password, phone) VALUES (?, 'U', ?, 'p', '1')",
+                     (user_id, 'u%d@x' % user_id))
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_capacity_override_needs_a_date_booked_service(conn):
+    with pytest.raises(bookings.BookingError):
+        bookings.set_capacity(conn, 1, 1, DAY.isoformat(), 5)
+    assert bookings.set_capacity(conn, 2, 2, DAY.isoformat(), 5) is False
+    assert bookings.set_capacity(conn, 1, 2, DAY.isoformat(), 5) is True
+    assert conn.execute('SELECT capacity FROM Service_Capacity WHERE service_id = 2').fetchone()[0] == 5
+
+def test_slot_cannot_be_overbooked(conn):
+    bookings.add_to_cart(conn, 2, [(2, 1, 2, DAY.isoformat())])
+    with pytest.raises(bookings.SlotUnavailable):
+        bookings.add_to_cart(conn, 3, [(2, 1, 1, DAY.isoformat())])
+    # All or nothing: the free service in the same request is not added
+    with pytest.raises(bookings.SlotUnavailable), transaction(conn):
+        bookings.add_to_cart(conn, 3, [(1, 1, 1, None), (2, 1, 1, DAY.isoformat())])
+    assert conn.execute('SELECT COUNT(*) FROM Cart WHERE user_id = 3').fetchone()[0] == 0
+
+    day = bookings.availability(conn, 2, DAY, DAY)['days'][0]
+    assert (day['capacity'], day['booked'], day['held'], day['available']) == (2, 0, 2, 0)
+
+def test_expired_hold_frees_the_slot(conn):
+    bookings.add_to_cart(conn, 2, [(2, 1, 2, DAY.isoformat())], hold_seconds=-1)
+    # Lapsed holds count as free before anything releases them
+    assert bookings.availability(conn, 2, DAY, DAY)['days'][0]['available'] == 2
+
+    bookings.add_to_cart(conn, 3, [(2, 1, 2, DAY.isoformat())])
+    assert [row[0] for row in conn.execute('SELECT user_id FROM Booking_Holds')] == [3]
+    # The first cart line is still there, but checkout can no longer book it
+    with pytest.raises(bookings.SlotUnavailable):
+        bookings.confirm_cart_slots(conn, 2)
+
+    order_id = place_order(conn, 3, {'payment_method': 'Cash', 'name': 'U', 'email': 'u3@x', 'address': 'a',
+                                     'city': 'c', 'state': 's', 'pin': '1', 'phone': '1'})
+    assert order_id is not None
+    day = bookings.availability(conn, 2, DAY, DAY)['days'][0]
+    assert (day['booked'], day['held'], day['available']) == (2, 0, 0)
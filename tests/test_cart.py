@@ -0,0 +1,35 @@
+import sqlite3
+
+from conftest import add_orders, user_client
+
+
+def cart_lines(db_path, user_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT service_id, vendor_id, quantity FROM Cart WHERE user_id = ? ORDER BY cart_id',
+                            (user_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_add_to_cart_checks_its_input(appmod):
+    db_path = appmod.app.config['DATABASE']
+    add_orders(db_path, 0)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO Users (user_id, name, email, password, phone) VALUES (4, 'C', 'c@x', 'p', '4')")
+    conn.commit()
+    conn.close()
+    client = user_client(appmod, 4)
+
+    for body in ({'service_id': 1, 'vendor_id': 1, 'quantity': 'abc'},
+                 {'service_id': 1, 'vendor_id': 1, 'quantity': -5},
+                 {'service_id': 1, 'quantity': 1}):
+        assert client.post('/add_to_cart', json=body).status_code == 400
+    assert client.post('/add_to_cart', data='not json', content_type='text/plain').status_code == 400
+    # Service 1 belongs to vendor 1
+    assert client.post('/add_to_cart', json={'service_id': 1, 'vendor_id': 42, 'quantity': 1}).status_code == 400
+    assert cart_lines(db_path, 4) == []
+
+    assert client.post('/add_to_cart', json={'service_id': 1, 'vendor_id': 1, 'quantity': 2}).status_code == 200
+    assert client.post('/add_to_cart_batch', json=[{'service_id': 1, 'vendor_id': 1, 'quantity': 0}]).status_code == 400
+    assert cart_lines(db_path, 4) == [(1, 1, 2)]
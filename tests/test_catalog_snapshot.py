@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+from catalog_snapshot import CatalogSnapshot
+from conftest import add_orders
+
+
+@pytest.fixture
+def conn(db_path):
+    # Service 1: Buffet, Catering, 100 (see add_orders)
+    add_orders(db_path, 0)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    for service_id, name, price, category in [(2, 'Roses', 30, 'Florist'), (3, 'Canapes', 20, 'Catering')]:
+        conn.execute('INSERT INTO Services (service_id, vendor_id, name, price, category) VALUES (?, 1, ?, ?, ?)',
+                     (service_id, name, price, category))
+    yield conn
+    conn.close()
+
+def names(snapshot, conn, **filters):
+    return [service['name'] for service in snapshot.browse(conn, **filters)['services']]
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+def test_snapshot_refreshes_incrementally(conn, use_numpy):
+    snapshot = CatalogSnapshot(use_numpy=use_numpy)
+    snapshot.refresh(conn)
+    assert names(snapshot, conn) == ['Canapes', 'Roses', 'Buffet']
+    assert names(snapshot, conn, category='Catering', descending=True) == ['Buffet', 'Canapes']
+
+    # Edits, an archived service and a new one are patched in
+    conn.execute('UPDATE Services SET price = 5 WHERE service_id = 1')
+    conn.execute('UPDATE Services SET archived_at = CURRENT_TIMESTAMP WHERE service_id = 2')
+    conn.execute("INSERT INTO Services (service_id, vendor_id, name, price, category) "
+                 "VALUES (4, 1, 'Lights', 50, 'Lighting')")
+    snapshot.refresh(conn)
+    assert names(snapshot, conn) == ['Buffet', 'Canapes', 'Lights']
+    assert names(snapshot, conn, min_price=10, max_price=60) == ['Canapes', 'Lights']
+    assert names(snapshot, conn, category='Florist') == []
+    stats = snapshot.stats()
+    assert (stats['rebuilds'], stats['refreshes'], stats['rows_applied']) == (1, 1, 3)
+
+    # Nothing changed: nothing is read
+    snapshot.refresh(conn)
+    assert snapshot.stats()['refreshes'] == 1
+
+    # Once over a quarter of the slots are archived ones, it is rebuilt
+    conn.execute('UPDATE Services SET archived_at = CURRENT_TIMESTAMP WHERE service_id = 3')
+    snapshot.refresh(conn)
+    stats = snapshot.stats()
+    assert (stats['rebuilds'], stats['services'], stats['dead_slots']) == (2, 2, 0)
+    assert names(snapshot, conn) == ['Buffet', 'Lights']
@@ -0,0 +1,68 @@
+import sqlite3
+import time
+
+import pytest
+
+from db import ConnectionPool
+from jobs import JobQueue, enqueue, _claim_job
+from writer import WriteQueue
+
+
+@pytest.fixture
+def queue(db_path):
+    # No worker threads: the tests claim and run jobs themselves
+    return JobQueue(ConnectionPool(db_path, size=2, readonly=True), WriteQueue(db_path, wait_timeout=5),
+                    workers=0, lease=10, backoff_base=60)
+
+def job_row(db_path, job_id):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return conn.execute('SELECT * FROM Jobs WHERE job_id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_duplicate_idempotency_key_is_a_no_op(queue, db_path):
+    assert queue.writer.run(enqueue, 'email', {'to': 'a'}, 'order-1')
+    assert not queue.writer.run(enqueue, 'email', {'to': 'b'}, 'order-1')
+    assert queue.writer.run(enqueue, 'email', {'to': 'c'}, 'order-2')
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT payload FROM Jobs ORDER BY job_id').fetchall() == [('{"to": "a"}',), ('{"to": "c"}',)]
+    conn.close()
+
+def test_expired_lease_is_reclaimed(queue, db_path):
+    queue.writer.run(enqueue, 'email', {}, 'order-1')
+    now = time.time()
+    first = queue.writer.run(_claim_job, 'worker-a', now, queue.lease)
+    assert first['attempts'] == 1
+    # Leased to worker-a until now + 10
+    assert queue.writer.run(_claim_job, 'worker-b', now + 5, queue.lease) is None
+    second = queue.writer.run(_claim_job, 'worker-b', now + 11, queue.lease)
+    assert (second['job_id'], second['attempts']) == (first['job_id'], 2)
+
+    # worker-a finishing late does not overwrite worker-b's claim
+    queue.register('email', lambda conn, payload: None)
+    queue._execute('worker-a', first)
+    assert queue.stats()['lost'] == 1
+    assert job_row(db_path, first['job_id'])['status'] == 'running'
+    queue._execute('worker-b', second)
+    assert job_row(db_path, first['job_id'])['status'] == 'done'
+
+def test_failed_job_is_retried_with_backoff_then_given_up(queue, db_path):
+    def fail(conn, payload):
+        raise RuntimeError('mail server down')
+    queue.register('email', fail)
+    queue.writer.run(enqueue, 'email', {}, 'order-1', 0, 2)
+
+    now = time.time()
+    job = queue.writer.run(_claim_job, 'worker-a', now, queue.lease)
+    queue._execute('worker-a', job)
+    row = job_row(db_path, job['job_id'])
+    assert row['status'] == 'pending' and row['run_at'] >= now + 30
+    assert 'mail server down' in row['last_error']
+
+    job = queue.writer.run(_claim_job, 'worker-a', row['run_at'], queue.lease)
+    queue._execute('worker-a', job)
+    assert job_row(db_path, job['job_id'])['status'] == 'failed'
+    assert (queue.stats()['retried'], queue.stats()['failed']) == (1, 1)
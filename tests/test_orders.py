@@ -0,0 +1,40 @@
+import sqlite3
+
+from conftest import add_orders, vendor_client
+
+
+def order_status(db_path, order_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT status FROM Orders WHERE order_id = ?', (order_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_vendor_only_updates_own_orders(appmod):
+    db_path = appmod.app.config['DATABASE']
+    add_orders(db_path, 1, status='Received', created_at='2025-05-01 10:00:00')
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO Vendors (vendor_id, name, email, password, phone, category) "
+                 "VALUES (2, 'W', 'w@x', 'p', '2', 'Catering')")
+    order_id = conn.execute('SELECT MAX(order_id) FROM Orders').fetchone()[0]
+    events = conn.execute('SELECT COUNT(*) FROM Order_Status_Events').fetchone()[0]
+    conn.commit()
+    conn.close()
+
+    response = vendor_client(appmod, 2).post('/update_order_status',
+                                             data={'order_id': order_id, 'status': 'Ready for Shipping'})
+    assert response.status_code == 404
+    assert order_status(db_path, order_id) == 'Received'
+
+    owner = vendor_client(appmod, 1)
+    response = owner.post('/update_order_status', data={'order_id': order_id, 'status': 'Shipped'})
+    assert response.status_code == 400
+    assert order_status(db_path, order_id) == 'Received'
+
+    response = owner.post('/update_order_status', data={'order_id': order_id, 'status': 'Ready for Shipping'})
+    assert response.status_code == 302
+    assert order_status(db_path, order_id) == 'Ready for Shipping'
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM Order_Status_Events').fetchone()[0] == events + 1
+    conn.close()
@@ -0,0 +1,64 @@
+import hashlib
+import sqlite3
+import threading
+
+import pytest
+
+from passwords import PasswordHasherBusy, PasswordManager, PBKDF2Hasher, ScryptHasher
+
+
+class BlockingHasher(ScryptHasher):
+    # Holds every hash until released
+    def __init__(self):
+        super().__init__(n=2 ** 10)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def hash(self, password):
+        self.started.set()
+        self.release.wait(5)
+        return super().hash(password)
+
+
+def test_hashes_verify_and_report_their_cost():
+    manager = PasswordManager(ScryptHasher(n=2 ** 10), workers=2)
+    encoded = manager.hash('secret')
+    assert encoded.startswith('scrypt$1024$8$1$')
+    assert manager.verify(encoded, 'secret') and not manager.verify(encoded, 'wrong')
+    assert not manager.needs_rehash(encoded)
+    # Another cost or algorithm is upgraded on the next login
+    assert manager.needs_rehash(ScryptHasher(n=2 ** 11).hash('secret'))
+    assert manager.needs_rehash(PBKDF2Hasher(iterations=1000).hash('secret'))
+    legacy = hashlib.sha256(b'secret').hexdigest()
+    assert manager.verify(legacy, 'secret') and manager.needs_rehash(legacy)
+    assert not manager.verify('scrypt$garbage', 'secret')
+    manager.shutdown()
+
+def test_pool_refuses_work_beyond_max_pending():
+    hasher = BlockingHasher()
+    manager = PasswordManager(hasher, workers=1, max_pending=1, wait_timeout=0.1)
+    first = threading.Thread(target=manager.hash, args=('one',))
+    first.start()
+    hasher.started.wait(5)
+    with pytest.raises(PasswordHasherBusy):
+        manager.hash('two')
+    hasher.release.set()
+    first.join(5)
+    # The slot is free again
+    assert manager.hash('three').startswith('scrypt$')
+    manager.shutdown()
+
+def test_login_upgrades_a_legacy_hash(appmod):
+    db_path = appmod.app.config['DATABASE']
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO Users (name, email, password, phone) VALUES ('L', 'legacy@x', ?, '1')",
+                 (hashlib.sha256(b'secret').hexdigest(),))
+    conn.commit()
+
+    client = appmod.app.test_client()
+    response = client.post('/user_login', data={'email': 'legacy@x', 'password': 'secret'})
+    assert response.status_code == 302
+    stored = conn.execute("SELECT password FROM Users WHERE email = 'legacy@x'").fetchone()[0]
+    conn.close()
+    assert stored.startswith(appmod.passwords.hasher.algorithm + '$')
+    assert appmod.passwords.verify(stored, 'secret')
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+
+import analytics
+import bookings
+import cache
+import catalog_snapshot
+import exports
+import jobs
+import notifications
+import order_feed
+import orders
+import sessions
+import stats
+from pagination import encode_cursor, keyset_query
+
+# The queries behind the hot routes, taken from the modules that run them
+# and checked with EXPLAIN QUERY PLAN, so a schema or query change that falls
+# back to a full table scan or a sort fails here
+
+DAYS = ('2025-01-01', '2025-01-31')
+EXPORT_ARGS = {'from': DAYS[0], 'to': DAYS[1]}
+# Rankings of a range's rollup groups by revenue: the groups are sorted
+# once aggregated, which no index can do
+RANKED = {'vendor_analytics.services', 'admin_analytics.categories', 'admin_analytics.vendors'}
+
+
+def keyset(sql, params, sort_columns, key):
+    # Second page of a listing: the keyset condition and order are filled in
+    query = keyset_query(sql, params, sort_columns, {'after': encode_cursor(key)})
+    return query.sql, query.params
+
+def plan_checks(app):
+    order_key = ('o.created_at', 'o.order_id')
+    return [
+        ('add_to_cart', bookings.ADD_TO_CART_SQL, (1, 1, None, 1)),
+        ('set_cart_line', bookings.SET_CART_LINE_SQL, (1, 1, DAYS[0], 1)),
+        ('cart', app.CART_ITEMS_SQL, (1,)),
+        ('cart_slots', bookings.CART_SLOTS_SQL, (1,)),
+        ('slot', bookings.SLOT_SQL, (DAYS[0], DAYS[0], 1)),
+        ('release_day_holds', bookings.RELEASE_DAY_HOLDS_SQL, (1, DAYS[0], 0)),
+        ('sweep_holds', bookings.SWEEP_HOLDS_SQL, (0, bookings.SWEEP_LIMIT)),
+        ('calendar.capacity', bookings.CAPACITY_OVERRIDES_SQL, (1,) + DAYS),
+        ('calendar.slots', bookings.SLOT_COUNTS_SQL, (1,) + DAYS),
+        ('calendar.lapsed', bookings.LAPSED_HOLDS_SQL, (1,) + DAYS + (0,)),
+        ('checkout_cart_versions', orders.STALE_CART_LINES_SQL, (1,)),
+        ('user_dashboard', cache.CATEGORIES_SQL, ()),
+        ('vendor_services.vendors', cache.VENDORS_SQL, ('Catering',)),
+        ('vendor_services.services', cache.SERVICES_SQL, (1,)),
+        ('catalog_version', cache.CATALOG_VERSION_SQL, ()),
+        ('session', sessions.SESSION_SQL, ('x',)),
+        ('vendor_dashboard', stats.VENDOR_STATS_SQL, (1,)),
+        ('admin_dashboard', stats.STATS_SQL, tuple(stats.GLOBAL_COUNTERS)),
+        ('my_orders',) + keyset(app.MY_ORDERS_SQL, (1,), order_key, ('2025-01-15', 10)),
+        ('admin_users',) + keyset(app.ADMIN_USERS_SQL, (), ('created_at', 'user_id'), ('2025-01-15', 10)),
+        ('admin_vendors',) + keyset(app.ADMIN_VENDORS_SQL, (), ('created_at', 'vendor_id'), ('2025-01-15', 10)),
+        ('admin_orders',) + keyset(app.ADMIN_ORDERS_SQL, (), order_key, ('2025-01-15', 10)),
+        ('request_item.orders',) + keyset(orders.VENDOR_ORDERS_SQL % 'o.status = ?', (1, 'Received'),
+                                          ('oi.order_id',), (10,)),
+        ('request_item.items', orders.VENDOR_ORDER_ITEMS_SQL % '?, ?, ?', (1, 1, 2, 3)),
+        ('vendor_analytics.daily', analytics.VENDOR_DAILY_SQL % '1', (1,) + DAYS),
+        ('vendor_analytics.status', analytics.VENDOR_STATUS_SQL, (1,) + DAYS),
+        ('vendor_analytics.services', analytics.VENDOR_TOP_SERVICES_SQL % '1', (1,) + DAYS + (10,)),
+        ('admin_analytics.daily', analytics.ADMIN_DAILY_SQL % '1', DAYS),
+        ('admin_analytics.status', analytics.ADMIN_STATUS_SQL, DAYS),
+        ('admin_analytics.categories', analytics.ADMIN_CATEGORIES_SQL % '1', DAYS),
+        ('admin_analytics.vendors', analytics.ADMIN_TOP_VENDORS_SQL % 'r.status = ?', DAYS + ('Received', 10)),
+        ('order_events_user', order_feed.USER_EVENTS_SQL, (1, 0, 100)),
+        ('order_events_vendor', order_feed.VENDOR_EVENTS_SQL, (0, 1, 100)),
+        ('jobs_claim', jobs.CLAIM_SQL, (0, 'w', 0)),
+        ('jobs_next_due', jobs.NEXT_DUE_SQL, ()),
+        ('jobs_purge', jobs.PURGE_SQL, (0,)),
+        ('catalog_snapshot_changes', catalog_snapshot.CHANGED_SQL, (0,)),
+        ('catalog_snapshot_details', catalog_snapshot.DETAILS_SQL % '?, ?', (1, 2)),
+        ('order_email', notifications.ORDER_SQL, (1,)),
+        ('order_email.lines', notifications.ORDER_LINES_SQL, (1,)),
+        ('export_orders',) + exports.orders_query(EXPORT_ARGS),
+        ('export_order_items',) + exports.order_items_query(EXPORT_ARGS),
+        ('export_vendor_requests',) + exports.vendor_requests_query(1, EXPORT_ARGS),
+    ]
+
+def plan_problems(conn, name, sql, params):
+    problems = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+        detail = row[3]
+        # "SCAN t USING INDEX ..." walks an index in order; a bare
+        # "SCAN t" reads the whole table
+        if detail.startswith('SCAN ') and ' USING ' not in detail:
+            problems.append((name, detail))
+        # Paged listings must come straight off an index, not be sorted
+        elif detail == 'USE TEMP B-TREE FOR ORDER BY' and name not in RANKED:
+            problems.append((name, detail))
+    return problems
+
+
+@pytest.fixture(scope='module')
+def checks(appmod):
+    return plan_checks(appmod)
+
+def test_hot_queries_use_indexes(db_path, checks):
+    conn = sqlite3.connect(db_path)
+    problems = [problem for check in checks for problem in plan_problems(conn, *check)]
+    conn.close()
+    assert problems == []
+
+def test_plan_check_flags_scans_and_sorts(db_path):
+    conn = sqlite3.connect(db_path)
+    assert plan_problems(conn, 'scan', 'SELECT * FROM Orders WHERE payment_method = ?', ('Cash',))
+    assert plan_problems(conn, 'sort', 'SELECT * FROM Users WHERE user_id > ? ORDER BY phone', (0,))
+    conn.close()
@@ -0,0 +1,51 @@
+import sqlite3
+
+from conftest import vendor_client
+
+
+def vendor_services(db_path, vendor_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT name, price FROM Services WHERE vendor_id = ? AND archived_at IS NULL',
+                            (vendor_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_manage_services_validates_the_form(appmod):
+    db_path = appmod.app.config['DATABASE']
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO Vendors (vendor_id, name, email, password, phone, category) "
+                 "VALUES (3, 'S', 's@x', 'p', '3', 'Catering')")
+    conn.commit()
+    conn.close()
+    client = vendor_client(appmod, 3)
+
+    response = client.post('/manage_services', data={'action': 'add', 'name': 'Buffet', 'category': 'Catering'})
+    assert response.status_code == 200
+    assert b'Name, price and category are required' in response.data
+    response = client.post('/manage_services', data={'action': 'add', 'name': 'Buffet', 'price': 'abc',
+                                                     'category': 'Catering'})
+    assert b'Price must be a number of 0 or more' in response.data
+    assert vendor_services(db_path, 3) == []
+
+    client.post('/manage_services', data={'action': 'add', 'name': 'Buffet', 'price': '100',
+                                          'category': 'Catering'})
+    assert vendor_services(db_path, 3) == [('Buffet', 100.0)]
+
+    conn = sqlite3.connect(db_path)
+    service_id, version = conn.execute('SELECT service_id, version FROM Services WHERE vendor_id = 3').fetchone()
+    conn.close()
+    response = client.post('/manage_services', data={'action': 'update', 'service_id': service_id,
+                                                     'version': version, 'name': 'Buffet', 'category': 'Catering'})
+    assert response.status_code == 200
+    assert b'Name, price and category are required' in response.data
+    assert vendor_services(db_path, 3) == [('Buffet', 100.0)]
+
+    # Without the version it was opened at, an edit could overwrite a
+    # concurrent one
+    update = {'action': 'update', 'service_id': service_id, 'name': 'Buffet', 'price': '120', 'category': 'Catering'}
+    assert client.post('/manage_services', data=update).status_code == 400
+    assert vendor_services(db_path, 3) == [('Buffet', 100.0)]
+    assert client.post('/manage_services', data=dict(update, version=version)).status_code == 200
+    assert vendor_services(db_path, 3) == [('Buffet', 120.0)]
@@ -0,0 +1,65 @@
+import sqlite3
+import time
+
+import pytest
+
+from sessions import LocalSharedStore, SessionStore, session_key
+from writer import WriteQueue
+
+
+@pytest.fixture
+def writer(db_path):
+    return WriteQueue(db_path, wait_timeout=5)
+
+@pytest.fixture
+def conn(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+def stored_keys(conn):
+    return {row[0] for row in conn.execute('SELECT session_key FROM Sessions')}
+
+
+def test_revoke_ends_every_session_of_one_account(writer, conn):
+    store = SessionStore(writer, shared=LocalSharedStore())
+    store.save('phone', {'role': 'user', 'user_id': 1})
+    store.save('laptop', {'role': 'user', 'user_id': 1})
+    store.save('other', {'role': 'user', 'user_id': 2})
+    store.save('vendor', {'role': 'vendor', 'vendor_id': 1})
+    assert store.load('phone', conn)['data'] == {'role': 'user', 'user_id': 1}
+
+    assert store.revoke('user', 1) == 2
+    # Gone from the LRU, the shared tier and SQLite
+    assert store.load('phone', conn) is None and store.load('laptop', conn) is None
+    assert store.shared.get(session_key('phone')) is None
+    assert stored_keys(conn) == {session_key('other'), session_key('vendor')}
+    assert store.load('other', conn) is not None
+
+def test_idle_and_old_sessions_expire(writer, conn):
+    SessionStore(writer).save('idle', {'role': 'user', 'user_id': 1})
+    SessionStore(writer).save('old', {'role': 'user', 'user_id': 2}, created_at=time.time() - 3600)
+    writer.execute('UPDATE Sessions SET last_seen = last_seen - 120 WHERE session_key = ?', (session_key('idle'),))
+
+    # A fresh store, so the records come from SQLite
+    store = SessionStore(writer, idle_timeout=60, max_age=1800)
+    assert store.load('idle', conn) is None
+    assert store.load('old', conn) is None
+    assert store.stats()['expired'] == 2
+    assert stored_keys(conn) == set()
+
+def test_touches_are_flushed_in_batches(writer, conn):
+    store = SessionStore(writer, idle_timeout=60, touch_interval=0)
+    store.save('active', {'role': 'user', 'user_id': 1})
+    store.save('stale', {'role': 'user', 'user_id': 2})
+    writer.execute('UPDATE Sessions SET last_seen = last_seen - 120')
+
+    # Still fresh in this process's cache
+    before = time.time()
+    store.touch('active', store.load('active', conn))
+    store.flush().result(5)
+    # The touched session slid forward; the idle one was purged
+    assert stored_keys(conn) == {session_key('active')}
+    last_seen = conn.execute('SELECT last_seen FROM Sessions').fetchone()[0]
+    assert last_seen >= before - 1
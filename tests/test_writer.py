@@ -0,0 +1,51 @@
+import sqlite3
+import threading
+
+import pytest
+
+from writer import WriteQueue, WriteQueueFull
+
+
+def add_user(conn, email):
+    return conn.execute("INSERT INTO Users (name, email, password, phone) VALUES ('U', ?, 'p', '1')",
+                        (email,)).lastrowid
+
+def commit_behind_writer(conn):
+    # Breaks the job contract: the RELEASE after it finds no transaction
+    add_user(conn, 'commits@x')
+    conn.execute('COMMIT')
+
+def user_count(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM Users').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_writer_survives_a_failed_batch(db_path):
+    writer = WriteQueue(db_path, wait_timeout=5)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.run(commit_behind_writer)
+    assert writer.run(add_user, 'after@x')
+    assert writer.stats()['failed_commits'] == 1
+    assert user_count(db_path) == 2
+
+def test_run_gives_up_after_wait_timeout(db_path):
+    writer = WriteQueue(db_path, wait_timeout=0.2)
+    started, release = threading.Event(), threading.Event()
+
+    def hold(conn):
+        started.set()
+        release.wait(5)
+
+    blocker = writer.submit(hold)
+    started.wait(5)
+    with pytest.raises(WriteQueueFull):
+        writer.run(add_user, 'late@x')
+    release.set()
+    blocker.result(5)
+    # The write that timed out was dropped, and the writer goes on
+    assert writer.run(add_user, 'next@x')
+    assert user_count(db_path) == 1
+    assert writer.stats()['timed_out'] == 1
@@ -0,0 +1,243 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from queue import Queue, Empty, Full
+
+# Single-writer queue. Every write of a worker process runs on one thread
+# that owns the process's only write connection, so request threads never
+# contend for SQLite's write lock among themselves. Jobs that queue up while
+# a transaction is committing are applied together in the next one (group
+# commit): one BEGIN IMMEDIATE/COMMIT, and one WAL sync, per batch. Each job
+# runs inside its own savepoint, so a failing job rolls back alone and its
+# exception is raised in the request that submitted it.
+#
+# A job is func(conn, *args). It must not call conn.commit()/rollback();
+# db.transaction() inside a job nests as a savepoint. Its return value is
+# handed back only after the batch has committed. run() waits at most
+# wait_timeout for it and then raises WriteQueueFull, as submit() does when
+# the queue stays full.
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'future', 'queued_at')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class WriteQueue:
+    def __init__(self, path, max_batch=64, max_pending=1024, timeout=10.0, busy_timeout=5000, wait_timeout=30.0):
+        self.path = path
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self.busy_timeout = busy_timeout
+
+        self._queue = Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.commits = 0
+        self.committed_jobs = 0
+        self.failed_commits = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_depth = 0
+        self.max_batch_seen = 0
+        self.batch_sizes = dict.fromkeys(BATCH_SIZE_BUCKETS + ('+Inf',), 0)
+        self.queue_time = 0.0
+        self.commit_time = 0.0
+
+    def _connect(self):
+        # Autocommit mode: the writer issues BEGIN/COMMIT itself
+        conn = sqlite3.connect(self.path,
+                               timeout=self.busy_timeout / 1000.0,
+                               check_same_thread=False,
+                               isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA busy_timeout = %d' % int(self.busy_timeout))
+        return conn
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                # Started lazily so a forking server (gunicorn --preload)
+                # gets one writer thread per worker, not one in the master
+                self._thread = threading.Thread(target=self._run, args=(self._connect(),),
+                                                name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args):
+        if self._thread is None:
+            self._start()
+        job = _Job(func, args)
+        try:
+            self._queue.put(job, timeout=self.timeout)
+        except Full:
+            with self._lock:
+                self.rejected += 1
+            raise WriteQueueFull('Write queue still full after %.1fs' % self.timeout)
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            with self._lock:
+                self.max_depth = max(self.max_depth, depth)
+        return job.future
+
+    def run(self, func, *args):
+        future = self.submit(func, *args)
+        try:
+            future.exception(timeout=self.wait_timeout)
+        except FutureTimeout:
+            # Dropped if the writer has not started on it yet; otherwise it
+            # may still commit
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise WriteQueueFull('Write not done after %.1fs' % self.wait_timeout)
+        return future.result()
+
+    def execute(self, sql, params=()):
+        return self.run(_execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.run(_executemany, sql, seq_of_params)
+
+    def _run(self, conn):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            # Jobs whose caller stopped waiting are skipped
+            batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            while batch:
+                try:
+                    batch = self._commit_batch(conn, batch)
+                except BaseException as e:
+                    # This thread is the process's only writer: whatever
+                    # went wrong, fail the batch and carry on
+                    self._rollback(conn)
+                    self._finish([job for job in batch if not job.future.done()], [], time.perf_counter(), error=e)
+                    batch = []
+
+    def _rollback(self, conn):
+        if conn.in_transaction:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+
+    def _commit_batch(self, conn, batch):
+        # Returns the jobs that still have to be retried in a new transaction
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            self._finish(batch, [], started, error=e)
+            return []
+
+        results = []
+        try:
+            for index, job in enumerate(batch):
+                conn.execute('SAVEPOINT job')
+                try:
+                    result = job.func(conn, *job.args)
+                except BaseException as e:
+                    if not conn.in_transaction:
+                        # The error aborted the whole transaction (e.g. disk
+                        # full), taking the earlier jobs' writes with it
+                        self._finish([job], [], started, error=e)
+                        return [done for done, _ in results] + batch[index + 1:]
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((job, e))
+                else:
+                    conn.execute('RELEASE job')
+                    results.append((job, result))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            # A SAVEPOINT, RELEASE, ROLLBACK TO or the COMMIT failed: the
+            # batch fails as a whole
+            self._rollback(conn)
+            self._finish(batch, [], started, error=e)
+            return []
+        self._finish(batch, results, started)
+        return []
+
+    def _finish(self, batch, results, started, error=None):
+        now = time.perf_counter()
+        with self._lock:
+            self.commit_time += now - started
+            self.queue_time += sum(started - job.queued_at for job in batch)
+            self.jobs += len(batch)
+            if error is not None:
+                self.failed_commits += 1
+                self.failed_jobs += len(batch)
+            else:
+                self.commits += 1
+                self.committed_jobs += len(batch)
+                self.failed_jobs += sum(1 for _, result in results if isinstance(result, BaseException))
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                bucket = next((b for b in BATCH_SIZE_BUCKETS if len(batch) <= b), '+Inf')
+                self.batch_sizes[bucket] += 1
+
+        if error is not None:
+            for job in batch:
+                job.future.set_exception(error)
+            return
+        for job, result in results:
+            if isinstance(result, BaseException):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'max_pending': self._queue.maxsize,
+                'jobs': self.jobs,
+                'failed_jobs': self.failed_jobs,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'commits': self.commits,
+                'failed_commits': self.failed_commits,
+                'avg_batch_size': round(self.committed_jobs / self.commits, 2) if self.commits else 0.0,
+                'max_batch_size': self.max_batch_seen,
+                'batch_size_histogram': {str(b): n for b, n in self.batch_sizes.items()},
+                'avg_queue_wait_seconds': round(self.queue_time / self.jobs, 6) if self.jobs else 0.0,
+                'commit_time_seconds': round(self.commit_time, 6),
+            }
+
+
+class WriteResult:
+    # What callers need from a cursor once the write has committed
+    __slots__ = ('rowcount', 'lastrowid')
+
+    def __init__(self, cursor):
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+
+def _execute(conn, sql, params):
+    return WriteResult(conn.execute(sql, params))
+
+def _executemany(conn, sql, seq_of_params):
+    return WriteResult(conn.executemany(sql, seq_of_params))